@@ -1,11 +1,17 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Callable, List, Optional, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import object_session
+from sqlalchemy.ext.asyncio import AsyncSession
 from decouple import config
+from cache import TTLCache
 from database import get_db
 from models import User
 
@@ -14,11 +20,38 @@ SECRET_KEY = config("SECRET_KEY", default="your-secret-key-here")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Authenticated-user caches (per process). Deactivations and renames reach
+# other workers over the delivery bus; with WS_BUS_URL=memory:// and several
+# workers, those keep serving a changed user for up to AUTH_USER_CACHE_TTL.
+AUTH_USER_CACHE_SIZE = config("AUTH_USER_CACHE_SIZE", default=10000, cast=int)
+AUTH_USER_CACHE_TTL = config("AUTH_USER_CACHE_TTL", default=60.0, cast=float)
+AUTH_TOKEN_CACHE_SIZE = config("AUTH_TOKEN_CACHE_SIZE", default=10000, cast=int)
+
+# Token subject (username) -> detached User
+user_cache = TTLCache(AUTH_USER_CACHE_SIZE, AUTH_USER_CACHE_TTL)
+# Encoded token -> decoded payload, kept no longer than the token is valid
+token_cache = TTLCache(AUTH_TOKEN_CACHE_SIZE, ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
 # Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+BCRYPT_ROUNDS = config("BCRYPT_ROUNDS", default=12, cast=int)
+PASSWORD_REHASH_ON_LOGIN = config("PASSWORD_REHASH_ON_LOGIN", default=False, cast=bool)
+PASSWORD_HASH_WORKERS = config("PASSWORD_HASH_WORKERS", default=2, cast=int)
+PASSWORD_HASH_MAX_PENDING = config("PASSWORD_HASH_MAX_PENDING", default=64, cast=int)
+
+# Hashes at any other cost are flagged by needs_update (rehash on login)
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
 
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
+# Attachment downloads also accept signed links (<a>, <img> can't send
+# headers), so the bearer header is optional there
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token", auto_error=False)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a plain password against its hash."""
@@ -28,6 +61,62 @@ def get_password_hash(password: str) -> str:
     """Generate password hash."""
     return pwd_context.hash(password)
 
+class PasswordHasher:
+    """Runs bcrypt on a dedicated, bounded thread pool.
+    
+    bcrypt releases the GIL, so hashing proceeds in parallel with the event
+    loop. Once max_pending operations are queued or running, new ones are
+    rejected with 503 instead of piling up.
+    """
+    
+    def __init__(self, workers: int, max_pending: int):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+    
+    async def run(self, func, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Authentication service is busy, please retry",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+    
+    async def hash(self, password: str) -> str:
+        """Hash a password off the event loop."""
+        return await self.run(get_password_hash, password)
+    
+    async def verify(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """Verify a password off the event loop.
+        
+        Returns (valid, new_hash); new_hash is set when rehashing on login is
+        enabled and the stored hash doesn't use the configured cost.
+        """
+        if PASSWORD_REHASH_ON_LOGIN:
+            return await self.run(pwd_context.verify_and_update, plain_password, hashed_password)
+        return await self.run(verify_password, plain_password, hashed_password), None
+    
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create JWT access token."""
     to_encode = data.copy()
@@ -39,35 +128,94 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def authenticate_user(db: Session, username: str, password: str):
+async def authenticate_user(db: AsyncSession, username: str, password: str):
     """Authenticate user with username and password."""
-    user = db.query(User).filter(User.username == username).first()
+    user = await db.scalar(select(User).filter(User.username == username))
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    valid, new_hash = await password_hasher.verify(password, user.hashed_password)
+    if not valid:
         return False
+    if new_hash:
+        # Opt-in upgrade of the stored hash to the configured cost
+        user.hashed_password = new_hash
+        await db.commit()
     return user
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    """Get current authenticated user from JWT token."""
+# Called after commit with each username changed by this process, so other
+# workers drop it too (websocket_manager passes it over the delivery bus)
+user_invalidation_listeners: List[Callable[[str], None]] = []
+
+def invalidate_user(username: str):
+    """Drop a user from the authenticated-user cache."""
+    user_cache.invalidate(username)
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    # Covers deactivation and renames (old username is in the history)
+    usernames = {target.username, *inspect(target).attrs.username.history.deleted}
+    for username in usernames:
+        invalidate_user(username)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("changed_usernames", set()).update(usernames)
+
+@event.listens_for(AsyncSession.sync_session_class, "after_commit")
+def _publish_changed_users(session):
+    # Again after commit: a request may have cached the old row in between
+    for username in session.info.pop("changed_usernames", ()):
+        invalidate_user(username)
+        for listener in user_invalidation_listeners:
+            listener(username)
+
+@event.listens_for(AsyncSession.sync_session_class, "after_rollback")
+def _forget_changed_users(session):
+    session.info.pop("changed_usernames", None)
+
+def decode_access_token(token: str) -> dict:
+    """Decode and verify a JWT, caching the payload until it expires.
+    
+    Raises JWTError for invalid or expired tokens.
+    """
+    payload = token_cache.get(token)
+    if payload is not None and payload.get("exp", 0) > time.time():
+        return payload
+    
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    if "exp" in payload:
+        token_cache.set(token, payload, ttl=payload["exp"] - time.time())
+    return payload
+
+async def get_user_for_token(token: str, db: AsyncSession) -> User:
+    """Resolve a JWT to its user, served from the user cache when possible."""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_access_token(token)
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
     except JWTError:
         raise credentials_exception
     
-    user = db.query(User).filter(User.username == username).first()
+    user = user_cache.get(username)
     if user is None:
-        raise credentials_exception
+        user = await db.scalar(select(User).filter(User.username == username))
+        if user is None:
+            raise credentials_exception
+        # Detach so the cached instance can be shared across sessions
+        db.expunge(user)
+        user_cache.set(username, user)
     return user
 
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+    """Get current authenticated user from JWT token."""
+    return await get_user_for_token(token, db)
+
 async def get_current_active_user(current_user: User = Depends(get_current_user)):
     """Get current active user."""
     if not current_user.is_active:
@@ -75,24 +223,16 @@ async def get_current_active_user(current_user: User = Depends(get_current_user)
     return current_user
 
 # WebSocket-specific authentication
-async def get_current_user_from_token(token: str, db: Session) -> User:
+async def get_current_user_from_token(token: str, db: AsyncSession) -> User:
     """Get current authenticated user from JWT token for WebSocket connections."""
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    
-    user = db.query(User).filter(User.username == username).first()
-    if user is None:
-        raise credentials_exception
+    user = await get_user_for_token(token, db)
     if not user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
-    return user
\ No newline at end of file
+    return user
+
+def get_auth_cache_stats() -> dict:
+    """Hit/miss counters of the authentication caches."""
+    return {
+        "users": user_cache.stats(),
+        "tokens": token_cache.stats(),
+    }
\ No newline at end of file
@@ -0,0 +1,73 @@
+"""Benchmark the authenticated-user path with and without caching.
+
+Times get_current_user (JWT decode + user lookup) on SQLite with the
+token/user caches cleared before every call versus warm caches.
+
+Run from the backend directory:
+    python -m benchmarks.auth_cache
+"""
+import asyncio
+import time
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from models import Base, User
+from auth import create_access_token, get_current_user, token_cache, user_cache
+
+CALLS = 2000
+
+
+async def build_database():
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+    async with session_factory() as db:
+        db.add(User(username="me", email="me@example.com", hashed_password="x"))
+        await db.commit()
+    return engine, session_factory
+
+
+async def measure(engine, session_factory, token: str, cached: bool):
+    queries = 0
+
+    def count_query(*args):
+        nonlocal queries
+        queries += 1
+
+    event.listen(engine.sync_engine, "before_cursor_execute", count_query)
+    timings = []
+    for _ in range(CALLS):
+        if not cached:
+            token_cache.clear()
+            user_cache.clear()
+        async with session_factory() as db:
+            start = time.perf_counter()
+            await get_current_user(token=token, db=db)
+            timings.append(time.perf_counter() - start)
+    event.remove(engine.sync_engine, "before_cursor_execute", count_query)
+
+    timings.sort()
+    return {
+        "mean_us": sum(timings) / len(timings) * 1e6,
+        "p99_us": timings[int(len(timings) * 0.99)] * 1e6,
+        "queries": queries,
+    }
+
+
+async def main():
+    engine, session_factory = await build_database()
+    token = create_access_token({"sub": "me"})
+
+    print(f"{'mode':>8} {'mean us':>10} {'p99 us':>10} {'queries':>8}")
+    for name, cached in (("uncached", False), ("cached", True)):
+        result = await measure(engine, session_factory, token, cached)
+        print(f"{name:>8} {result['mean_us']:>10.1f} {result['p99_us']:>10.1f} {result['queries']:>8}")
+    print(f"user cache: {user_cache.stats()}")
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
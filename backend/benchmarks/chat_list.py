@@ -0,0 +1,152 @@
+"""Benchmark GET /messages/chats query count and latency.
+
+Compares the previous per-partner implementation (2N+1 queries) with
+routes.messages.get_user_chats, which reads the conversations table.
+
+Run from the backend directory:
+    python -m benchmarks.chat_list
+"""
+import asyncio
+import time
+from sqlalchemy import event, or_, and_, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from models import Base, User, Message
+from schemas import ChatResponse
+from routes.messages import get_user_chats
+from conversations import backfill_conversations
+from serialization import loads
+
+PARTNER_COUNTS = [10, 100, 1000]
+MESSAGES_PER_PARTNER = 5
+ROUNDS = 5
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine.sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def legacy_get_user_chats(db, current_user: User):
+    """Chat list as it was built before conversation summaries.
+
+    Runs on the synchronous session behind AsyncSession.run_sync.
+    """
+    chat_users = db.query(User).filter(
+        or_(
+            User.id.in_(
+                db.query(Message.sender_id).filter(Message.recipient_id == current_user.id)
+            ),
+            User.id.in_(
+                db.query(Message.recipient_id).filter(Message.sender_id == current_user.id)
+            )
+        ),
+        User.id != current_user.id
+    ).all()
+
+    chats = []
+    for user in chat_users:
+        last_message = db.query(Message).filter(
+            or_(
+                and_(Message.sender_id == current_user.id, Message.recipient_id == user.id),
+                and_(Message.sender_id == user.id, Message.recipient_id == current_user.id)
+            ),
+            Message.is_deleted == False
+        ).order_by(Message.created_at.desc()).first()
+
+        unread_count = db.query(Message).filter(
+            Message.sender_id == user.id,
+            Message.recipient_id == current_user.id
+        ).count()
+
+        chats.append(ChatResponse(
+            user=user,
+            last_message=last_message,
+            unread_count=unread_count
+        ))
+
+    return chats
+
+
+async def build_database(partner_count: int):
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+    db = session_factory()
+    me = User(username="me", email="me@example.com", hashed_password="x")
+    db.add(me)
+    await db.flush()
+
+    partners = [
+        User(username=f"user{i}", email=f"user{i}@example.com", hashed_password="x")
+        for i in range(partner_count)
+    ]
+    db.add_all(partners)
+    await db.flush()
+
+    messages = []
+    for partner in partners:
+        for i in range(MESSAGES_PER_PARTNER):
+            sender, recipient = (me, partner) if i % 2 else (partner, me)
+            messages.append(Message(
+                content=f"message {i}",
+                sender_id=sender.id,
+                recipient_id=recipient.id
+            ))
+    db.add_all(messages)
+    await db.commit()
+    await backfill_conversations(db)
+    await db.close()
+
+    return engine, session_factory
+
+
+async def run_legacy(db, current_user):
+    chats = await db.run_sync(legacy_get_user_chats, current_user)
+    # Serialize as FastAPI would; unloaded relationships would fail here
+    return [chat.model_dump() for chat in chats]
+
+
+async def run_summary(db, current_user):
+    # The route returns the encoded response
+    response = await get_user_chats(current_user=current_user, db=db)
+    return loads(response.body)
+
+
+async def measure(engine, session_factory, implementation):
+    counter = QueryCounter(engine)
+    timings = []
+    queries = 0
+    for _ in range(ROUNDS):
+        async with session_factory() as db:
+            current_user = await db.scalar(select(User).filter(User.username == "me"))
+            counter.count = 0
+            start = time.perf_counter()
+            chats = await implementation(db, current_user)
+            timings.append(time.perf_counter() - start)
+            queries = counter.count
+    return queries, min(timings) * 1000, len(chats)
+
+
+async def main():
+    print(f"{'partners':>8} {'impl':>10} {'queries':>8} {'best ms':>10} {'chats':>6}")
+    for partner_count in PARTNER_COUNTS:
+        engine, session_factory = await build_database(partner_count)
+        for name, implementation in (
+            ("legacy", run_legacy),
+            ("summary", run_summary),
+        ):
+            queries, best_ms, chats = await measure(engine, session_factory, implementation)
+            print(f"{partner_count:>8} {name:>10} {queries:>8} {best_ms:>10.2f} {chats:>6}")
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
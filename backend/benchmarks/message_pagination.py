@@ -0,0 +1,99 @@
+"""Benchmark conversation history paging: offset vs keyset cursor.
+
+Loads one conversation with MESSAGE_COUNT messages into SQLite and times
+GET /messages/{user_id} pages at increasing depth with skip/limit and with
+before_id.
+
+Run from the backend directory:
+    python -m benchmarks.message_pagination [message_count]
+"""
+import asyncio
+import sys
+import time
+from datetime import datetime, timedelta
+from fastapi import Response
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from models import Base, User, Message, Conversation
+from routes.messages import get_messages_with_user
+from serialization import loads
+
+MESSAGE_COUNT = 1_000_000
+PAGE_SIZE = 50
+ROUNDS = 5
+BATCH_SIZE = 50_000
+
+
+async def build_database(message_count: int):
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+    db = session_factory()
+    me = User(username="me", email="me@example.com", hashed_password="x")
+    partner = User(username="partner", email="partner@example.com", hashed_password="x")
+    db.add_all([me, partner])
+    await db.flush()
+    conversation = Conversation(user_a_id=me.id, user_b_id=partner.id)
+    db.add(conversation)
+    await db.commit()
+
+    start = datetime(2024, 1, 1)
+    for offset in range(0, message_count, BATCH_SIZE):
+        rows = []
+        for i in range(offset, min(offset + BATCH_SIZE, message_count)):
+            sender_id, recipient_id = (me.id, partner.id) if i % 2 else (partner.id, me.id)
+            rows.append({
+                "content": f"message {i}",
+                "sender_id": sender_id,
+                "recipient_id": recipient_id,
+                "conversation_id": conversation.id,
+                "created_at": start + timedelta(seconds=i),
+                "is_edited": False,
+                "is_deleted": False,
+            })
+        await db.execute(insert(Message), rows)
+    await db.commit()
+    await db.close()
+
+    return session_factory, me.id, partner.id
+
+
+async def time_page(session_factory, me_id, **params):
+    timings = []
+    for _ in range(ROUNDS):
+        async with session_factory() as db:
+            current_user = await db.get(User, me_id)
+            start = time.perf_counter()
+            page = await get_messages_with_user(
+                response=Response(),
+                current_user=current_user,
+                db=db,
+                limit=PAGE_SIZE,
+                **params
+            )
+            timings.append(time.perf_counter() - start)
+    assert len(loads(page.body)) == PAGE_SIZE
+    return min(timings) * 1000
+
+
+async def main():
+    message_count = int(sys.argv[1]) if len(sys.argv) > 1 else MESSAGE_COUNT
+    print(f"Loading {message_count} messages...")
+    session_factory, me_id, partner_id = await build_database(message_count)
+
+    depths = [0, 1_000, 10_000, 100_000, message_count // 2, message_count - PAGE_SIZE - 1]
+    print(f"{'depth':>10} {'offset ms':>10} {'keyset ms':>10}")
+    for depth in sorted(set(d for d in depths if d < message_count - PAGE_SIZE)):
+        offset_ms = await time_page(session_factory, me_id, user_id=partner_id, skip=depth)
+        # Ids follow created_at, so the newest-first row at `depth` has this id
+        anchor_id = message_count - depth
+        keyset_ms = await time_page(session_factory, me_id, user_id=partner_id, before_id=anchor_id)
+        print(f"{depth:>10} {offset_ms:>10.2f} {keyset_ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,133 @@
+"""Benchmark message full-text search and its cost on the send path.
+
+Times messaging.create_message (what POST /messages/ and the WebSocket
+send_message run) with the messages_search FTS5 triggers in place and
+with them dropped, then loads MESSAGE_COUNT messages into SQLite and
+times message_search.search_messages for common, rare and missing words.
+
+Run from the backend directory:
+    python -m benchmarks.message_search [message_count]
+"""
+import asyncio
+import random
+import sys
+import time
+from sqlalchemy import insert, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from models import Base, User, Message
+from messaging import create_message
+from message_search import search_messages
+
+MESSAGE_COUNT = 200_000
+SENDS = 2000
+SEARCHES = 200
+PAGE_SIZE = 20
+BATCH_SIZE = 50_000
+
+WORDS = ("hello meeting lunch tomorrow project deadline coffee weekend report call "
+         "review budget design launch invoice travel dinner update plan notes").split()
+
+
+def sentence(rng: random.Random, index: int) -> str:
+    # A unique token per message gives searches with exactly one hit
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 12))) + f" ref{index}"
+
+
+async def build_database():
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+    async with session_factory() as db:
+        me = User(username="me", email="me@example.com", hashed_password="x")
+        partner = User(username="partner", email="partner@example.com", hashed_password="x")
+        db.add_all([me, partner])
+        await db.commit()
+    return engine, session_factory, me.id, partner.id
+
+
+async def time_sends(session_factory, me_id: int, partner_id: int, rng: random.Random) -> dict:
+    timings = []
+    async with session_factory() as db:
+        partner = await db.get(User, partner_id)
+        for i in range(SENDS):
+            start = time.perf_counter()
+            await create_message(db, me_id, partner, sentence(rng, i))
+            timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        "p50_ms": timings[len(timings) // 2] * 1000,
+        "p99_ms": timings[int(len(timings) * 0.99)] * 1000,
+    }
+
+
+async def load_history(session_factory, me_id: int, partner_id: int, message_count: int, rng: random.Random):
+    async with session_factory() as db:
+        conversation_id = (await db.execute(text("SELECT id FROM conversations"))).scalar()
+        for offset in range(0, message_count, BATCH_SIZE):
+            await db.execute(insert(Message), [
+                {
+                    "content": sentence(rng, i),
+                    "sender_id": me_id if i % 2 else partner_id,
+                    "recipient_id": partner_id if i % 2 else me_id,
+                    "conversation_id": conversation_id,
+                    "is_edited": False,
+                    "is_deleted": False,
+                } for i in range(offset, min(offset + BATCH_SIZE, message_count))
+            ])
+        await db.commit()
+
+
+async def time_searches(session_factory, me_id: int, queries: list) -> dict:
+    timings = []
+    async with session_factory() as db:
+        for query in queries:
+            start = time.perf_counter()
+            await search_messages(db, me_id, query, PAGE_SIZE)
+            timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        "p50_ms": timings[len(timings) // 2] * 1000,
+        "p99_ms": timings[min(int(len(timings) * 0.99), len(timings) - 1)] * 1000,
+    }
+
+
+async def main():
+    message_count = int(sys.argv[1]) if len(sys.argv) > 1 else MESSAGE_COUNT
+    rng = random.Random(42)
+
+    print(f"{'send path':>22} {'p50 ms':>10} {'p99 ms':>10}")
+    for indexed in (False, True):
+        engine, session_factory, me_id, partner_id = await build_database()
+        if not indexed:
+            async with engine.begin() as conn:
+                await conn.execute(text("DROP TRIGGER messages_search_ai"))
+        result = await time_sends(session_factory, me_id, partner_id, rng)
+        name = "with search index" if indexed else "without search index"
+        print(f"{name:>22} {result['p50_ms']:>10.3f} {result['p99_ms']:>10.3f}")
+        if not indexed:
+            await engine.dispose()
+
+    start = time.perf_counter()
+    await load_history(session_factory, me_id, partner_id, message_count, rng)
+    print(f"\nLoaded {message_count} messages in {time.perf_counter() - start:.1f}s")
+
+    queries = {
+        "common word": [rng.choice(WORDS) for _ in range(SEARCHES)],
+        "two words": [f"{rng.choice(WORDS)} {rng.choice(WORDS)}" for _ in range(SEARCHES)],
+        "rare token": [f"ref{rng.randrange(message_count)}" for _ in range(SEARCHES)],
+        "no match": [f"missing{i}" for i in range(SEARCHES)],
+    }
+    print(f"{'search':>22} {'p50 ms':>10} {'p99 ms':>10}")
+    for name, kind_queries in queries.items():
+        result = await time_searches(session_factory, me_id, kind_queries)
+        print(f"{name:>22} {result['p50_ms']:>10.3f} {result['p99_ms']:>10.3f}")
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
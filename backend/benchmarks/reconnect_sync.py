@@ -0,0 +1,114 @@
+"""Benchmark the cost of a client reconnect: full reload vs event log delta.
+
+Sends history and then a few "missed" messages through
+messaging.create_message (which logs each recipient event), then compares
+what a reconnecting client costs the server: reloading GET /messages/chats
+plus its open conversations, against messaging.sync_events from the last
+seq it applied (GET /sync and the WebSocket resume frame). Reports
+queries, latency and response bytes per reconnect.
+
+Run from the backend directory:
+    python -m benchmarks.reconnect_sync
+"""
+import asyncio
+import time
+from fastapi import Response
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from models import Base, User
+from messaging import create_message, sync_events
+from routes.messages import get_user_chats, get_messages_with_user
+from serialization import json_response
+
+PARTNER_COUNT = 50
+MESSAGES_PER_PARTNER = 20
+OPEN_CONVERSATIONS = 5
+MISSED_MESSAGES = [1, 10, 100]
+RECONNECTS = 50
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine.sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+async def build_database():
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+    async with session_factory() as db:
+        me = User(username="me", email="me@example.com", hashed_password="x")
+        partners = [
+            User(username=f"partner{i}", email=f"partner{i}@example.com", hashed_password="x")
+            for i in range(PARTNER_COUNT)
+        ]
+        db.add_all([me, *partners])
+        await db.commit()
+        for partner in partners:
+            for i in range(MESSAGES_PER_PARTNER):
+                await create_message(db, partner.id, me, f"message {i} from {partner.username}")
+    return engine, session_factory, me, partners
+
+
+async def full_reload(db, me: User, partners: list) -> int:
+    size = len((await get_user_chats(current_user=me, db=db)).body)
+    for partner in partners[:OPEN_CONVERSATIONS]:
+        size += len((await get_messages_with_user(partner.id, Response(), current_user=me, db=db)).body)
+    return size
+
+
+async def delta_sync(db, me: User, since: int) -> int:
+    return len(json_response(await sync_events(db, me.id, since)).body)
+
+
+async def measure(session_factory, counter: QueryCounter, reconnect) -> dict:
+    timings = []
+    async with session_factory() as db:
+        counter.count = 0
+        size = await reconnect(db)
+        queries = counter.count
+        for _ in range(RECONNECTS):
+            start = time.perf_counter()
+            await reconnect(db)
+            timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        "queries": queries,
+        "bytes": size,
+        "p50_ms": timings[len(timings) // 2] * 1000,
+    }
+
+
+async def main():
+    engine, session_factory, me, partners = await build_database()
+    counter = QueryCounter(engine)
+
+    print(f"{PARTNER_COUNT} chats x {MESSAGES_PER_PARTNER} messages, {OPEN_CONVERSATIONS} open conversations")
+    print(f"{'missed':>8} {'mode':>12} {'queries':>8} {'bytes':>10} {'p50 ms':>10}")
+    for missed in MISSED_MESSAGES:
+        async with session_factory() as db:
+            since = await db.scalar(select(User.event_seq).where(User.id == me.id))
+            for i in range(missed):
+                await create_message(db, partners[i % PARTNER_COUNT].id, me, f"missed message {i}")
+
+        modes = (
+            ("full reload", lambda db: full_reload(db, me, partners)),
+            ("sync delta", lambda db: delta_sync(db, me, since)),
+        )
+        for mode, reconnect in modes:
+            result = await measure(session_factory, counter, reconnect)
+            print(f"{missed:>8} {mode:>12} {result['queries']:>8} {result['bytes']:>10} {result['p50_ms']:>10.2f}")
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,187 @@
+"""Micro-benchmarks of response and WebSocket frame encoding.
+
+Encodes in-memory rows (no database) the previous way and through
+serialization.py, reporting microseconds per encode and the speedup:
+
+- 50-message page: FastAPI response_model validation of List[MessageResponse],
+  then stdlib json, vs compiled serializers and orjson
+- chat list: ChatResponse models built in the route and validated again,
+  vs plain dicts and orjson
+- new_message event: the hand-built WebSocket dict and json.dumps, vs the
+  shared message serializer and orjson
+
+Each case is also timed with the encoded message and user fragment cache
+warm, and the cache's memory use per entry is printed for sizing
+MESSAGE_FRAGMENT_CACHE_BYTES and USER_FRAGMENT_CACHE_BYTES.
+
+Run from the backend directory:
+    python -m benchmarks.serialization
+"""
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List
+from pydantic import TypeAdapter
+
+from models import User, Message, MessageAttachment
+from schemas import ChatResponse, MessageResponse
+from event_log import NEW_MESSAGE
+from messaging import event_frame
+from serialization import (
+    dumps,
+    json_response,
+    serialize_message,
+    serialize_user,
+    message_fragment,
+    user_fragment,
+    get_fragment_cache_stats
+)
+
+PAGE_SIZE = 50
+CHAT_COUNT = 50
+ATTACHMENT_EVERY = 5
+MIN_SECONDS = 1.0
+
+
+def build_rows():
+    now = datetime.now(timezone.utc)
+    me = User(id=1, username="me", email="me@example.com", is_active=True, created_at=now)
+    partners = [
+        User(id=i + 2, username=f"partner{i}", email=f"partner{i}@example.com", is_active=True, created_at=now)
+        for i in range(CHAT_COUNT)
+    ]
+    messages = []
+    for i in range(PAGE_SIZE):
+        sender, recipient = (me, partners[0]) if i % 2 else (partners[0], me)
+        message = Message(
+            id=i + 1, content=f"message {i} " + "lorem ipsum " * 8,
+            sender_id=sender.id, recipient_id=recipient.id, sender=sender, recipient=recipient,
+            created_at=now - timedelta(minutes=PAGE_SIZE - i), updated_at=None,
+            is_edited=False, is_deleted=False
+        )
+        message.attachments = [
+            MessageAttachment(
+                id=i + 1, filename=f"{i}.png", original_filename=f"photo{i}.png", file_size=123456,
+                content_type="image/png", uploaded_at=now, thumbnail_status="ready",
+                thumbnail_width=320, thumbnail_height=240
+            )
+        ] if i % ATTACHMENT_EVERY == 0 else []
+        messages.append(message)
+    last_messages = [
+        Message(
+            id=1000 + i, content="see you tomorrow", sender_id=partner.id, recipient_id=me.id,
+            sender=partner, recipient=me, created_at=now, updated_at=None,
+            is_edited=False, is_deleted=False, attachments=[]
+        ) for i, partner in enumerate(partners)
+    ]
+    return me, partners, messages, last_messages
+
+
+def stdlib_render(content) -> bytes:
+    # starlette.responses.JSONResponse.render
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def legacy_websocket_message(db_message: Message, sender: User, recipient: User) -> dict:
+    """The hand-built WebSocket message dict used before serialization.py."""
+    return {
+        "id": db_message.id,
+        "content": db_message.content,
+        "sender_id": db_message.sender_id,
+        "recipient_id": db_message.recipient_id,
+        "created_at": db_message.created_at.isoformat(),
+        "updated_at": db_message.updated_at.isoformat() if db_message.updated_at else None,
+        "is_edited": db_message.is_edited,
+        "is_deleted": db_message.is_deleted,
+        "sender": {
+            "id": sender.id,
+            "username": sender.username,
+            "email": sender.email,
+            "is_active": sender.is_active,
+            "created_at": sender.created_at.isoformat()
+        },
+        "recipient": {
+            "id": recipient.id,
+            "username": recipient.username,
+            "email": recipient.email,
+            "is_active": recipient.is_active,
+            "created_at": recipient.created_at.isoformat()
+        },
+        "attachments": [
+            {
+                "id": att.id,
+                "filename": att.filename,
+                "original_filename": att.original_filename,
+                "file_size": att.file_size,
+                "content_type": att.content_type,
+                "uploaded_at": att.uploaded_at.isoformat()
+            } for att in db_message.attachments
+        ]
+    }
+
+
+def time_per_call(encode) -> float:
+    """Microseconds per call, repeated for at least MIN_SECONDS."""
+    calls = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < MIN_SECONDS:
+        for _ in range(100):
+            encode()
+        calls += 100
+        elapsed = time.perf_counter() - start
+    return elapsed / calls * 1_000_000
+
+
+def main():
+    me, partners, messages, last_messages = build_rows()
+    message_page = TypeAdapter(List[MessageResponse])
+    chat_list = TypeAdapter(List[ChatResponse])
+
+    cases = {
+        f"{PAGE_SIZE}-message page": (
+            lambda: stdlib_render(message_page.dump_python(
+                message_page.validate_python(messages, from_attributes=True), mode="json"
+            )),
+            lambda: json_response([serialize_message(message) for message in messages]).body,
+            lambda: json_response([message_fragment(message) for message in messages]).body,
+        ),
+        f"{CHAT_COUNT}-chat list": (
+            lambda: stdlib_render(chat_list.dump_python(chat_list.validate_python([
+                ChatResponse(user=partner, last_message=message, unread_count=3).model_dump()
+                for partner, message in zip(partners, last_messages)
+            ]), mode="json")),
+            lambda: json_response([
+                {"user": serialize_user(partner), "last_message": serialize_message(message), "unread_count": 3}
+                for partner, message in zip(partners, last_messages)
+            ]).body,
+            lambda: json_response([
+                {"user": user_fragment(partner), "last_message": message_fragment(message), "unread_count": 3}
+                for partner, message in zip(partners, last_messages)
+            ]).body,
+        ),
+        "new_message event": (
+            lambda: json.dumps({
+                "type": "new_message",
+                "message": legacy_websocket_message(messages[0], messages[0].sender, messages[0].recipient)
+            }),
+            lambda: dumps(event_frame(NEW_MESSAGE, 1, messages[0].id, serialize_message(messages[0]))),
+            lambda: dumps(event_frame(NEW_MESSAGE, 1, messages[0].id, message_fragment(messages[0]))),
+        ),
+    }
+
+    print(f"{'case':>20} {'before us':>10} {'after us':>10} {'cached us':>10} {'speedup':>8}")
+    for name, (before, after, cached) in cases.items():
+        before_us = time_per_call(before)
+        after_us = time_per_call(after)
+        cached_us = time_per_call(cached)
+        print(f"{name:>20} {before_us:>10.1f} {after_us:>10.1f} {cached_us:>10.1f} {before_us / cached_us:>7.1f}x")
+
+    print()
+    for name, stats in get_fragment_cache_stats().items():
+        per_entry = stats["bytes"] / stats["size"] if stats["size"] else 0
+        print(f"{name} cache: {stats['size']} entries, {stats['bytes']} bytes ({per_entry:.0f} per entry), hit rate {stats['hit_rate']:.2%}")
+
+
+if __name__ == "__main__":
+    main()
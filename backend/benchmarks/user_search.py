@@ -0,0 +1,108 @@
+"""Benchmark user search: ILIKE '%q%' scan vs the ranked, indexed search.
+
+Loads USER_COUNT users into SQLite (username indexes and the FTS5 trigram
+table are created with the schema) and times the previous ILIKE query
+against user_search.search_users for exact, prefix, substring and rare
+queries, reporting p50/p99 per kind.
+
+Run from the backend directory:
+    python -m benchmarks.user_search [user_count]
+"""
+import asyncio
+import random
+import sys
+import time
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from models import Base, User
+from user_search import search_users
+
+USER_COUNT = 1_000_000
+QUERIES_PER_KIND = 200
+LIMIT = 10
+BATCH_SIZE = 50_000
+
+SYLLABLES = ["ka", "lo", "mi", "ra", "te", "no", "su", "vi", "da", "el", "or", "an", "is", "yu", "be", "zo"]
+
+
+def make_username(rng: random.Random, index: int) -> str:
+    word = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+    return f"{word}_{index}"
+
+
+async def build_database(user_count: int):
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+    rng = random.Random(42)
+    usernames = [make_username(rng, i) for i in range(user_count)]
+    async with session_factory() as db:
+        for start in range(0, user_count, BATCH_SIZE):
+            await db.execute(insert(User), [
+                {"username": name, "email": f"{name}@example.com", "hashed_password": "x", "is_active": True}
+                for name in usernames[start:start + BATCH_SIZE]
+            ])
+        await db.commit()
+    return engine, session_factory, usernames
+
+
+def build_queries(rng: random.Random, usernames: list) -> dict:
+    sample = rng.sample(usernames, QUERIES_PER_KIND)
+    return {
+        "exact": sample,
+        "prefix": [name[:3] for name in sample],
+        "substring": [name[2:6] for name in sample],
+        # Few matches: the scan has to read every row to fill the page
+        "rare": [name[-5:] for name in sample],
+    }
+
+
+async def legacy_search(db, query: str):
+    return (await db.scalars(select(User).filter(
+        User.username.ilike(f"%{query}%"),
+        User.id != 0,
+        User.is_active == True
+    ).limit(LIMIT))).all()
+
+
+async def indexed_search(db, query: str):
+    users, _ = await search_users(db, query, LIMIT, 0)
+    return users
+
+
+async def measure(session_factory, search, queries: list) -> dict:
+    timings = []
+    async with session_factory() as db:
+        for query in queries:
+            start = time.perf_counter()
+            await search(db, query)
+            timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        "p50_ms": timings[len(timings) // 2] * 1000,
+        "p99_ms": timings[min(int(len(timings) * 0.99), len(timings) - 1)] * 1000,
+    }
+
+
+async def main():
+    user_count = int(sys.argv[1]) if len(sys.argv) > 1 else USER_COUNT
+    start = time.perf_counter()
+    engine, session_factory, usernames = await build_database(user_count)
+    print(f"Loaded {user_count} users in {time.perf_counter() - start:.1f}s")
+
+    queries = build_queries(random.Random(7), usernames)
+    print(f"{'kind':>10} {'mode':>8} {'p50 ms':>10} {'p99 ms':>10}")
+    for kind, kind_queries in queries.items():
+        for mode, search in (("ilike", legacy_search), ("indexed", indexed_search)):
+            result = await measure(session_factory, search, kind_queries)
+            print(f"{kind:>10} {mode:>8} {result['p50_ms']:>10.2f} {result['p99_ms']:>10.2f}")
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
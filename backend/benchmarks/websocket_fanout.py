@@ -0,0 +1,130 @@
+"""Benchmark WebSocket fan-out to many sockets with one slow client.
+
+Broadcasts events to 10k in-memory sockets, one of which takes
+SLOW_DELAY seconds per frame, and times how long it takes until every
+other socket has received the event. Compares the previous serial
+fan-out (encode and await per socket) with ConnectionManager's
+encode-once, per-connection queues under each slow-consumer policy.
+
+Run from the backend directory:
+    python -m benchmarks.websocket_fanout
+"""
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+from websocket_manager import ConnectionManager
+
+SOCKETS = 10_000
+SLOW_DELAY = 0.2
+LEGACY_EVENTS = 3
+EVENTS = 200
+QUEUE_SIZE = 64
+
+
+class FakeWebSocket:
+    """Stands in for a client; the slow one stalls on every send."""
+
+    def __init__(self, delay: float, tracker: "Tracker"):
+        self.delay = delay
+        self.tracker = tracker
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        # Yield like a real transport write would
+        await asyncio.sleep(self.delay)
+        if not self.delay:
+            self.tracker.received()
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        pass
+
+
+class Tracker:
+    """Signals once every fast socket received the current event."""
+
+    def __init__(self, expected: int):
+        self.expected = expected
+        self.count = 0
+        self.done = asyncio.Event()
+
+    def reset(self):
+        self.count = 0
+        self.done.clear()
+
+    def received(self):
+        self.count += 1
+        if self.count >= self.expected:
+            self.done.set()
+
+
+def build_sockets(tracker: Tracker):
+    # The slow client comes first, the worst case for serial delivery
+    return [FakeWebSocket(SLOW_DELAY if i == 0 else 0, tracker) for i in range(SOCKETS)]
+
+
+def event(seq: int) -> dict:
+    return {"type": "new_message", "message": {"id": seq, "content": "hello " * 10, "sender_id": 1}}
+
+
+def summarize(name: str, timings: list, extra: str = ""):
+    timings.sort()
+    p50 = timings[len(timings) // 2] * 1000
+    p99 = timings[min(int(len(timings) * 0.99), len(timings) - 1)] * 1000
+    print(f"{name:>22} {len(timings):>7} {p50:>10.1f} {p99:>10.1f}  {extra}")
+
+
+async def legacy_fanout():
+    tracker = Tracker(SOCKETS - 1)
+    sockets = build_sockets(tracker)
+    timings = []
+    for seq in range(LEGACY_EVENTS):
+        tracker.reset()
+        start = time.perf_counter()
+        for websocket in sockets:
+            await websocket.send_text(json.dumps(event(seq)))
+        await tracker.done.wait()
+        timings.append(time.perf_counter() - start)
+    summarize("serial (previous)", timings)
+
+
+async def queued_fanout(policy: str):
+    tracker = Tracker(SOCKETS - 1)
+    manager = ConnectionManager(queue_size=QUEUE_SIZE, policy=policy)
+    for i, websocket in enumerate(build_sockets(tracker)):
+        await manager.connect(websocket, SimpleNamespace(id=i, username=f"user{i}"))
+    # Let the connection_status frames drain
+    await asyncio.sleep(SLOW_DELAY * 2)
+
+    user_ids = list(range(SOCKETS))
+    timings = []
+    for seq in range(EVENTS):
+        tracker.reset()
+        start = time.perf_counter()
+        await manager.broadcast_to_users(event(seq), user_ids)
+        await tracker.done.wait()
+        timings.append(time.perf_counter() - start)
+
+    stats = manager.stats()
+    summarize(
+        f"queued ({policy})", timings,
+        f"dropped={stats['frames_dropped']} disconnects={stats['slow_disconnects']} "
+        f"max_depth={stats['max_queue_depth']}"
+    )
+    for websocket in list(manager.connections):
+        manager.disconnect(websocket)
+
+
+async def main():
+    print(f"{SOCKETS} sockets, one taking {SLOW_DELAY * 1000:.0f} ms per frame, queue size {QUEUE_SIZE}")
+    print(f"{'mode':>22} {'events':>7} {'p50 ms':>10} {'p99 ms':>10}")
+    await legacy_fanout()
+    for policy in ("drop", "coalesce", "disconnect"):
+        await queued_fanout(policy)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,257 @@
+from typing import Tuple
+from sqlalchemy import and_, case, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Conversation, Message
+
+
+def conversation_pair(user_id: int, other_user_id: int) -> Tuple[int, int]:
+    """Return the ordered (user_a_id, user_b_id) key of a conversation."""
+    return min(user_id, other_user_id), max(user_id, other_user_id)
+
+
+def unread_column(conversation_user_a_id: int, user_id: int):
+    """Column holding the unread counter of user_id in a conversation."""
+    return Conversation.unread_a if user_id == conversation_user_a_id else Conversation.unread_b
+
+
+def read_watermark_column(conversation_user_a_id: int, user_id: int):
+    """Column holding the read watermark of user_id in a conversation."""
+    return Conversation.last_read_a_id if user_id == conversation_user_a_id else Conversation.last_read_b_id
+
+
+def get_partner_id(conversation: Conversation, user_id: int) -> int:
+    """Get the other participant of a conversation."""
+    return conversation.user_b_id if conversation.user_a_id == user_id else conversation.user_a_id
+
+
+def get_unread_count(conversation: Conversation, user_id: int) -> int:
+    """Get the number of messages user_id has not read in a conversation."""
+    return conversation.unread_a if conversation.user_a_id == user_id else conversation.unread_b
+
+
+async def get_conversation(db: AsyncSession, user_id: int, other_user_id: int):
+    """Get conversation between two users, if any."""
+    user_a_id, user_b_id = conversation_pair(user_id, other_user_id)
+    return await db.scalar(select(Conversation).filter(
+        Conversation.user_a_id == user_a_id,
+        Conversation.user_b_id == user_b_id
+    ))
+
+
+async def get_or_create_conversation(db: AsyncSession, user_id: int, other_user_id: int) -> Conversation:
+    """Get conversation between two users, creating it on first message."""
+    conversation = await get_conversation(db, user_id, other_user_id)
+    if conversation:
+        return conversation
+
+    user_a_id, user_b_id = conversation_pair(user_id, other_user_id)
+    try:
+        # Savepoint so a concurrent insert of the same pair doesn't abort the caller
+        async with db.begin_nested():
+            conversation = Conversation(user_a_id=user_a_id, user_b_id=user_b_id)
+            db.add(conversation)
+    except IntegrityError:
+        conversation = await get_conversation(db, user_id, other_user_id)
+    return conversation
+
+
+async def get_message_conversation(db: AsyncSession, message: Message):
+    """Get conversation a message belongs to."""
+    if message.conversation_id is not None:
+        return await db.get(Conversation, message.conversation_id)
+    return await get_conversation(db, message.sender_id, message.recipient_id)
+
+
+def _last_visible_message_id(conversation: Conversation):
+    return select(Message.id).filter(
+        Message.conversation_id == conversation.id,
+        Message.is_deleted == False
+    ).order_by(Message.created_at.desc(), Message.id.desc()).limit(1).scalar_subquery()
+
+
+async def record_message_sent(db: AsyncSession, message: Message) -> Conversation:
+    """Update conversation summary for a new (flushed) message."""
+    if message.conversation_id is not None:
+        conversation = await db.get(Conversation, message.conversation_id)
+    else:
+        conversation = await get_or_create_conversation(db, message.sender_id, message.recipient_id)
+        message.conversation_id = conversation.id
+    counter = unread_column(conversation.user_a_id, message.recipient_id)
+
+    conversation.last_message_id = message.id
+    conversation.last_activity_at = func.now()
+    # Increment in SQL so concurrent senders don't lose updates
+    setattr(conversation, counter.key, counter + 1)
+    return conversation
+
+
+async def record_message_updated(db: AsyncSession, message: Message):
+    """Update conversation summary for an edited message."""
+    conversation = await get_message_conversation(db, message)
+    if conversation and conversation.last_message_id == message.id:
+        conversation.updated_at = func.now()
+    return conversation
+
+
+async def record_message_deleted(db: AsyncSession, message: Message):
+    """Update conversation summary for a (soft) deleted message."""
+    conversation = await get_message_conversation(db, message)
+    if not conversation:
+        return None
+
+    # Only messages past the recipient's read watermark are counted as unread
+    watermark = getattr(conversation, read_watermark_column(conversation.user_a_id, message.recipient_id).key)
+    if watermark is None or message.id > watermark:
+        counter = unread_column(conversation.user_a_id, message.recipient_id)
+        setattr(conversation, counter.key, case((counter > 0, counter - 1), else_=0))
+
+    if conversation.last_message_id == message.id:
+        await db.flush()
+        conversation.last_message_id = _last_visible_message_id(conversation)
+    return conversation
+
+
+async def advance_read_watermark(db: AsyncSession, reader_id: int, partner_id: int, message_id: int) -> bool:
+    """Move reader's read watermark forward and recount their unread messages.
+
+    message_id comes from the client, so it is clamped to the latest message
+    the partner actually sent the reader; an id from the future or from
+    another conversation can't hide messages that arrive later. Watermarks
+    never move backwards. Returns whether the conversation was updated.
+    """
+    user_a_id, user_b_id = conversation_pair(reader_id, partner_id)
+    watermark = read_watermark_column(user_a_id, reader_id)
+    counter = unread_column(user_a_id, reader_id)
+
+    # Max over the (sender_id, recipient_id, id) index
+    latest_id = await db.scalar(select(func.max(Message.id)).where(
+        Message.sender_id == partner_id,
+        Message.recipient_id == reader_id
+    ))
+    if latest_id is None:
+        return False
+    message_id = min(message_id, latest_id)
+
+    # Indexed range count on (sender_id, recipient_id, id)
+    unread_count = select(func.count(Message.id)).where(
+        Message.sender_id == partner_id,
+        Message.recipient_id == reader_id,
+        Message.id > message_id,
+        Message.is_deleted == False
+    ).scalar_subquery()
+
+    result = await db.execute(
+        update(Conversation).where(
+            Conversation.user_a_id == user_a_id,
+            Conversation.user_b_id == user_b_id,
+            or_(watermark.is_(None), watermark < message_id)
+        ).values({watermark.key: message_id, counter.key: unread_count})
+    )
+    return result.rowcount > 0
+
+
+async def backfill_conversations(db: AsyncSession) -> int:
+    """Rebuild conversation summaries from the messages table.
+
+    Returns number of conversations written.
+    """
+    user_a_id = case((Message.sender_id < Message.recipient_id, Message.sender_id), else_=Message.recipient_id)
+    user_b_id = case((Message.sender_id < Message.recipient_id, Message.recipient_id), else_=Message.sender_id)
+
+    ranked_messages = select(
+        Message.id.label("message_id"),
+        user_a_id.label("user_a_id"),
+        user_b_id.label("user_b_id"),
+        func.row_number().over(
+            partition_by=(user_a_id, user_b_id),
+            order_by=(Message.created_at.desc(), Message.id.desc())
+        ).label("position")
+    ).filter(Message.is_deleted == False).subquery()
+
+    last_messages = select(
+        ranked_messages.c.user_a_id,
+        ranked_messages.c.user_b_id,
+        ranked_messages.c.message_id
+    ).filter(ranked_messages.c.position == 1).subquery()
+
+    # Unread messages are visible ones past the existing read watermarks
+    visible = Message.is_deleted == False
+    unread_by_a = and_(
+        visible,
+        Message.recipient_id == user_a_id,
+        or_(Conversation.last_read_a_id.is_(None), Message.id > Conversation.last_read_a_id)
+    )
+    unread_by_b = and_(
+        visible,
+        Message.recipient_id == user_b_id,
+        or_(Conversation.last_read_b_id.is_(None), Message.id > Conversation.last_read_b_id)
+    )
+    summaries = select(
+        user_a_id.label("user_a_id"),
+        user_b_id.label("user_b_id"),
+        func.max(Message.created_at).label("last_activity_at"),
+        func.count(case((unread_by_a, Message.id))).label("unread_a"),
+        func.count(case((unread_by_b, Message.id))).label("unread_b")
+    ).outerjoin(
+        Conversation,
+        and_(Conversation.user_a_id == user_a_id, Conversation.user_b_id == user_b_id)
+    ).group_by(user_a_id, user_b_id).subquery()
+
+    rows = (await db.execute(
+        select(summaries, last_messages.c.message_id).outerjoin(
+            last_messages,
+            and_(
+                last_messages.c.user_a_id == summaries.c.user_a_id,
+                last_messages.c.user_b_id == summaries.c.user_b_id
+            )
+        )
+    )).all()
+
+    existing = {
+        (conversation.user_a_id, conversation.user_b_id): conversation
+        for conversation in (await db.scalars(select(Conversation))).all()
+    }
+
+    for row in rows:
+        conversation = existing.get((row.user_a_id, row.user_b_id))
+        if not conversation:
+            conversation = Conversation(user_a_id=row.user_a_id, user_b_id=row.user_b_id)
+            db.add(conversation)
+        conversation.last_message_id = row.message_id
+        conversation.last_activity_at = row.last_activity_at
+        conversation.unread_a = row.unread_a
+        conversation.unread_b = row.unread_b
+
+    await db.flush()
+
+    # Attach messages written before conversations existed
+    await db.execute(
+        update(Message).where(Message.conversation_id.is_(None)).values(
+            conversation_id=select(Conversation.id).where(
+                Conversation.user_a_id == user_a_id,
+                Conversation.user_b_id == user_b_id
+            ).scalar_subquery()
+        )
+    )
+
+    await db.commit()
+    return len(rows)
+
+
+async def link_legacy_messages(db: AsyncSession, user_id: int) -> bool:
+    """Backfill conversations if user_id has messages without one; returns whether it did.
+
+    The upgrade on startup links existing messages, but workers still on an
+    earlier version write unlinked ones during a rolling deploy. Reads that
+    go through conversations call this first instead of missing them; once
+    none are left it is one lookup on an empty index range.
+    """
+    unlinked = await db.scalar(select(Message.id).where(
+        Message.conversation_id.is_(None),
+        or_(Message.sender_id == user_id, Message.recipient_id == user_id)
+    ).limit(1))
+    if unlinked is None:
+        return False
+    await backfill_conversations(db)
+    return True
@@ -0,0 +1,516 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Set
+from decouple import config
+from serialization import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+# memory:// (single process), postgresql://... (LISTEN/NOTIFY) or redis://...
+WS_BUS_URL = config("WS_BUS_URL", default="memory://")
+WS_BUS_CHANNEL_PREFIX = config("WS_BUS_CHANNEL_PREFIX", default="ws_")
+WS_BUS_HEARTBEAT_INTERVAL = config("WS_BUS_HEARTBEAT_INTERVAL", default=5.0, cast=float)
+# Frames waiting for the broker before new ones are dropped (e.g. while reconnecting)
+WS_BUS_OUTBOX_SIZE = config("WS_BUS_OUTBOX_SIZE", default=10000, cast=int)
+
+# A node missing this many heartbeats is considered gone with all its users
+NODE_EXPIRY_HEARTBEATS = 3
+# Users per presence snapshot message
+SNAPSHOT_CHUNK = 500
+RECONNECT_DELAY = 1.0
+RECONNECT_DELAY_MAX = 30.0
+
+Deliver = Callable[[str, int, Optional[str]], None]
+PresenceChanged = Callable[[int], None]
+Invalidated = Callable[[str, str], None]
+
+
+class DeliveryBus:
+    """Relays encoded frames to users connected to other nodes.
+
+    Every node subscribes only to the channels of users it holds a socket
+    for and announces them on a shared presence channel, so each node
+    knows which users are online elsewhere. Frames are only published for
+    those users. Subclasses provide the broker transport.
+
+    Broker traffic goes through one outbox task, so hold/release/publish
+    can be called from synchronous code and keep their order.
+    """
+
+    backend = "memory"
+
+    def __init__(self, channel_prefix: str = WS_BUS_CHANNEL_PREFIX,
+                 heartbeat_interval: float = WS_BUS_HEARTBEAT_INTERVAL,
+                 outbox_size: int = WS_BUS_OUTBOX_SIZE):
+        self.node_id = uuid.uuid4().hex
+        self.user_prefix = f"{channel_prefix}user_"
+        self.presence_channel = f"{channel_prefix}presence"
+        self.heartbeat_interval = heartbeat_interval
+        self.outbox_size = outbox_size
+        # Users with a socket on this node
+        self.held: Set[int] = set()
+        # user_id -> other nodes holding it, and the reverse
+        self.remote: Dict[int, Set[str]] = {}
+        self.node_users: Dict[str, Set[int]] = {}
+        self.node_seen: Dict[str, float] = {}
+        self.connected = False
+        self._deliver: Optional[Deliver] = None
+        # Called with a user id when it comes online or goes offline elsewhere
+        self.on_presence: Optional[PresenceChanged] = None
+        # Called with (cache, key) when another node changed a cached row
+        self.on_invalidate: Optional[Invalidated] = None
+        self._outbox: Optional[asyncio.Queue] = None
+        self._pending_frames = 0
+        self._tasks: List[asyncio.Task] = []
+        self.frames_published = 0
+        self.frames_received = 0
+        self.frames_dropped = 0
+        self.reconnects = 0
+
+    # Transport, implemented by subclasses
+
+    async def _connect(self):
+        pass
+
+    async def _disconnect(self):
+        pass
+
+    async def _listen(self, channel: str):
+        pass
+
+    async def _unlisten(self, channel: str):
+        pass
+
+    async def _send(self, channel: str, payload: str):
+        pass
+
+    async def _wait_closed(self):
+        """Return or raise once the broker connection is lost."""
+        await asyncio.Event().wait()
+
+    # Public API
+
+    async def start(self, deliver: Deliver):
+        """Connect to the broker; deliver(text, user_id, coalesce_key) receives remote frames."""
+        if self._tasks:
+            return
+        self._deliver = deliver
+        self._outbox = asyncio.Queue()
+        self._tasks = [
+            asyncio.create_task(self._run()),
+            asyncio.create_task(self._heartbeat()),
+        ]
+
+    async def stop(self):
+        """Say goodbye so other nodes drop our users, then disconnect."""
+        if not self._tasks:
+            return
+        if self.connected:
+            try:
+                await asyncio.wait_for(self._send_presence({"op": "bye"}), self.heartbeat_interval)
+            except Exception as e:
+                logger.warning(f"Delivery bus goodbye failed: {e}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._outbox = None
+        self.connected = False
+        await self._disconnect()
+
+    def hold(self, user_id: int):
+        """Start receiving frames for a user who connected to this node."""
+        if user_id not in self.held:
+            self.held.add(user_id)
+            self._put(("listen", user_id))
+
+    def release(self, user_id: int):
+        """Stop receiving frames for a user whose last socket here closed."""
+        if user_id in self.held:
+            self.held.discard(user_id)
+            self._put(("unlisten", user_id))
+
+    def publish(self, text: str, user_id: int, coalesce_key: Optional[str] = None):
+        """Queue a frame for the user's sockets on other nodes."""
+        if user_id not in self.remote or self._outbox is None:
+            return
+        if self._pending_frames >= self.outbox_size:
+            self.frames_dropped += 1
+            return
+        self._pending_frames += 1
+        self._put(("publish", user_id, f"{self.node_id}\n{coalesce_key or ''}\n{text}"))
+
+    def invalidate(self, cache: str, key: str):
+        """Tell the other nodes to drop an entry of one of their caches."""
+        self._put(("presence", {"op": "invalidate", "cache": cache, "key": key}))
+
+    def is_online_elsewhere(self, user_id: int) -> bool:
+        return bool(self.remote.get(user_id))
+
+    def online_elsewhere(self) -> List[int]:
+        return list(self.remote.keys())
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend,
+            "node_id": self.node_id,
+            "connected": self.connected,
+            "nodes": len(self.node_seen) + 1,
+            "remote_users": len(self.remote),
+            "pending_frames": self._pending_frames,
+            "frames_published": self.frames_published,
+            "frames_received": self.frames_received,
+            "frames_dropped": self.frames_dropped,
+            "reconnects": self.reconnects,
+        }
+
+    # Outbox
+
+    def _put(self, item: tuple):
+        if self._outbox is not None:
+            self._outbox.put_nowait(item)
+
+    def user_channel(self, user_id: int) -> str:
+        return f"{self.user_prefix}{user_id}"
+
+    async def _run(self):
+        delay = RECONNECT_DELAY
+        while True:
+            try:
+                await self._connect()
+                await self._listen(self.presence_channel)
+                for user_id in list(self.held):
+                    await self._listen(self.user_channel(user_id))
+                self.connected = True
+                delay = RECONNECT_DELAY
+                # Ask the others for their users, then announce ours
+                await self._send_presence({"op": "hello"})
+                await self._send_snapshot()
+                logger.info(f"Delivery bus node {self.node_id} connected ({self.backend})")
+
+                pump = asyncio.create_task(self._pump())
+                closed = asyncio.create_task(self._wait_closed())
+                try:
+                    done, _ = await asyncio.wait({pump, closed}, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        task.result()
+                    raise ConnectionError("broker connection closed")
+                finally:
+                    pump.cancel()
+                    closed.cancel()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.connected = False
+                self.reconnects += 1
+                logger.error(f"Delivery bus connection failed, retrying in {delay:.0f}s: {e}")
+                try:
+                    await self._disconnect()
+                except Exception:
+                    pass
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_DELAY_MAX)
+
+    async def _pump(self):
+        while True:
+            item = await self._outbox.get()
+            op = item[0]
+            # Subscriptions are resynced from self.held on reconnect, so only
+            # apply the ones still current
+            if op == "listen":
+                if item[1] in self.held:
+                    await self._listen(self.user_channel(item[1]))
+                    await self._send_presence({"op": "online", "user": item[1]})
+            elif op == "unlisten":
+                if item[1] not in self.held:
+                    await self._unlisten(self.user_channel(item[1]))
+                    await self._send_presence({"op": "offline", "user": item[1]})
+            elif op == "publish":
+                self._pending_frames -= 1
+                await self._send(self.user_channel(item[1]), item[2])
+                self.frames_published += 1
+            elif op == "presence":
+                await self._send_presence(item[1])
+            elif op == "snapshot":
+                await self._send_snapshot()
+
+    async def _heartbeat(self):
+        expiry = self.heartbeat_interval * NODE_EXPIRY_HEARTBEATS
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            if self.connected:
+                self._put(("presence", {"op": "heartbeat"}))
+            cutoff = time.monotonic() - expiry
+            for node, seen in list(self.node_seen.items()):
+                if seen < cutoff:
+                    logger.warning(f"Delivery bus node {node} expired")
+                    self._drop_node(node)
+
+    async def _send_presence(self, event: dict):
+        event["node"] = self.node_id
+        await self._send(self.presence_channel, dumps(event))
+
+    async def _send_snapshot(self):
+        users = sorted(self.held)
+        chunks = [users[i:i + SNAPSHOT_CHUNK] for i in range(0, len(users), SNAPSHOT_CHUNK)] or [[]]
+        for index, chunk in enumerate(chunks):
+            await self._send_presence({"op": "snapshot", "users": chunk, "first": index == 0})
+
+    # Inbound
+
+    def _receive(self, channel: str, payload: str):
+        """Dispatch a message from the broker."""
+        try:
+            if channel == self.presence_channel:
+                self._on_presence(loads(payload))
+                return
+            node, coalesce_key, text = payload.split("\n", 2)
+            if node == self.node_id:
+                return
+            user_id = int(channel[len(self.user_prefix):])
+            if user_id in self.held and self._deliver is not None:
+                self.frames_received += 1
+                self._deliver(text, user_id, coalesce_key or None)
+        except Exception as e:
+            logger.error(f"Bad delivery bus message on {channel}: {e}")
+
+    def _on_presence(self, event: dict):
+        node = event["node"]
+        if node == self.node_id:
+            return
+        op = event["op"]
+        if op == "bye":
+            self._drop_node(node)
+            return
+        known = node in self.node_seen
+        self.node_seen[node] = time.monotonic()
+
+        if op == "hello":
+            # A node (re)joined; it starts from an empty view
+            self._drop_node(node)
+            self.node_seen[node] = time.monotonic()
+            self._put(("snapshot",))
+        elif not known and op != "snapshot":
+            # We missed this node's snapshot, e.g. while reconnecting
+            self._put(("presence", {"op": "hello"}))
+
+        if op == "invalidate":
+            if self.on_invalidate is not None:
+                self.on_invalidate(event["cache"], event["key"])
+        elif op == "snapshot":
+            if event.get("first"):
+                for user_id in list(self.node_users.get(node, ())):
+                    self._remove_remote(node, user_id)
+            for user_id in event["users"]:
+                self._add_remote(node, user_id)
+        elif op == "online":
+            self._add_remote(node, event["user"])
+        elif op == "offline":
+            self._remove_remote(node, event["user"])
+
+    def _add_remote(self, node: str, user_id: int):
+        first = user_id not in self.remote
+        self.remote.setdefault(user_id, set()).add(node)
+        self.node_users.setdefault(node, set()).add(user_id)
+        if first and self.on_presence is not None:
+            self.on_presence(user_id)
+
+    def _remove_remote(self, node: str, user_id: int):
+        nodes = self.remote.get(user_id)
+        if nodes is not None:
+            nodes.discard(node)
+        users = self.node_users.get(node)
+        if users is not None:
+            users.discard(user_id)
+        if nodes is not None and not nodes:
+            del self.remote[user_id]
+            if self.on_presence is not None:
+                self.on_presence(user_id)
+
+    def _drop_node(self, node: str):
+        for user_id in list(self.node_users.pop(node, ())):
+            self._remove_remote(node, user_id)
+        self.node_users.pop(node, None)
+        self.node_seen.pop(node, None)
+
+
+class LocalBroker:
+    """In-memory pub/sub shared by the InProcessBus nodes of one process."""
+
+    def __init__(self):
+        self.channels: Dict[str, Set["InProcessBus"]] = {}
+
+    def publish(self, channel: str, payload: str):
+        for bus in list(self.channels.get(channel, ())):
+            bus._receive(channel, payload)
+
+
+class InProcessBus(DeliveryBus):
+    """Bus for a single process; nodes sharing a LocalBroker see each other (tests)."""
+
+    backend = "memory"
+
+    def __init__(self, broker: Optional[LocalBroker] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.broker = broker or LocalBroker()
+
+    async def _disconnect(self):
+        for subscribers in self.broker.channels.values():
+            subscribers.discard(self)
+
+    async def _listen(self, channel: str):
+        self.broker.channels.setdefault(channel, set()).add(self)
+
+    async def _unlisten(self, channel: str):
+        subscribers = self.broker.channels.get(channel)
+        if subscribers is not None:
+            subscribers.discard(self)
+            if not subscribers:
+                del self.broker.channels[channel]
+
+    async def _send(self, channel: str, payload: str):
+        self.broker.publish(channel, payload)
+
+
+class RedisBus(DeliveryBus):
+    """Bus over Redis pub/sub (or any broker speaking the Redis protocol)."""
+
+    backend = "redis"
+
+    def __init__(self, url: str, **kwargs):
+        super().__init__(**kwargs)
+        self.url = url
+        self.client = None
+        self.pubsub = None
+
+    async def _connect(self):
+        import redis.asyncio as redis
+
+        self.client = redis.from_url(self.url, decode_responses=True)
+        self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+
+    async def _disconnect(self):
+        if self.pubsub is not None:
+            await self.pubsub.close()
+            self.pubsub = None
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+
+    async def _listen(self, channel: str):
+        await self.pubsub.subscribe(channel)
+
+    async def _unlisten(self, channel: str):
+        await self.pubsub.unsubscribe(channel)
+
+    async def _send(self, channel: str, payload: str):
+        await self.client.publish(channel, payload)
+
+    async def _wait_closed(self):
+        while True:
+            message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            if message is not None and message["type"] == "message":
+                self._receive(message["channel"], message["data"])
+
+
+class PostgresBus(DeliveryBus):
+    """Bus over Postgres LISTEN/NOTIFY, using two dedicated connections.
+
+    NOTIFY payloads are limited to 8000 bytes, so larger frames are sent
+    in parts and reassembled by the receiver.
+    """
+
+    backend = "postgresql"
+    # Stay under the 8000 byte NOTIFY limit including the part header
+    MAX_PAYLOAD = 7600
+
+    def __init__(self, url: str, **kwargs):
+        super().__init__(**kwargs)
+        scheme, separator, rest = url.partition("://")
+        # asyncpg takes plain libpq URLs
+        self.dsn = f"postgresql{separator}{rest}"
+        self.listener = None
+        self.publisher = None
+        self._closed: Optional[asyncio.Event] = None
+        self._part_seq = 0
+        # part id -> (first seen, parts)
+        self._partials: Dict[str, tuple] = {}
+
+    async def _connect(self):
+        import asyncpg
+
+        self._closed = asyncio.Event()
+        self.listener = await asyncpg.connect(self.dsn)
+        self.listener.add_termination_listener(lambda connection: self._closed.set())
+        self.publisher = await asyncpg.connect(self.dsn)
+
+    async def _disconnect(self):
+        for connection in (self.listener, self.publisher):
+            if connection is not None:
+                try:
+                    await asyncio.wait_for(connection.close(), 5)
+                except Exception:
+                    connection.terminate()
+        self.listener = None
+        self.publisher = None
+        self._partials.clear()
+
+    async def _listen(self, channel: str):
+        await self.listener.add_listener(channel, self._on_notify)
+
+    async def _unlisten(self, channel: str):
+        await self.listener.remove_listener(channel, self._on_notify)
+
+    async def _send(self, channel: str, payload: str):
+        for part in self._split(payload):
+            await self.publisher.execute("SELECT pg_notify($1, $2)", channel, part)
+
+    async def _wait_closed(self):
+        await self._closed.wait()
+
+    def _split(self, payload: str) -> List[str]:
+        # Count characters as up to 4 bytes unless the payload is ASCII
+        step = self.MAX_PAYLOAD if payload.isascii() else self.MAX_PAYLOAD // 4
+        if len(payload) <= step:
+            return [payload]
+        self._part_seq += 1
+        part_id = f"{self.node_id}-{self._part_seq}"
+        parts = [payload[i:i + step] for i in range(0, len(payload), step)]
+        return [f"~{part_id}:{index}:{len(parts)}\n{part}" for index, part in enumerate(parts)]
+
+    def _on_notify(self, connection, pid, channel: str, payload: str):
+        if payload.startswith("~"):
+            payload = self._reassemble(payload)
+            if payload is None:
+                return
+        self._receive(channel, payload)
+
+    def _reassemble(self, payload: str) -> Optional[str]:
+        header, _, part = payload[1:].partition("\n")
+        part_id, index, total = header.rsplit(":", 2)
+        now = time.monotonic()
+        # Forget parts whose siblings never arrived
+        expiry = now - self.heartbeat_interval * NODE_EXPIRY_HEARTBEATS
+        for stale in [key for key, (seen, _) in self._partials.items() if seen < expiry]:
+            del self._partials[stale]
+
+        seen, parts = self._partials.setdefault(part_id, (now, {}))
+        parts[int(index)] = part
+        if len(parts) < int(total):
+            return None
+        del self._partials[part_id]
+        return "".join(parts[i] for i in range(int(total)))
+
+
+def create_bus(url: str = WS_BUS_URL) -> DeliveryBus:
+    """Bus for a WS_BUS_URL."""
+    scheme = url.partition("://")[0].split("+")[0]
+    if scheme == "memory":
+        return InProcessBus()
+    if scheme in ("postgres", "postgresql"):
+        return PostgresBus(url)
+    if scheme in ("redis", "rediss"):
+        return RedisBus(url)
+    raise ValueError(f"Unsupported WS_BUS_URL scheme: {scheme}")
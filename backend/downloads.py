@@ -0,0 +1,192 @@
+import hashlib
+import hmac
+import os
+import re
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional, Tuple
+from urllib.parse import quote
+import aiofiles
+import aiofiles.os
+from decouple import config
+from fastapi import HTTPException, Request, Response, status
+from fastapi.responses import FileResponse, StreamingResponse
+from auth import SECRET_KEY
+from storage import UPLOAD_CHUNK_SIZE, UPLOAD_DIR
+
+# Hand file transfers to nginx (X-Accel-Redirect) once the request is authorized
+ATTACHMENT_ACCEL_REDIRECT = config("ATTACHMENT_ACCEL_REDIRECT", default=False, cast=bool)
+# Internal nginx location aliased to the uploads directory
+ATTACHMENT_ACCEL_PREFIX = config("ATTACHMENT_ACCEL_PREFIX", default="/_protected_uploads/")
+
+# Content-named files never change under the same URL
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+
+# Types a browser may render in place; anything else (HTML, SVG, scripts...)
+# could run in our origin, so it is always downloaded
+INLINE_CONTENT_TYPES = frozenset({
+    "image/jpeg", "image/png", "image/gif", "image/webp", "image/bmp", "image/avif",
+    "audio/mpeg", "audio/ogg", "audio/wav", "audio/webm", "audio/aac", "audio/mp4",
+    "video/mp4", "video/webm", "video/ogg",
+    "application/pdf",
+})
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# Signed download links replace the session token in attachment URLs. They
+# are issued for fixed windows and stay valid for one to two of them, so
+# everyone opening a file in the same window gets the same, cacheable URL.
+ATTACHMENT_URL_TTL = config("ATTACHMENT_URL_TTL", default=3600, cast=int)  # seconds
+# Separate from the JWT key use of SECRET_KEY
+_URL_SIGNING_KEY = hmac.new(SECRET_KEY.encode(), b"attachment-download-url", hashlib.sha256).digest()
+
+
+def _url_signature(path: str, expires: int) -> str:
+    return hmac.new(_URL_SIGNING_KEY, f"{path}\n{expires}".encode(), hashlib.sha256).hexdigest()
+
+
+def sign_download_path(path: str) -> Tuple[str, int]:
+    """Signed URL of a download path (as routed) and its expiry timestamp."""
+    expires = (int(time.time()) // ATTACHMENT_URL_TTL + 2) * ATTACHMENT_URL_TTL
+    return f"{quote(path)}?expires={expires}&signature={_url_signature(path, expires)}", expires
+
+
+def verify_download_signature(path: str, expires: int, signature: str) -> bool:
+    """Whether a signed URL grants access to path now."""
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(signature, _url_signature(path, expires))
+
+
+def _content_disposition(content_type: Optional[str], download_name: str) -> str:
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    disposition = "inline" if media_type in INLINE_CONTENT_TYPES else "attachment"
+    return f"{disposition}; filename*=utf-8''{quote(download_name)}"
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """Weak comparison against an If-None-Match list."""
+    if header.strip() == "*":
+        return True
+    tags = [tag.strip() for tag in header.split(",")]
+    return etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+
+
+def _not_modified_since(header: str, mtime: float) -> bool:
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+    return int(mtime) <= since.timestamp()
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single byte range into inclusive (start, end).
+
+    Returns None for ranges we don't serve partially (multiple ranges or
+    malformed headers), which get the full file. Raises 416 when the range
+    lies outside the file.
+    """
+    match = RANGE_PATTERN.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # Suffix range: the last N bytes
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start >= size or start > end:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end
+
+
+async def _read_range(file_path: str, start: int, length: int):
+    async with aiofiles.open(file_path, "rb") as file:
+        await file.seek(start)
+        while length > 0:
+            chunk = await file.read(min(UPLOAD_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+async def file_response(
+    request: Request,
+    file_path: str,
+    download_name: str,
+    content_type: Optional[str] = None,
+    content_hash: Optional[str] = None
+) -> Response:
+    """Serve a stored file with validators, caching and byte ranges.
+
+    Files named by their content hash get a strong ETag from the hash and
+    immutable caching; others are revalidated against mtime and size.
+    Only INLINE_CONTENT_TYPES are shown in place; others are downloaded.
+    Supports If-None-Match/If-Modified-Since (304), single byte ranges
+    (206, with If-Range) and, when enabled, offloading to nginx.
+    """
+    try:
+        stat = await aiofiles.os.stat(file_path)
+    except FileNotFoundError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File not found"
+        )
+
+    etag = f'"{content_hash}"' if content_hash else f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    last_modified = formatdate(stat.st_mtime, usegmt=True)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if content_hash else REVALIDATE_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": _content_disposition(content_type, download_name),
+        # Browsers must not second-guess the stored type into something renderable
+        "X-Content-Type-Options": "nosniff",
+        # Don't pass signed URLs on to pages opened from the file
+        "Referrer-Policy": "no-referrer",
+    }
+
+    # Conditional GET; If-None-Match takes precedence over If-Modified-Since
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if _etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    elif "if-modified-since" in request.headers:
+        if _not_modified_since(request.headers["if-modified-since"], stat.st_mtime):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    media_type = content_type or "application/octet-stream"
+
+    if ATTACHMENT_ACCEL_REDIRECT:
+        # nginx serves the bytes (including ranges); we only authorized it
+        relative_path = os.path.relpath(file_path, UPLOAD_DIR).replace(os.sep, "/")
+        headers["X-Accel-Redirect"] = ATTACHMENT_ACCEL_PREFIX + quote(relative_path)
+        return Response(media_type=media_type, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range in (etag, last_modified)):
+        byte_range = _parse_range(range_header, stat.st_size)
+        if byte_range is not None:
+            start, end = byte_range
+            length = end - start + 1
+            headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+            headers["Content-Length"] = str(length)
+            return StreamingResponse(
+                _read_range(file_path, start, length),
+                status_code=status.HTTP_206_PARTIAL_CONTENT,
+                media_type=media_type,
+                headers=headers
+            )
+
+    return FileResponse(file_path, stat_result=stat, media_type=media_type, headers=headers)
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+from decouple import config
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import SessionLocal
+from models import User, UserEvent
+
+logger = logging.getLogger(__name__)
+
+# Events older than this are pruned; clients further behind resync fully
+EVENT_LOG_RETENTION = config("EVENT_LOG_RETENTION", default=7 * 24 * 3600, cast=int)  # seconds
+EVENT_LOG_PRUNE_INTERVAL = config("EVENT_LOG_PRUNE_INTERVAL", default=3600.0, cast=float)
+# Most events returned by one sync request
+SYNC_PAGE_SIZE = config("SYNC_PAGE_SIZE", default=500, cast=int)
+
+# Logged event types, named like the WebSocket frames they replay
+NEW_MESSAGE = "new_message"
+MESSAGE_UPDATED = "message_updated"
+MESSAGE_DELETED = "message_deleted"
+
+
+async def append_event(db: AsyncSession, user_id: int, event_type: str, message_id: int) -> int:
+    """Log an event for user_id in the caller's transaction; returns its seq.
+
+    Incrementing users.event_seq locks the user's row until commit, so a
+    user's events commit in seq order with no gaps.
+    """
+    seq = await db.scalar(
+        update(User).where(User.id == user_id)
+        .values(event_seq=User.event_seq + 1)
+        .returning(User.event_seq)
+        .execution_options(synchronize_session=False)
+    )
+    db.add(UserEvent(user_id=user_id, seq=seq, type=event_type, message_id=message_id))
+    return seq
+
+
+async def read_events(
+    db: AsyncSession,
+    user_id: int,
+    since: Optional[int],
+    limit: int
+) -> Tuple[int, Optional[List[UserEvent]]]:
+    """Events of user_id after since, oldest first, at most limit + 1 of them.
+
+    Returns the user's latest seq and the events; the events are None when
+    some after since were already pruned (or since is from another log),
+    and the client has to reload everything.
+    """
+    current_seq = await db.scalar(select(User.event_seq).where(User.id == user_id)) or 0
+    if since is None or since == current_seq:
+        return current_seq, []
+    if since < 0 or since > current_seq:
+        return current_seq, None
+
+    events = (await db.scalars(
+        select(UserEvent)
+        .where(UserEvent.user_id == user_id, UserEvent.seq > since)
+        .order_by(UserEvent.seq)
+        .limit(limit + 1)
+    )).all()
+    # Seqs are gapless, so a missing successor means it was pruned
+    if not events or events[0].seq != since + 1:
+        return current_seq, None
+    return current_seq, list(events)
+
+
+async def prune_events(db: AsyncSession, retention: int = EVENT_LOG_RETENTION) -> int:
+    """Delete events older than the retention period; returns how many."""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=retention)
+    result = await db.execute(delete(UserEvent).where(UserEvent.created_at < cutoff))
+    await db.commit()
+    return result.rowcount
+
+
+class EventLogJanitor:
+    """Periodically prunes events past the retention period."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Start periodic pruning."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop periodic pruning."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                async with SessionLocal() as db:
+                    pruned = await prune_events(db)
+                if pruned:
+                    logger.info(f"Pruned {pruned} events from the event log")
+            except Exception as e:
+                logger.error(f"Event log pruning failed: {e}")
+            await asyncio.sleep(self.interval)
+
+
+# Global event log janitor instance
+event_log_janitor = EventLogJanitor(EVENT_LOG_PRUNE_INTERVAL)
@@ -1,14 +1,20 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import ORJSONResponse
 import os
 import uvicorn
 import logging
 from contextlib import asynccontextmanager
 
-from database import engine
-from models import Base
-from routes import auth, messages, websocket, users  # Added users import
+from database import engine, get_pool_status
+from migrations import upgrade_database
+from read_receipts import read_receipts
+from thumbnails import thumbnails
+from upload_sessions import upload_janitor
+from event_log import event_log_janitor
+from websocket_manager import manager
+from storage import RequestSizeLimitMiddleware
+from routes import auth, messages, websocket, users, metrics, uploads, sync  # Added users import
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -19,7 +25,8 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info("Creating database tables...")
     try:
-        Base.metadata.create_all(bind=engine)
+        # Also adds what tables and rows of earlier versions are missing
+        await upgrade_database(engine)
         logger.info("Database tables created successfully!")
     except Exception as e:
         logger.error(f"Failed to create database tables: {e}")
@@ -30,9 +37,30 @@ async def lifespan(app: FastAPI):
         os.makedirs("uploads")
         logger.info("Created uploads directory")
     
+    # Start batched read receipt writer
+    await read_receipts.start()
+    
+    # Start thumbnail workers; they resume any pending backlog
+    await thumbnails.start()
+    
+    # Expire abandoned resumable uploads
+    await upload_janitor.start()
+    
+    # Prune message events past their retention
+    await event_log_janitor.start()
+    
+    # Join the delivery bus shared with other workers and nodes
+    await manager.start()
+    
     yield
     
     # Shutdown
+    await manager.stop()
+    await event_log_janitor.stop()
+    await upload_janitor.stop()
+    await thumbnails.stop()
+    await read_receipts.stop()
+    await engine.dispose()
     logger.info("Application shutdown")
 
 # Create FastAPI app
@@ -40,9 +68,15 @@ app = FastAPI(
     title="Messenger API",
     description="A real-time messenger application with file attachments and WebSocket support",
     version="1.2.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    # orjson for every JSON response; hot routes also skip response_model
+    # validation by returning serialization.json_response
+    default_response_class=ORJSONResponse
 )
 
+# Reject oversized message uploads while they are still arriving
+app.add_middleware(RequestSizeLimitMiddleware)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -56,16 +90,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Content-Range", "Accept-Ranges", "ETag", "Upload-Offset"],
 )
 
-# Mount static files for uploads
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
-
 # Include routers
 app.include_router(auth.router)
 app.include_router(messages.router)
 app.include_router(websocket.router)
 app.include_router(users.router)  # Added users router
+app.include_router(metrics.router)
+app.include_router(uploads.router)
+app.include_router(sync.router)
 
 @app.get("/")
 def read_root():
@@ -78,22 +113,15 @@ def read_root():
 
 @app.get("/health")
 def health_check():
-    try:
-        # Test database connection
-        from database import SessionLocal
-        from sqlalchemy import text
-        db = SessionLocal()
-        db.execute(text("SELECT 1"))
-        db.close()
-        return {
-            "status": "healthy", 
-            "database": "connected",
-            "version": "1.2.0",
-            "websocket": "available"
-        }
-    except Exception as e:
-        logger.error(f"Health check failed: {e}")
-        raise HTTPException(status_code=503, detail=f"Service unhealthy: {str(e)}")
+    # Report pool saturation instead of checking out a connection per probe
+    pool = get_pool_status()
+    saturated = pool["saturation"] is not None and pool["saturation"] >= 1
+    return {
+        "status": "saturated" if saturated else "healthy",
+        "database_pool": pool,
+        "version": "1.2.0",
+        "websocket": "available"
+    }
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,163 @@
+"""Maintenance commands.
+
+Usage:
+    python manage.py upgrade-schema
+    python manage.py backfill-conversations
+    python manage.py storage-report
+    python manage.py collect-blobs
+    python manage.py expire-uploads
+    python manage.py build-search-index
+    python manage.py prune-events
+"""
+import argparse
+import asyncio
+import logging
+
+from database import SessionLocal, engine
+from migrations import upgrade_database
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def upgrade_schema_command(args):
+    """Report the database as current; upgrades run before every command."""
+    logger.info("Database schema and data are up to date")
+
+
+async def backfill_conversations_command(args):
+    """Rebuild conversation summaries from existing messages."""
+    from conversations import backfill_conversations
+
+    async with SessionLocal() as db:
+        count = await backfill_conversations(db)
+        logger.info(f"Backfilled {count} conversations")
+
+
+async def storage_report_command(args):
+    """Report how much space content-addressed storage saves."""
+    from sqlalchemy import func, select
+    from models import Blob, Message, MessageAttachment
+
+    async with SessionLocal() as db:
+        logical_count, logical_bytes = (await db.execute(
+            select(func.count(MessageAttachment.id), func.coalesce(func.sum(MessageAttachment.file_size), 0))
+            .join(Message, Message.id == MessageAttachment.message_id)
+            .where(MessageAttachment.sha256.is_not(None), Message.is_deleted == False)
+        )).one()
+        blob_count, stored_bytes = (await db.execute(
+            select(func.count(Blob.sha256), func.coalesce(func.sum(Blob.size), 0))
+            .where(Blob.ref_count > 0)
+        )).one()
+        legacy_count, legacy_bytes = (await db.execute(
+            select(func.count(MessageAttachment.id), func.coalesce(func.sum(MessageAttachment.file_size), 0))
+            .where(MessageAttachment.sha256.is_(None))
+        )).one()
+        garbage_count = (await db.execute(
+            select(func.count(Blob.sha256)).where(Blob.ref_count <= 0)
+        )).scalar()
+
+    saved = logical_bytes - stored_bytes
+    ratio = saved / logical_bytes if logical_bytes else 0.0
+    print(f"attachments:        {logical_count} ({logical_bytes} bytes)")
+    print(f"unique blobs:       {blob_count} ({stored_bytes} bytes)")
+    print(f"saved by dedup:     {saved} bytes ({ratio:.1%})")
+    print(f"legacy files:       {legacy_count} ({legacy_bytes} bytes, not deduplicated)")
+    print(f"unreferenced blobs: {garbage_count}")
+
+
+async def collect_blobs_command(args):
+    """Delete blobs no message references any more."""
+    from sqlalchemy import select
+    from models import Blob
+    from storage import collect_blobs
+
+    async with SessionLocal() as db:
+        hashes = (await db.execute(select(Blob.sha256).where(Blob.ref_count <= 0))).scalars().all()
+        freed = await collect_blobs(db, hashes)
+        logger.info(f"Collected {len(hashes)} blobs, freed {freed} bytes")
+
+
+async def expire_uploads_command(args):
+    """Delete stale resumable upload sessions and unsent uploads."""
+    from upload_sessions import expire_uploads
+
+    async with SessionLocal() as db:
+        expired = await expire_uploads(db)
+        logger.info(f"Expired {expired['sessions']} upload sessions and {expired['attachments']} unsent uploads, freed {expired['bytes_freed']} bytes")
+        logger.info(f"Restored {expired['temp_files_restored']} and removed {expired['temp_files_removed']} files left in uploads/tmp")
+
+
+async def build_search_index_command(args):
+    """Reindex usernames and messages; upgrades already create missing indexes."""
+    from user_search import build_search_index
+    from message_search import build_message_search_index
+
+    async with SessionLocal() as db:
+        await build_search_index(db)
+        await build_message_search_index(db)
+        logger.info("Username and message search indexes rebuilt")
+
+
+async def prune_events_command(args):
+    """Delete message events past the event log retention."""
+    from event_log import prune_events
+
+    async with SessionLocal() as db:
+        pruned = await prune_events(db)
+        logger.info(f"Pruned {pruned} events from the event log")
+
+
+async def run(args):
+    await upgrade_database(engine)
+    try:
+        await args.handler(args)
+    finally:
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Messenger API maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser(
+        "upgrade-schema",
+        help="Add columns and constraints missing from a database created by an earlier version"
+    ).set_defaults(handler=upgrade_schema_command)
+
+    subparsers.add_parser(
+        "backfill-conversations",
+        help="Rebuild the conversations table from the messages table"
+    ).set_defaults(handler=backfill_conversations_command)
+
+    subparsers.add_parser(
+        "storage-report",
+        help="Show attachment storage usage and deduplication savings"
+    ).set_defaults(handler=storage_report_command)
+
+    subparsers.add_parser(
+        "collect-blobs",
+        help="Delete attachment blobs with no remaining references"
+    ).set_defaults(handler=collect_blobs_command)
+
+    subparsers.add_parser(
+        "expire-uploads",
+        help="Delete stale resumable upload sessions and unsent uploads"
+    ).set_defaults(handler=expire_uploads_command)
+
+    subparsers.add_parser(
+        "build-search-index",
+        help="Rebuild the username and message search indexes from the tables"
+    ).set_defaults(handler=build_search_index_command)
+
+    subparsers.add_parser(
+        "prune-events",
+        help="Delete message events older than EVENT_LOG_RETENTION"
+    ).set_defaults(handler=prune_events_command)
+
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
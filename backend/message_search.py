@@ -0,0 +1,109 @@
+import html
+import re
+from typing import List, Optional, Tuple
+from sqlalchemy import column, func, literal_column, or_, select, table, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from conversations import conversation_pair
+from models import Conversation, Message, MESSAGE_SEARCH_CONFIG, MESSAGE_SEARCH_DDL, MESSAGE_SEARCH_REINDEX
+
+# Marks around matched terms in snippets
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_STOP = "</mark>"
+SNIPPET_WORDS = 16
+
+# The database highlights matches with these private-use characters; they
+# become the marks above only after the message text is HTML-escaped (a
+# message containing them can at worst add stray marks, never markup)
+MATCH_START = "\ue000"
+MATCH_STOP = "\ue001"
+
+messages_search = table("messages_search", column("rowid"))
+
+
+def highlight(snippet: str) -> str:
+    """HTML for a database snippet: the text escaped, matches wrapped in marks."""
+    return (
+        html.escape(snippet)
+        .replace(MATCH_START, HIGHLIGHT_START)
+        .replace(MATCH_STOP, HIGHLIGHT_STOP)
+    )
+
+
+def fts5_query(query: str) -> Optional[str]:
+    """FTS5 query matching every word of query; None if it has no words."""
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    return " ".join(f'"{word}"' for word in words)
+
+
+async def search_messages(
+    db: AsyncSession,
+    user_id: int,
+    query: str,
+    limit: int,
+    partner_id: Optional[int] = None,
+    before_id: Optional[int] = None
+) -> List[Tuple[Message, str]]:
+    """Messages of user_id's conversations matching query, newest first, with snippets.
+
+    Snippets are HTML: message text is escaped and only the match marks
+    are markup, so clients can render them as is.
+
+    Postgres matches websearch syntax ("quoted phrases", or, -excluded)
+    against messages.search_vector; SQLite matches all words through the
+    messages_search FTS5 table. Deleted messages are not indexed.
+    """
+    dialect = db.bind.dialect.name
+    if dialect == "postgresql":
+        tsquery = func.websearch_to_tsquery(MESSAGE_SEARCH_CONFIG, query)
+        snippet = func.ts_headline(
+            MESSAGE_SEARCH_CONFIG, Message.content, tsquery,
+            f"StartSel={MATCH_START}, StopSel={MATCH_STOP}, MaxWords={SNIPPET_WORDS}, MinWords=5"
+        )
+        statement = select(Message, snippet).filter(
+            literal_column("messages.search_vector").op("@@")(tsquery)
+        )
+    else:
+        match = fts5_query(query)
+        if match is None:
+            return []
+        snippet = literal_column(
+            f"snippet(messages_search, 0, '{MATCH_START}', '{MATCH_STOP}', '…', {SNIPPET_WORDS})"
+        )
+        statement = select(Message, snippet).join(
+            messages_search, messages_search.c.rowid == Message.id
+        ).filter(text("messages_search MATCH :match").bindparams(match=match))
+
+    if partner_id is not None:
+        user_a_id, user_b_id = conversation_pair(user_id, partner_id)
+        conversations = select(Conversation.id).where(
+            Conversation.user_a_id == user_a_id,
+            Conversation.user_b_id == user_b_id
+        )
+    else:
+        conversations = select(Conversation.id).where(
+            or_(Conversation.user_a_id == user_id, Conversation.user_b_id == user_id)
+        )
+    statement = statement.filter(
+        Message.conversation_id.in_(conversations),
+        Message.is_deleted == False
+    )
+    if before_id is not None:
+        statement = statement.filter(Message.id < before_id)
+
+    statement = statement.options(
+        selectinload(Message.sender),
+        selectinload(Message.recipient),
+        selectinload(Message.attachments)
+    ).order_by(Message.id.desc()).limit(limit)
+    return [(message, highlight(snippet)) for message, snippet in (await db.execute(statement)).all()]
+
+
+async def build_message_search_index(db: AsyncSession):
+    """Create the message full-text index if missing and reindex all messages."""
+    dialect = db.bind.dialect.name
+    for statement in MESSAGE_SEARCH_DDL.get(dialect, []) + MESSAGE_SEARCH_REINDEX.get(dialect, []):
+        await db.execute(text(statement))
+    await db.commit()
@@ -0,0 +1,187 @@
+from typing import Any, Iterable, List, Optional, Sequence, Tuple
+from fastapi import HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from models import User, Message, MessageAttachment
+from conversations import get_or_create_conversation, record_message_sent
+from event_log import NEW_MESSAGE, MESSAGE_DELETED, SYNC_PAGE_SIZE, append_event, read_events
+from storage import StoredFile, add_blob_references, discard_uploads, publish_uploads
+from thumbnails import thumbnails, wants_thumbnail, THUMBNAIL_PENDING
+from serialization import message_fragment
+
+# Longest idempotency key a client may send
+CLIENT_ID_MAX_LENGTH = 64
+
+
+async def load_message(db: AsyncSession, message_id: int):
+    """Load message with the relationships MessageResponse serializes."""
+    return await db.scalar(
+        select(Message).filter(Message.id == message_id).options(
+            selectinload(Message.sender),
+            selectinload(Message.recipient),
+            selectinload(Message.attachments)
+        ).execution_options(populate_existing=True)
+    )
+
+
+async def get_message_by_client_id(db: AsyncSession, sender_id: int, client_id: str) -> Optional[Message]:
+    """Message a sender already sent with this idempotency key."""
+    message_id = await db.scalar(select(Message.id).where(
+        Message.sender_id == sender_id,
+        Message.client_id == client_id
+    ))
+    return await load_message(db, message_id) if message_id is not None else None
+
+
+async def create_message(
+    db: AsyncSession,
+    sender_id: int,
+    recipient: User,
+    content: str,
+    stored_files: Sequence[StoredFile] = (),
+    attachment_ids: Iterable[int] = (),
+    client_id: Optional[str] = None
+) -> Tuple[Message, Optional[int]]:
+    """Persist a message with its attachments; shared by HTTP and WebSocket sends.
+
+    Returns the loaded message and the seq of its new_message event in the
+    recipient's event log, or None when it wasn't created: a client_id the
+    sender already used returns the earlier message instead, so retries
+    don't duplicate it. Stored files are discarded when nothing is created.
+    """
+    attachment_ids = list(attachment_ids)
+    recipient_id = recipient.id
+    if client_id is not None:
+        if len(client_id) > CLIENT_ID_MAX_LENGTH:
+            await discard_uploads(stored_files)
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"client_id longer than {CLIENT_ID_MAX_LENGTH} characters"
+            )
+        existing = await get_message_by_client_id(db, sender_id, client_id)
+        if existing is not None:
+            # A retry; the first attempt already stored its files
+            await discard_uploads(stored_files)
+            return existing, None
+
+    try:
+        # Finalized resumable uploads of this user that no message claimed
+        # yet; locked so two messages can't claim the same one
+        uploaded_attachments = []
+        if attachment_ids:
+            uploaded_attachments = (await db.scalars(select(MessageAttachment).where(
+                MessageAttachment.id.in_(attachment_ids),
+                MessageAttachment.uploaded_by_id == sender_id,
+                MessageAttachment.message_id.is_(None)
+            ).with_for_update())).all()
+            if len(uploaded_attachments) != len(set(attachment_ids)):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Unknown or already sent attachment"
+                )
+
+        # Create message
+        conversation = await get_or_create_conversation(db, sender_id, recipient_id)
+        db_message = Message(
+            content=content,
+            sender_id=sender_id,
+            recipient_id=recipient_id,
+            conversation_id=conversation.id,
+            client_id=client_id
+        )
+        db_message.attachments = [
+            MessageAttachment(
+                uploaded_by_id=sender_id,
+                filename=stored.filename,
+                original_filename=stored.original_filename,
+                file_path=stored.file_path,
+                file_size=stored.file_size,
+                content_type=stored.content_type,
+                sha256=stored.sha256,
+                thumbnail_status=THUMBNAIL_PENDING if wants_thumbnail(stored.content_type, stored.sha256) else None
+            ) for stored in stored_files
+        ] + list(uploaded_attachments)
+
+        db.add(db_message)
+        await add_blob_references(db, stored_files)
+        await db.flush()
+
+        # Keep conversation summary in the same transaction as the message
+        await record_message_sent(db, db_message)
+        seq = await append_event(db, recipient_id, NEW_MESSAGE, db_message.id)
+
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        await discard_uploads(stored_files)
+        if client_id is None:
+            raise
+        # A concurrent retry with the same key won the insert
+        existing = await get_message_by_client_id(db, sender_id, client_id)
+        if existing is None:
+            raise
+        return existing, None
+    except BaseException:
+        await db.rollback()
+        await discard_uploads(stored_files)
+        raise
+
+    # Identical content is stored once; files land only after commit
+    await publish_uploads(stored_files)
+    thumbnails.enqueue(
+        attachment.id for attachment in db_message.attachments
+        if attachment.thumbnail_status == THUMBNAIL_PENDING
+    )
+
+    return await load_message(db, db_message.id), seq
+
+
+def event_frame(event_type: str, seq: int, message_id: int, message: Any) -> dict:
+    """WebSocket frame of a message event; live and replayed frames are alike."""
+    if event_type == MESSAGE_DELETED:
+        return {"type": event_type, "seq": seq, "message_id": message_id}
+    return {"type": event_type, "seq": seq, "message": message}
+
+
+async def sync_events(db: AsyncSession, user_id: int, since: Optional[int], limit: int = SYNC_PAGE_SIZE) -> dict:
+    """Message events a client missed after seq since, as WebSocket frames.
+
+    Replayed frames carry the message as it is now. Without since only the
+    current seq is returned, to start tracking from. full_resync means the
+    log no longer reaches back to since; has_more asks for another page
+    from the returned seq.
+    """
+    current_seq, events = await read_events(db, user_id, since, limit)
+    if events is None:
+        return {"seq": current_seq, "events": [], "full_resync": True, "has_more": False}
+
+    has_more = len(events) > limit
+    events = events[:limit]
+    message_ids = {event.message_id for event in events if event.type != MESSAGE_DELETED}
+    messages = {}
+    if message_ids:
+        messages = {message.id: message for message in (await db.scalars(
+            select(Message).filter(Message.id.in_(message_ids)).options(
+                selectinload(Message.sender),
+                selectinload(Message.recipient),
+                selectinload(Message.attachments)
+            )
+        )).all()}
+
+    frames: List[dict] = []
+    for event in events:
+        encoded = None
+        if event.type != MESSAGE_DELETED:
+            message = messages.get(event.message_id)
+            if message is None:
+                continue
+            encoded = message_fragment(message)
+        frames.append(event_frame(event.type, event.seq, event.message_id, encoded))
+    return {
+        "seq": events[-1].seq if events else current_seq,
+        "events": frames,
+        "full_resync": False,
+        "has_more": has_more,
+    }
@@ -0,0 +1,192 @@
+import logging
+from typing import List
+from sqlalchemy import BigInteger, inspect, select, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from conversations import backfill_conversations
+from models import (
+    Base, Message, MessageAttachment, MESSAGE_SEARCH_DDL, MESSAGE_SEARCH_REINDEX, USER_SEARCH_DDL, USER_SEARCH_REINDEX
+)
+
+logger = logging.getLogger(__name__)
+
+# Columns added to tables that predate them: (table, column, definition).
+# Base.metadata.create_all creates missing tables but never alters existing
+# ones, so databases created before these columns get them from here.
+ADDED_COLUMNS = [
+    # Event log sequence (/sync)
+    ("users", "event_seq", "INTEGER NOT NULL DEFAULT 0"),
+    # Conversation summaries and keyset pagination
+    ("messages", "conversation_id", "INTEGER REFERENCES conversations (id)"),
+    # Idempotent sends
+    ("messages", "client_id", "VARCHAR(64)"),
+    # Resumable uploads, content-addressed storage and thumbnails
+    ("message_attachments", "uploaded_by_id", "INTEGER REFERENCES users (id)"),
+    ("message_attachments", "sha256", "VARCHAR(64)"),
+    ("message_attachments", "thumbnail_status", "VARCHAR(16)"),
+    ("message_attachments", "thumbnail_path", "VARCHAR(500)"),
+    ("message_attachments", "thumbnail_width", "INTEGER"),
+    ("message_attachments", "thumbnail_height", "INTEGER"),
+]
+
+# Tables whose model indexes are created when missing
+INDEXED_TABLES = ("messages", "message_attachments")
+
+# Unique constraints added to existing tables: name -> (table, columns)
+ADDED_UNIQUE_CONSTRAINTS = {
+    "uq_messages_sender_client_id": ("messages", ("sender_id", "client_id")),
+}
+
+# Search indexes created with their tables by models.py: name -> (table,
+# what marks them present per dialect, DDL per dialect, statements that
+# index the rows already there). A "table" marker is a table of that name,
+# an "index" marker an index on the table.
+SEARCH_INDEXES = {
+    "username search index": (
+        "users",
+        {"sqlite": ("table", "users_search"), "postgresql": ("index", "ix_users_username_trgm")},
+        USER_SEARCH_DDL,
+        USER_SEARCH_REINDEX,
+    ),
+    "message search index": (
+        "messages",
+        {"sqlite": ("table", "messages_search"), "postgresql": ("index", "ix_messages_search_vector")},
+        MESSAGE_SEARCH_DDL,
+        MESSAGE_SEARCH_REINDEX,
+    ),
+}
+
+
+async def upgrade_database(engine: AsyncEngine) -> List[str]:
+    """Create missing tables and bring older ones and their rows up to date.
+
+    Runs on every start and before every manage.py command; returns the
+    applied steps.
+    """
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        applied = await conn.run_sync(upgrade_schema)
+    async with AsyncSession(bind=engine, autoflush=False, expire_on_commit=False) as db:
+        applied += await upgrade_data(db)
+    return applied
+
+
+async def upgrade_data(db: AsyncSession) -> List[str]:
+    """Fill in what rows written by earlier versions lack.
+
+    Messages from before conversations have no conversation_id, which the
+    chat list, history pages and search all go through. New messages always
+    get one, so this is a single indexed lookup once done.
+    """
+    unlinked = select(Message.id).where(Message.conversation_id.is_(None)).limit(1)
+    if await db.scalar(unlinked) is None:
+        return []
+    try:
+        count = await backfill_conversations(db)
+    except IntegrityError:
+        # Another worker starting at the same time created the conversations
+        await db.rollback()
+        if await db.scalar(unlinked) is None:
+            return []
+        count = await backfill_conversations(db)
+    logger.info(f"Data upgrade: backfilled {count} conversations")
+    return ["backfill conversations"]
+
+
+def upgrade_schema(conn: Connection) -> List[str]:
+    """Bring tables created by earlier versions up to date with the models.
+
+    Runs after create_all, in the caller's transaction. Every step checks
+    the live schema first, so this is a no-op on an up-to-date or fresh
+    database and safe to run on every start. Returns the applied steps.
+    """
+    dialect = conn.dialect.name
+    applied: List[str] = []
+
+    def execute(step: str, statement: str):
+        conn.execute(text(statement))
+        applied.append(step)
+        logger.info(f"Schema upgrade: {step}")
+
+    inspector = inspect(conn)
+    for table, column, definition in ADDED_COLUMNS:
+        existing = {c["name"] for c in inspector.get_columns(table)}
+        if column not in existing:
+            execute(f"add {table}.{column}", f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    # Finalized resumable uploads have no message yet; attachment sizes
+    # past 2 GiB need a 64-bit column
+    inspector = inspect(conn)
+    columns = {c["name"]: c for c in inspector.get_columns("message_attachments")}
+    if not columns["message_id"]["nullable"]:
+        if dialect == "sqlite":
+            _rebuild_sqlite_table(conn, MessageAttachment.__table__)
+            applied.append("rebuild message_attachments")
+            logger.info("Schema upgrade: rebuild message_attachments")
+        else:
+            execute(
+                "make message_attachments.message_id nullable",
+                "ALTER TABLE message_attachments ALTER COLUMN message_id DROP NOT NULL"
+            )
+    if dialect == "postgresql" and not isinstance(columns["file_size"]["type"], BigInteger):
+        execute(
+            "widen message_attachments.file_size",
+            "ALTER TABLE message_attachments ALTER COLUMN file_size TYPE BIGINT"
+        )
+
+    inspector = inspect(conn)
+    for name in INDEXED_TABLES:
+        existing = {index["name"] for index in inspector.get_indexes(name)}
+        for index in Base.metadata.tables[name].indexes:
+            if index.name not in existing:
+                index.create(conn)
+                applied.append(f"create index {index.name}")
+                logger.info(f"Schema upgrade: create index {index.name}")
+
+    for name, (table, constraint_columns) in ADDED_UNIQUE_CONSTRAINTS.items():
+        existing = {c["name"] for c in inspector.get_unique_constraints(table)}
+        existing |= {index["name"] for index in inspector.get_indexes(table)}
+        if name not in existing:
+            column_list = ", ".join(constraint_columns)
+            if dialect == "sqlite":
+                # SQLite can't add constraints; a unique index enforces the same
+                statement = f"CREATE UNIQUE INDEX {name} ON {table} ({column_list})"
+            else:
+                statement = f"ALTER TABLE {table} ADD CONSTRAINT {name} UNIQUE ({column_list})"
+            execute(f"add unique constraint {name}", statement)
+
+    # Search is served only from these indexes, so a database that predates
+    # them gets them here, with its existing rows indexed
+    for name, (table, markers, ddl, reindex) in SEARCH_INDEXES.items():
+        if dialect not in markers or _has_marker(conn, table, markers[dialect]):
+            continue
+        for statement in ddl[dialect] + reindex.get(dialect, []):
+            conn.execute(text(statement))
+        applied.append(f"create {name}")
+        logger.info(f"Schema upgrade: create {name}")
+
+    return applied
+
+
+def _has_marker(conn: Connection, table: str, marker) -> bool:
+    kind, name = marker
+    inspector = inspect(conn)
+    if kind == "table":
+        return name in inspector.get_table_names()
+    return name in {index["name"] for index in inspector.get_indexes(table)}
+
+
+def _rebuild_sqlite_table(conn: Connection, table):
+    """Recreate a SQLite table from its model, keeping its rows.
+
+    SQLite can't change a column's constraints in place. Indexes are
+    dropped first since their names are global, not per table.
+    """
+    for index in inspect(conn).get_indexes(table.name):
+        conn.execute(text(f"DROP INDEX {index['name']}"))
+    conn.execute(text(f"ALTER TABLE {table.name} RENAME TO {table.name}_old"))
+    table.create(conn)
+    column_list = ", ".join(column.name for column in table.columns)
+    conn.execute(text(f"INSERT INTO {table.name} ({column_list}) SELECT {column_list} FROM {table.name}_old"))
+    conn.execute(text(f"DROP TABLE {table.name}_old"))
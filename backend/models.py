@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, Integer, String, DateTime, Text, ForeignKey, Table
+from sqlalchemy import BigInteger, Boolean, Column, DDL, Integer, String, DateTime, Text, ForeignKey, Table, Index, UniqueConstraint, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -8,25 +8,77 @@ Base = declarative_base()
 
 class User(Base):
     __tablename__ = "users"
+    # Load server-generated defaults on flush; no lazy refresh under asyncio
+    __mapper_args__ = {"eager_defaults": True}
     
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String(50), unique=True, index=True, nullable=False)
     email = Column(String(100), unique=True, index=True, nullable=False)
     hashed_password = Column(String(255), nullable=False)
     is_active = Column(Boolean, default=True)
+    # Sequence number of the user's latest event in user_events
+    event_seq = Column(Integer, default=0, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relationships
     sent_messages = relationship("Message", foreign_keys="Message.sender_id", back_populates="sender")
     received_messages = relationship("Message", foreign_keys="Message.recipient_id", back_populates="recipient")
 
+# Username search indexes used by user_search.py, per dialect. Created with
+# the users table; migrations.upgrade_schema adds them to an existing
+# database.
+USER_SEARCH_DDL = {
+    "postgresql": [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        # Exact and prefix ranges, ordered bytewise
+        'CREATE INDEX IF NOT EXISTS ix_users_username_lower ON users ((lower(username) COLLATE "C"))',
+        # Substring matches
+        "CREATE INDEX IF NOT EXISTS ix_users_username_trgm ON users USING gin (lower(username) gin_trgm_ops)",
+    ],
+    "sqlite": [
+        "CREATE INDEX IF NOT EXISTS ix_users_username_lower ON users (lower(username))",
+        # Trigram full-text table over users.username, kept in sync by triggers
+        "CREATE VIRTUAL TABLE IF NOT EXISTS users_search USING fts5("
+        "username, content='users', content_rowid='id', tokenize='trigram')",
+        "CREATE TRIGGER IF NOT EXISTS users_search_ai AFTER INSERT ON users BEGIN "
+        "INSERT INTO users_search(rowid, username) VALUES (new.id, new.username); END",
+        "CREATE TRIGGER IF NOT EXISTS users_search_ad AFTER DELETE ON users BEGIN "
+        "INSERT INTO users_search(users_search, rowid, username) VALUES ('delete', old.id, old.username); END",
+        "CREATE TRIGGER IF NOT EXISTS users_search_au AFTER UPDATE OF username ON users BEGIN "
+        "INSERT INTO users_search(users_search, rowid, username) VALUES ('delete', old.id, old.username); "
+        "INSERT INTO users_search(rowid, username) VALUES (new.id, new.username); END",
+    ],
+}
+
+# Indexes the users already there once the index is added to a database
+USER_SEARCH_REINDEX = {
+    "sqlite": ["INSERT INTO users_search(users_search) VALUES ('rebuild')"],
+}
+
+for _dialect, _statements in USER_SEARCH_DDL.items():
+    for _statement in _statements:
+        event.listen(User.__table__, "after_create", DDL(_statement).execute_if(dialect=_dialect))
+
 class Message(Base):
     __tablename__ = "messages"
+    # Load server-generated defaults on flush; no lazy refresh under asyncio
+    __mapper_args__ = {"eager_defaults": True}
+    __table_args__ = (
+        # Range counts of unread messages past a read watermark
+        Index("ix_messages_sender_recipient_id", "sender_id", "recipient_id", "id"),
+        # Keyset pagination of conversation history
+        Index("ix_messages_conversation_created_id", "conversation_id", "created_at", "id"),
+        # Idempotent sends: a client retrying with the same key gets the same message
+        UniqueConstraint("sender_id", "client_id", name="uq_messages_sender_client_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     content = Column(Text, nullable=False)
     sender_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     recipient_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=True)
+    # Idempotency key supplied by the sending client
+    client_id = Column(String(64), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     is_edited = Column(Boolean, default=False)
@@ -37,17 +89,151 @@ class Message(Base):
     recipient = relationship("User", foreign_keys=[recipient_id], back_populates="received_messages")
     attachments = relationship("MessageAttachment", back_populates="message", cascade="all, delete-orphan")
 
+# Text search configuration of message content (no stemming, any language)
+MESSAGE_SEARCH_CONFIG = "simple"
+
+# Full-text index of message content used by message_search.py, per dialect.
+# Soft-deleted messages drop out of the index. Created with the messages
+# table; migrations.upgrade_schema adds it to an existing database.
+MESSAGE_SEARCH_DDL = {
+    "postgresql": [
+        # Computed in the INSERT itself; GIN's pending list keeps index
+        # maintenance off the send path
+        "ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+        f"CASE WHEN is_deleted THEN NULL ELSE to_tsvector('{MESSAGE_SEARCH_CONFIG}', content) END) STORED",
+        "CREATE INDEX IF NOT EXISTS ix_messages_search_vector ON messages USING gin (search_vector)",
+    ],
+    "sqlite": [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS messages_search USING fts5("
+        "content, content='messages', content_rowid='id')",
+        "CREATE TRIGGER IF NOT EXISTS messages_search_ai AFTER INSERT ON messages "
+        "WHEN NOT coalesce(new.is_deleted, 0) BEGIN "
+        "INSERT INTO messages_search(rowid, content) VALUES (new.id, new.content); END",
+        "CREATE TRIGGER IF NOT EXISTS messages_search_ad AFTER DELETE ON messages "
+        "WHEN NOT coalesce(old.is_deleted, 0) BEGIN "
+        "INSERT INTO messages_search(messages_search, rowid, content) VALUES ('delete', old.id, old.content); END",
+        "CREATE TRIGGER IF NOT EXISTS messages_search_au AFTER UPDATE OF content, is_deleted ON messages BEGIN "
+        "INSERT INTO messages_search(messages_search, rowid, content) "
+        "SELECT 'delete', old.id, old.content WHERE NOT coalesce(old.is_deleted, 0); "
+        "INSERT INTO messages_search(rowid, content) "
+        "SELECT new.id, new.content WHERE NOT coalesce(new.is_deleted, 0); END",
+    ],
+}
+
+# Indexes the messages already there, leaving out deleted ones (Postgres
+# fills the generated column when it is added)
+MESSAGE_SEARCH_REINDEX = {
+    "sqlite": [
+        "INSERT INTO messages_search(messages_search) VALUES ('delete-all')",
+        "INSERT INTO messages_search(rowid, content) "
+        "SELECT id, content FROM messages WHERE NOT coalesce(is_deleted, 0)",
+    ],
+}
+
+for _dialect, _statements in MESSAGE_SEARCH_DDL.items():
+    for _statement in _statements:
+        event.listen(Message.__table__, "after_create", DDL(_statement).execute_if(dialect=_dialect))
+
 class MessageAttachment(Base):
     __tablename__ = "message_attachments"
+    # Load server-generated defaults on flush; no lazy refresh under asyncio
+    __mapper_args__ = {"eager_defaults": True}
     
     id = Column(Integer, primary_key=True, index=True)
-    message_id = Column(Integer, ForeignKey("messages.id"), nullable=False)
-    filename = Column(String(255), nullable=False)
+    # Null for finalized resumable uploads not yet sent with a message
+    message_id = Column(Integer, ForeignKey("messages.id"), nullable=True, index=True)
+    uploaded_by_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    filename = Column(String(255), nullable=False, index=True)
     original_filename = Column(String(255), nullable=False)
     file_path = Column(String(500), nullable=False)
-    file_size = Column(Integer, nullable=False)
+    file_size = Column(BigInteger, nullable=False)
     content_type = Column(String(100), nullable=True)
+    # References blobs.sha256; no FK so soft-deleted messages can outlive the blob
+    sha256 = Column(String(64), nullable=True, index=True)
+    # Thumbnail pipeline: pending, ready or failed; null when not applicable
+    thumbnail_status = Column(String(16), nullable=True, index=True)
+    thumbnail_path = Column(String(500), nullable=True)
+    thumbnail_width = Column(Integer, nullable=True)
+    thumbnail_height = Column(Integer, nullable=True)
     uploaded_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relationships
-    message = relationship("Message", back_populates="attachments")
\ No newline at end of file
+    message = relationship("Message", back_populates="attachments")
+
+class Conversation(Base):
+    __tablename__ = "conversations"
+    # Load server-generated defaults on flush; no lazy refresh under asyncio
+    __mapper_args__ = {"eager_defaults": True}
+    __table_args__ = (
+        UniqueConstraint("user_a_id", "user_b_id", name="uq_conversations_pair"),
+        Index("ix_conversations_user_a_activity", "user_a_id", "last_activity_at"),
+        Index("ix_conversations_user_b_activity", "user_b_id", "last_activity_at"),
+    )
+    
+    # Participants are stored ordered so that user_a_id < user_b_id
+    id = Column(Integer, primary_key=True, index=True)
+    user_a_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_b_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    last_message_id = Column(
+        Integer,
+        ForeignKey("messages.id", use_alter=True, name="fk_conversations_last_message_id"),
+        nullable=True
+    )
+    last_activity_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    # Messages waiting to be read by user_a / user_b
+    unread_a = Column(Integer, default=0, nullable=False)
+    unread_b = Column(Integer, default=0, nullable=False)
+    # Read watermarks: last message id read by user_a / user_b
+    last_read_a_id = Column(Integer, nullable=True)
+    last_read_b_id = Column(Integer, nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
+    # Relationships
+    user_a = relationship("User", foreign_keys=[user_a_id])
+    user_b = relationship("User", foreign_keys=[user_b_id])
+    last_message = relationship("Message", foreign_keys=[last_message_id])
+
+class Blob(Base):
+    __tablename__ = "blobs"
+    # Load server-generated defaults on flush; no lazy refresh under asyncio
+    __mapper_args__ = {"eager_defaults": True}
+    
+    # Content-addressed attachment storage shared by identical uploads
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    ref_count = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class UploadSession(Base):
+    __tablename__ = "upload_sessions"
+    # Load server-generated defaults on flush; no lazy refresh under asyncio
+    __mapper_args__ = {"eager_defaults": True}
+    
+    # Resumable upload in progress; chunks are appended to a file in uploads/tmp
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    filename = Column(String(255), nullable=False)
+    content_type = Column(String(100), nullable=True)
+    total_size = Column(BigInteger, nullable=False)
+    received_size = Column(BigInteger, default=0, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Pushed back on every chunk; expired sessions are deleted with their data
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+class UserEvent(Base):
+    __tablename__ = "user_events"
+    # Load server-generated defaults on flush; no lazy refresh under asyncio
+    __mapper_args__ = {"eager_defaults": True}
+    __table_args__ = (
+        # Reads of a user's events after a sequence number
+        UniqueConstraint("user_id", "seq", name="uq_user_events_user_seq"),
+    )
+    
+    # Message notification delivered to user_id, replayed by /sync after a reconnect
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    # Gapless per user: taken from users.event_seq in the event's transaction
+    seq = Column(Integer, nullable=False)
+    type = Column(String(32), nullable=False)
+    message_id = Column(Integer, ForeignKey("messages.id"), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
\ No newline at end of file
@@ -0,0 +1,50 @@
+import base64
+from typing import Tuple
+
+# Cursor directions
+BEFORE = "before"
+AFTER = "after"
+
+
+def encode_cursor(direction: str, message_id: int) -> str:
+    """Encode an opaque pagination cursor."""
+    raw = f"{direction}:{message_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """Decode a pagination cursor into (direction, message_id).
+
+    Raises ValueError for malformed cursors.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        direction, message_id = base64.urlsafe_b64decode(padded).decode().split(":")
+        message_id = int(message_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if direction not in (BEFORE, AFTER):
+        raise ValueError("Invalid cursor")
+    return direction, message_id
+
+
+def encode_search_cursor(tier: int, user_id: int) -> str:
+    """Encode a user search cursor: the match tier and last user returned."""
+    raw = f"search:{tier}:{user_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_search_cursor(cursor: str) -> Tuple[int, int]:
+    """Decode a user search cursor into (tier, user_id).
+
+    Raises ValueError for malformed cursors.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        kind, tier, user_id = base64.urlsafe_b64decode(padded).decode().split(":")
+        tier, user_id = int(tier), int(user_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if kind != "search":
+        raise ValueError("Invalid cursor")
+    return tier, user_id
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Set
+from decouple import config
+from fastapi import WebSocket
+from serialization import dumps
+
+if TYPE_CHECKING:
+    from websocket_manager import ConnectionManager
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_FLUSH_INTERVAL = config("PRESENCE_FLUSH_INTERVAL", default=0.25, cast=float)  # seconds
+# A user whose last socket closed is reported offline only after this long,
+# so reconnects and page reloads don't flap
+PRESENCE_GRACE_PERIOD = config("PRESENCE_GRACE_PERIOD", default=5.0, cast=float)  # seconds
+PRESENCE_MAX_SUBSCRIPTIONS = config("PRESENCE_MAX_SUBSCRIPTIONS", default=1000, cast=int)  # per connection
+
+
+class PresenceHub:
+    """Pushes batched online/offline diffs to connections subscribed to users.
+
+    Subscriptions are kept in a reverse index (watched user -> sockets), so
+    a status change only touches the connections interested in it. Changes
+    are collected and sent once per flush interval, one frame per socket.
+    """
+
+    def __init__(self, manager: "ConnectionManager",
+                 flush_interval: float = PRESENCE_FLUSH_INTERVAL,
+                 grace_period: float = PRESENCE_GRACE_PERIOD,
+                 max_subscriptions: int = PRESENCE_MAX_SUBSCRIPTIONS):
+        self.manager = manager
+        self.flush_interval = flush_interval
+        self.grace_period = grace_period
+        self.max_subscriptions = max_subscriptions
+        # watched user -> subscribed sockets, and the reverse
+        self.subscribers: Dict[int, Set[WebSocket]] = {}
+        self.subscriptions: Dict[WebSocket, Set[int]] = {}
+        # Debounced status: users reported online to subscribers
+        self.visible: Set[int] = set()
+        # user_id -> status changed since the last flush
+        self.changed: Dict[int, bool] = {}
+        self.offline_timers: Dict[int, asyncio.TimerHandle] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.diffs_sent = 0
+        self.flaps_suppressed = 0
+
+    async def start(self):
+        """Start periodic flushing."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for timer in self.offline_timers.values():
+            timer.cancel()
+        self.offline_timers.clear()
+
+    def is_online(self, user_id: int) -> bool:
+        return user_id in self.visible or self.manager.is_user_online(user_id)
+
+    def subscribe(self, websocket: WebSocket, user_ids: Iterable[int]) -> List[int]:
+        """Watch users; returns the ones newly subscribed."""
+        watched = self.subscriptions.setdefault(websocket, set())
+        added = []
+        for user_id in user_ids:
+            if len(watched) >= self.max_subscriptions:
+                break
+            if user_id not in watched:
+                watched.add(user_id)
+                self.subscribers.setdefault(user_id, set()).add(websocket)
+                added.append(user_id)
+        return added
+
+    def unsubscribe(self, websocket: WebSocket, user_ids: Iterable[int]):
+        watched = self.subscriptions.get(websocket)
+        if watched is None:
+            return
+        for user_id in user_ids:
+            if user_id in watched:
+                watched.discard(user_id)
+                self._remove_subscriber(user_id, websocket)
+
+    def drop(self, websocket: WebSocket):
+        """Forget all subscriptions of a closed socket."""
+        for user_id in self.subscriptions.pop(websocket, ()):
+            self._remove_subscriber(user_id, websocket)
+
+    def _remove_subscriber(self, user_id: int, websocket: WebSocket):
+        sockets = self.subscribers.get(user_id)
+        if sockets is not None:
+            sockets.discard(websocket)
+            if not sockets:
+                del self.subscribers[user_id]
+
+    def status_changed(self, user_id: int):
+        """Called when a user gains their first or loses their last socket on any node."""
+        if self.manager.is_user_online(user_id):
+            timer = self.offline_timers.pop(user_id, None)
+            if timer is not None:
+                # Back within the grace period; subscribers never saw them leave
+                timer.cancel()
+                self.flaps_suppressed += 1
+            if user_id not in self.visible:
+                self.visible.add(user_id)
+                self.changed[user_id] = True
+        elif user_id in self.visible and user_id not in self.offline_timers:
+            self.offline_timers[user_id] = asyncio.get_running_loop().call_later(
+                self.grace_period, self._expire, user_id
+            )
+
+    def _expire(self, user_id: int):
+        self.offline_timers.pop(user_id, None)
+        if user_id in self.visible and not self.manager.is_user_online(user_id):
+            self.visible.discard(user_id)
+            self.changed[user_id] = False
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Presence flush failed: {e}")
+
+    def flush(self):
+        """Send each subscriber the changes to the users it watches."""
+        if not self.changed:
+            return
+        batch, self.changed = self.changed, {}
+        diffs: Dict[WebSocket, Dict[int, bool]] = {}
+        for user_id, online in batch.items():
+            for websocket in self.subscribers.get(user_id, ()):
+                diffs.setdefault(websocket, {})[user_id] = online
+        for websocket, diff in diffs.items():
+            self.send(websocket, diff)
+            self.diffs_sent += 1
+
+    def send(self, websocket: WebSocket, statuses: Dict[int, bool]):
+        connection = self.manager.connections.get(websocket)
+        if connection is not None:
+            connection.enqueue(dumps({
+                "type": "presence",
+                "online": [user_id for user_id, online in statuses.items() if online],
+                "offline": [user_id for user_id, online in statuses.items() if not online]
+            }))
+
+    def stats(self) -> dict:
+        return {
+            "subscribed_connections": len(self.subscriptions),
+            "watched_users": len(self.subscribers),
+            "online_users": len(self.visible),
+            "pending_changes": len(self.changed),
+            "pending_offline": len(self.offline_timers),
+            "diffs_sent": self.diffs_sent,
+            "flaps_suppressed": self.flaps_suppressed,
+        }
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+from decouple import config
+from database import SessionLocal
+from conversations import advance_read_watermark
+
+logger = logging.getLogger(__name__)
+
+READ_RECEIPT_FLUSH_INTERVAL = config("READ_RECEIPT_FLUSH_INTERVAL", default=1.0, cast=float)
+
+
+class ReadReceiptWriter:
+    """Coalesces read receipts in memory and persists them in batches.
+
+    Each flush issues at most one UPDATE per (reader, partner) conversation,
+    however many receipts arrived during the interval.
+    """
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        # (reader_id, partner_id) -> highest message id read
+        self.pending: Dict[Tuple[int, int], int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def mark_read(self, reader_id: int, partner_id: int, message_id: int):
+        """Queue a read receipt; only the highest message id is kept."""
+        key = (reader_id, partner_id)
+        if message_id > self.pending.get(key, 0):
+            self.pending[key] = message_id
+
+    async def start(self):
+        """Start periodic flushing."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop periodic flushing and persist what is still pending."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Read receipt flush failed: {e}")
+
+    async def flush(self):
+        """Persist pending watermarks."""
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        try:
+            await self._write(batch)
+        except Exception:
+            # Put the batch back so the next flush retries it
+            for (reader_id, partner_id), message_id in batch.items():
+                self.mark_read(reader_id, partner_id, message_id)
+            raise
+
+    async def _write(self, batch: Dict[Tuple[int, int], int]):
+        async with SessionLocal() as db:
+            for (reader_id, partner_id), message_id in batch.items():
+                await advance_read_watermark(db, reader_id, partner_id, message_id)
+            await db.commit()
+
+
+# Global read receipt writer instance
+read_receipts = ReadReceiptWriter(READ_RECEIPT_FLUSH_INTERVAL)
@@ -1,41 +1,66 @@
 import os
-import uuid
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_
+from datetime import datetime, timezone
+from typing import List, Optional, Union
+from fastapi import APIRouter, Depends, HTTPException, Query, status, UploadFile, File, Form, Request, Response
+from sqlalchemy import or_, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased, joinedload, selectinload
 from database import get_db
-from models import User, Message, MessageAttachment
-from schemas import MessageResponse, MessageCreate, MessageUpdate, ChatResponse
-from auth import get_current_active_user
+from models import User, Message, MessageAttachment, Conversation
+from schemas import (
+    MessageResponse,
+    MessageCreate,
+    MessageUpdate,
+    ChatResponse,
+    CompactMessageList,
+    MessageSearchResult,
+    AttachmentLinkResponse
+)
+from auth import get_current_active_user, get_current_user_from_token, optional_oauth2_scheme
+from downloads import file_response, sign_download_path, verify_download_signature
+from thumbnails import THUMBNAIL_READY
+from pagination import BEFORE, AFTER, encode_cursor, decode_cursor
+from storage import (
+    UPLOAD_DIR,
+    save_uploads,
+    release_blob_references,
+    collect_blobs
+)
+from conversations import (
+    get_conversation,
+    link_legacy_messages,
+    get_unread_count,
+    record_message_updated,
+    record_message_deleted
+)
+from messaging import create_message, event_frame, load_message
+from event_log import NEW_MESSAGE, MESSAGE_UPDATED, MESSAGE_DELETED, append_event
+from message_search import search_messages
+from serialization import (
+    json_response,
+    serialize_user,
+    serialize_compact_message,
+    user_fragment,
+    message_fragment,
+    invalidate_message
+)
 
 router = APIRouter(prefix="/messages", tags=["messages"])
 
 # Create uploads directory if it doesn't exist
-UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 # WebSocket notification functions (will be imported dynamically to avoid circular imports)
-async def send_websocket_notification(notification_type: str, message_data: dict, recipient_id: int):
-    """Send WebSocket notification if manager is available."""
+async def send_websocket_notification(notification_type: str, message_id: int, recipient_id: int, seq: int, message=None):
+    """Send WebSocket notification if manager is available.
+    
+    seq is the event's position in the recipient's event log; clients
+    that see a gap fetch the missed events from /sync. message is the
+    encoded message, not needed for deletions.
+    """
     try:
         from websocket_manager import manager
-        if notification_type == "new_message":
-            await manager.send_to_user({
-                "type": "new_message",
-                "message": message_data
-            }, recipient_id)
-        elif notification_type == "message_updated":
-            await manager.send_to_user({
-                "type": "message_updated",
-                "message": message_data
-            }, recipient_id)
-        elif notification_type == "message_deleted":
-            await manager.send_to_user({
-                "type": "message_deleted",
-                "message_id": message_data
-            }, recipient_id)
+        await manager.send_to_user(event_frame(notification_type, seq, message_id, message), recipient_id)
     except ImportError:
         # WebSocket manager not available, skip notification
         pass
@@ -45,181 +70,229 @@ async def send_websocket_notification(notification_type: str, message_data: dict
         logger = logging.getLogger(__name__)
         logger.error(f"WebSocket notification failed: {e}")
 
-def serialize_message_for_websocket(db_message: Message, sender: User, recipient: User) -> dict:
-    """Convert message to dictionary for WebSocket transmission."""
-    return {
-        "id": db_message.id,
-        "content": db_message.content,
-        "sender_id": db_message.sender_id,
-        "recipient_id": db_message.recipient_id,
-        "created_at": db_message.created_at.isoformat(),
-        "updated_at": db_message.updated_at.isoformat() if db_message.updated_at else None,
-        "is_edited": db_message.is_edited,
-        "is_deleted": db_message.is_deleted,
-        "sender": {
-            "id": sender.id,
-            "username": sender.username,
-            "email": sender.email,
-            "is_active": sender.is_active,
-            "created_at": sender.created_at.isoformat()
-        },
-        "recipient": {
-            "id": recipient.id,
-            "username": recipient.username,
-            "email": recipient.email,
-            "is_active": recipient.is_active,
-            "created_at": recipient.created_at.isoformat()
-        },
-        "attachments": [
-            {
-                "id": att.id,
-                "filename": att.filename,
-                "original_filename": att.original_filename,
-                "file_size": att.file_size,
-                "content_type": att.content_type,
-                "uploaded_at": att.uploaded_at.isoformat()
-            } for att in db_message.attachments
-        ]
-    }
-
 @router.post("/", response_model=MessageResponse)
 async def send_message(
     content: str = Form(...),
     recipient_id: int = Form(...),
     files: List[UploadFile] = File(default=[]),
+    attachment_ids: List[int] = Form(default=[]),
+    client_id: Optional[str] = Form(default=None),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """Send a new message with optional file attachments."""
+    """Send a new message with optional file attachments.
+    
+    Large files can be uploaded beforehand through /uploads and referenced
+    by the attachment ids returned when those uploads were completed.
+    A client_id makes retries idempotent: resending it returns the message
+    created the first time.
+    """
     
     # Check if recipient exists
-    recipient = db.query(User).filter(User.id == recipient_id).first()
+    recipient = await db.get(User, recipient_id)
     if not recipient:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Recipient not found"
         )
     
-    # Create message
-    db_message = Message(
-        content=content,
-        sender_id=current_user.id,
-        recipient_id=recipient_id
+    # Write attachments before the message exists, so a failed or
+    # oversized upload never leaves a message behind
+    stored_files = await save_uploads(files)
+    db_message, seq = await create_message(
+        db, current_user.id, recipient, content, stored_files, attachment_ids, client_id
     )
     
-    db.add(db_message)
-    db.commit()
-    db.refresh(db_message)
-    
-    # Handle file attachments
-    for file in files:
-        if file.filename:
-            # Generate unique filename
-            file_extension = os.path.splitext(file.filename)[1]
-            unique_filename = f"{uuid.uuid4()}{file_extension}"
-            file_path = os.path.join(UPLOAD_DIR, unique_filename)
-            
-            # Save file
-            with open(file_path, "wb") as buffer:
-                content_bytes = await file.read()
-                buffer.write(content_bytes)
-            
-            # Create attachment record
-            attachment = MessageAttachment(
-                message_id=db_message.id,
-                filename=unique_filename,
-                original_filename=file.filename,
-                file_path=file_path,
-                file_size=len(content_bytes),
-                content_type=file.content_type
-            )
-            
-            db.add(attachment)
-    
-    db.commit()
-    db.refresh(db_message)
-    
-    # Send WebSocket notification to recipient
-    message_dict = serialize_message_for_websocket(db_message, current_user, recipient)
-    await send_websocket_notification("new_message", message_dict, recipient_id)
+    # Serialized once for the response and the recipient's notification
+    message = message_fragment(db_message)
+    if seq is not None:
+        await send_websocket_notification(NEW_MESSAGE, db_message.id, recipient_id, seq, message)
     
-    return db_message
+    return json_response(message)
 
 @router.get("/chats", response_model=List[ChatResponse])
-def get_user_chats(
+async def get_user_chats(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Get list of all chats for current user."""
     
-    # Get all users that have exchanged messages with current user
-    chat_users = db.query(User).filter(
+    await link_legacy_messages(db, current_user.id)
+    
+    # One indexed lookup on the conversation summaries, most recent first
+    conversations = (await db.scalars(select(Conversation).filter(
         or_(
-            User.id.in_(
-                db.query(Message.sender_id).filter(Message.recipient_id == current_user.id)
-            ),
-            User.id.in_(
-                db.query(Message.recipient_id).filter(Message.sender_id == current_user.id)
-            )
+            Conversation.user_a_id == current_user.id,
+            Conversation.user_b_id == current_user.id
         ),
-        User.id != current_user.id
-    ).all()
+        Conversation.user_a_id != Conversation.user_b_id
+    ).options(
+        joinedload(Conversation.user_a),
+        joinedload(Conversation.user_b),
+        joinedload(Conversation.last_message).options(
+            selectinload(Message.sender),
+            selectinload(Message.recipient),
+            selectinload(Message.attachments)
+        )
+    ).order_by(Conversation.last_activity_at.desc(), Conversation.id.desc()))).unique().all()
     
     chats = []
-    for user in chat_users:
-        # Get last message
-        last_message = db.query(Message).filter(
-            or_(
-                and_(Message.sender_id == current_user.id, Message.recipient_id == user.id),
-                and_(Message.sender_id == user.id, Message.recipient_id == current_user.id)
-            ),
-            Message.is_deleted == False
-        ).order_by(Message.created_at.desc()).first()
-        
-        # Count unread messages
-        unread_count = db.query(Message).filter(
-            Message.sender_id == user.id,
-            Message.recipient_id == current_user.id
-        ).count()
-        
-        chats.append(ChatResponse(
-            user=user,
-            last_message=last_message,
-            unread_count=unread_count
-        ))
+    for conversation in conversations:
+        partner = conversation.user_b if conversation.user_a_id == current_user.id else conversation.user_a
+        last_message = conversation.last_message
+        chats.append({
+            "user": user_fragment(partner),
+            "last_message": message_fragment(last_message) if last_message else None,
+            "unread_count": get_unread_count(conversation, current_user.id)
+        })
+    
+    return json_response(chats)
+
+@router.get("/search", response_model=List[MessageSearchResult])
+async def search_message_history(
+    response: Response,
+    q: str = Query(..., min_length=1, description="Words to find in message content"),
+    user_id: Optional[int] = Query(default=None, description="Only search the conversation with this user"),
+    limit: int = Query(default=20, ge=1, le=50),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Full-text search over the current user's conversations, newest first.
+    
+    Each hit carries a snippet with the matched terms highlighted. More
+    results continue from the cursor in the X-Next-Cursor header.
+    """
+    
+    before_id = None
+    if cursor is not None:
+        try:
+            direction, before_id = decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        if direction != BEFORE:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
     
-    return chats
+    hits = await search_messages(db, current_user.id, q, limit, user_id, before_id)
+    if len(hits) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(BEFORE, hits[-1][0].id)
+    
+    return json_response([
+        {"message": message_fragment(message), "snippet": snippet} for message, snippet in hits
+    ], response)
 
-@router.get("/{user_id}", response_model=List[MessageResponse])
-def get_messages_with_user(
+@router.get("/{user_id}", response_model=Union[List[MessageResponse], CompactMessageList])
+async def get_messages_with_user(
     user_id: int,
+    response: Response,
     skip: int = 0,
     limit: int = 50,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    compact: bool = False,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get messages between current user and specified user."""
+    """Get messages between current user and specified user, newest first.
     
-    messages = db.query(Message).filter(
-        or_(
-            and_(Message.sender_id == current_user.id, Message.recipient_id == user_id),
-            and_(Message.sender_id == user_id, Message.recipient_id == current_user.id)
-        ),
+    Pages either by skip/limit or by keyset: before_id/after_id, or the
+    opaque cursor returned in the X-Next-Cursor header. With compact=true
+    messages carry only user ids and the users are returned once in a map.
+    """
+    
+    if sum(value is not None for value in (before_id, after_id, cursor)) > 1:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Use only one of before_id, after_id and cursor"
+        )
+    
+    direction, anchor_id = None, None
+    if cursor is not None:
+        try:
+            direction, anchor_id = decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    elif before_id is not None:
+        direction, anchor_id = BEFORE, before_id
+    elif after_id is not None:
+        direction, anchor_id = AFTER, after_id
+    
+    conversation = await get_conversation(db, current_user.id, user_id)
+    if not conversation and await link_legacy_messages(db, current_user.id):
+        conversation = await get_conversation(db, current_user.id, user_id)
+    if not conversation:
+        return json_response({"messages": [], "users": {}} if compact else [])
+    
+    query = select(Message).filter(
+        Message.conversation_id == conversation.id,
         Message.is_deleted == False
-    ).order_by(Message.created_at.desc()).offset(skip).limit(limit).all()
+    ).options(selectinload(Message.attachments))
+    if not compact:
+        query = query.options(
+            selectinload(Message.sender),
+            selectinload(Message.recipient)
+        )
+    
+    if direction is None:
+        # Legacy offset paging
+        direction = BEFORE
+        query = query.order_by(
+            Message.created_at.desc(), Message.id.desc()
+        ).offset(skip).limit(limit)
+    else:
+        # Compare against the anchor row in SQL so the (conversation_id,
+        # created_at, id) index drives the range scan
+        anchor = aliased(Message)
+        anchor_key = select(anchor.created_at, anchor.id).where(
+            anchor.id == anchor_id,
+            anchor.conversation_id == conversation.id
+        ).scalar_subquery()
+        position = tuple_(Message.created_at, Message.id)
+        
+        if direction == BEFORE:
+            query = query.filter(position < anchor_key).order_by(
+                Message.created_at.desc(), Message.id.desc()
+            ).limit(limit)
+        else:
+            query = query.filter(position > anchor_key).order_by(
+                Message.created_at.asc(), Message.id.asc()
+            ).limit(limit)
+    
+    messages = list((await db.scalars(query)).all())
+    
+    # Cursor continues in the same direction from the last row fetched
+    if messages and len(messages) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(direction, messages[-1].id)
     
-    return messages
+    if direction == AFTER:
+        messages.reverse()
+    
+    if compact:
+        # Only the two participants can appear in a conversation
+        participants = {current_user.id: current_user}
+        if user_id != current_user.id and messages:
+            participants[user_id] = await db.get(User, user_id)
+        return json_response({
+            "messages": [serialize_compact_message(message) for message in messages],
+            "users": {
+                user_id: serialize_user(participant)
+                for user_id, participant in participants.items() if participant
+            }
+        }, response)
+    
+    return json_response([message_fragment(message) for message in messages], response)
 
 @router.put("/{message_id}", response_model=MessageResponse)
 async def update_message(
     message_id: int,
     message_update: MessageUpdate,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Update/edit a message."""
     
-    db_message = db.query(Message).filter(Message.id == message_id).first()
+    db_message = await load_message(db, message_id)
     if not db_message:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -234,29 +307,31 @@ async def update_message(
     
     db_message.content = message_update.content
     db_message.is_edited = True
+    await record_message_updated(db, db_message)
+    seq = await append_event(db, db_message.recipient_id, MESSAGE_UPDATED, db_message.id)
     
-    db.commit()
-    db.refresh(db_message)
+    await db.commit()
+    invalidate_message(message_id)
     
     # Get recipient for WebSocket notification
-    recipient = db.query(User).filter(User.id == db_message.recipient_id).first()
+    recipient = db_message.recipient
     
     # Send WebSocket notification to recipient
+    message = message_fragment(db_message)
     if recipient:
-        message_dict = serialize_message_for_websocket(db_message, current_user, recipient)
-        await send_websocket_notification("message_updated", message_dict, db_message.recipient_id)
+        await send_websocket_notification(MESSAGE_UPDATED, message_id, db_message.recipient_id, seq, message)
     
-    return db_message
+    return json_response(message)
 
 @router.delete("/{message_id}")
 async def delete_message(
     message_id: int,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Delete a message."""
     
-    db_message = db.query(Message).filter(Message.id == message_id).first()
+    db_message = await db.get(Message, message_id)
     if not db_message:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -270,22 +345,140 @@ async def delete_message(
         )
     
     recipient_id = db_message.recipient_id
-    db_message.is_deleted = True
-    db.commit()
-    
-    # Send WebSocket notification to recipient
-    await send_websocket_notification("message_deleted", message_id, recipient_id)
+    if not db_message.is_deleted:
+        db_message.is_deleted = True
+        await record_message_deleted(db, db_message)
+        seq = await append_event(db, recipient_id, MESSAGE_DELETED, message_id)
+        
+        # Deleted messages no longer hold their attachment blobs
+        blob_hashes = (await db.execute(
+            select(MessageAttachment.sha256).where(
+                MessageAttachment.message_id == message_id,
+                MessageAttachment.sha256.is_not(None)
+            )
+        )).scalars().all()
+        await release_blob_references(db, blob_hashes)
+        await db.commit()
+        invalidate_message(message_id)
+        
+        await collect_blobs(db, blob_hashes)
+        
+        # Send WebSocket notification to recipient
+        await send_websocket_notification(MESSAGE_DELETED, message_id, recipient_id, seq)
     
     return {"detail": "Message deleted successfully"}
 
-@router.get("/attachments/{filename}")
-def get_attachment(filename: str):
-    """Download message attachment."""
-    file_path = os.path.join(UPLOAD_DIR, filename)
-    if not os.path.exists(file_path):
+async def get_shared_attachment(db: AsyncSession, filename: str, user: Optional[User]) -> MessageAttachment:
+    """Find an attachment the user sent or received; 404 otherwise.
+    
+    Without a user, any attachment of a message that isn't deleted.
+    """
+    query = (
+        select(MessageAttachment)
+        .join(Message, Message.id == MessageAttachment.message_id)
+        .where(MessageAttachment.filename == filename, Message.is_deleted == False)
+        .limit(1)
+    )
+    if user is not None:
+        # Only participants of a conversation that shared the file may fetch it
+        query = query.where(or_(Message.sender_id == user.id, Message.recipient_id == user.id))
+    attachment = (await db.execute(query)).scalar()
+    if not attachment:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="File not found"
         )
+    return attachment
+
+async def get_downloadable_attachment(
+    filename: str,
+    request: Request,
+    expires: Optional[int] = None,
+    signature: Optional[str] = None,
+    header_token: Optional[str] = Depends(optional_oauth2_scheme),
+    db: AsyncSession = Depends(get_db)
+) -> MessageAttachment:
+    """Attachment of a download request, authorized by a signed link or a bearer header."""
+    if signature is not None or expires is not None:
+        # The link was signed for a participant when issued
+        if expires is None or signature is None or \
+                not verify_download_signature(request.url.path, expires, signature):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Download link invalid or expired"
+            )
+        return await get_shared_attachment(db, filename, None)
+    if not header_token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    user = await get_current_user_from_token(header_token, db)
+    return await get_shared_attachment(db, filename, user)
+
+@router.get("/attachments/{filename}/link", response_model=AttachmentLinkResponse)
+async def get_attachment_link(
+    filename: str,
+    request: Request,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Signed links to an attachment and its thumbnail, for use in <a> and <img> tags.
+    
+    Links carry no session token; each grants access to one file until
+    expires_at. Within a signing window every caller gets the same URL,
+    so browsers and proxies can cache the download.
+    """
+    attachment = await get_shared_attachment(db, filename, current_user)
+    
+    url, expires = sign_download_path(request.url_for("get_attachment", filename=filename).path)
+    thumbnail_url = None
+    if attachment.thumbnail_status == THUMBNAIL_READY:
+        thumbnail_url, _ = sign_download_path(
+            request.url_for("get_attachment_thumbnail", filename=filename).path
+        )
+    return {
+        "url": url,
+        "thumbnail_url": thumbnail_url,
+        "expires_at": datetime.fromtimestamp(expires, timezone.utc)
+    }
+
+@router.get("/attachments/{filename}")
+async def get_attachment(
+    filename: str,
+    request: Request,
+    attachment: MessageAttachment = Depends(get_downloadable_attachment)
+):
+    """Download message attachment (supports Range and conditional requests)."""
     
-    return FileResponse(file_path)
\ No newline at end of file
+    return await file_response(
+        request,
+        attachment.file_path,
+        attachment.original_filename,
+        content_type=attachment.content_type,
+        content_hash=attachment.sha256
+    )
+
+@router.get("/attachments/{filename}/thumbnail")
+async def get_attachment_thumbnail(
+    filename: str,
+    request: Request,
+    attachment: MessageAttachment = Depends(get_downloadable_attachment)
+):
+    """Download the thumbnail of an image attachment."""
+    if attachment.thumbnail_status != THUMBNAIL_READY:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Thumbnail not available"
+        )
+    
+    # Named by blob hash and size, so it caches like the original
+    name, _ = os.path.splitext(attachment.original_filename)
+    return await file_response(
+        request,
+        attachment.thumbnail_path,
+        f"{name}.webp",
+        content_type="image/webp",
+        content_hash=os.path.splitext(os.path.basename(attachment.thumbnail_path))[0]
+    )
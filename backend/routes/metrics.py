@@ -0,0 +1,37 @@
+import hmac
+from typing import Optional
+from decouple import config
+from fastapi import APIRouter, Depends, HTTPException, status
+from database import get_pool_status
+from auth import get_auth_cache_stats, optional_oauth2_scheme, password_hasher
+from thumbnails import thumbnails
+from serialization import get_fragment_cache_stats
+from websocket_manager import manager
+
+# Bearer token for scrapers; metrics are not served while it is unset
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+def require_metrics_token(token: Optional[str] = Depends(optional_oauth2_scheme)):
+    """Allow only requests bearing METRICS_TOKEN."""
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if token is None or not hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid metrics token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+@router.get("/", dependencies=[Depends(require_metrics_token)])
+def get_metrics():
+    """Get runtime metrics of this worker process."""
+    return {
+        "database_pool": get_pool_status(),
+        "auth_cache": get_auth_cache_stats(),
+        "password_hashing": password_hasher.stats(),
+        "thumbnails": thumbnails.stats(),
+        "serialization_cache": get_fragment_cache_stats(),
+        "websocket": manager.stats()
+    }
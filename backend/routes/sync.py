@@ -0,0 +1,29 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db
+from models import User
+from schemas import SyncResponse
+from auth import get_current_active_user
+from event_log import SYNC_PAGE_SIZE
+from messaging import sync_events
+from serialization import json_response
+
+router = APIRouter(prefix="/sync", tags=["sync"])
+
+@router.get("/", response_model=SyncResponse)
+async def sync(
+    since: Optional[int] = Query(default=None, ge=0, description="Last event seq the client applied"),
+    limit: int = Query(default=SYNC_PAGE_SIZE, ge=1, le=SYNC_PAGE_SIZE, description="Maximum number of events"),
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get the message events missed since a seq, oldest first.
+    
+    Events are the new_message, message_updated and message_deleted frames
+    the WebSocket delivers, with the message as it is now. Without since
+    only the current seq is returned. full_resync means events after since
+    were pruned and chats must be reloaded; has_more asks for another page
+    from the returned seq.
+    """
+    return json_response(await sync_events(db, current_user.id, since, limit))
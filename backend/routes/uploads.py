@@ -0,0 +1,73 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db
+from models import User
+from schemas import UploadSessionCreate, UploadSessionResponse, MessageAttachmentResponse
+from auth import get_current_active_user
+from upload_sessions import (
+    create_session,
+    get_session,
+    write_chunk,
+    finalize_session,
+    cancel_session
+)
+
+router = APIRouter(prefix="/uploads", tags=["uploads"])
+
+@router.post("/", response_model=UploadSessionResponse)
+async def create_upload(
+    upload: UploadSessionCreate,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Start a resumable upload."""
+    if upload.size <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Upload size must be positive"
+        )
+    
+    return await create_session(db, current_user.id, upload.filename, upload.size, upload.content_type)
+
+@router.get("/{upload_id}", response_model=UploadSessionResponse)
+async def get_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get upload progress; received_size is the offset to resume from."""
+    return await get_session(db, upload_id, current_user.id)
+
+@router.put("/{upload_id}/chunks", response_model=UploadSessionResponse)
+async def upload_chunk(
+    upload_id: str,
+    offset: int,
+    request: Request,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Write the raw request body at offset."""
+    session = await get_session(db, upload_id, current_user.id)
+    return await write_chunk(db, session, offset, request)
+
+@router.post("/{upload_id}/complete", response_model=MessageAttachmentResponse)
+async def complete_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Finish an upload; send the returned attachment id with a message."""
+    session = await get_session(db, upload_id, current_user.id)
+    return await finalize_session(db, session)
+
+@router.delete("/{upload_id}")
+async def delete_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Cancel an upload."""
+    session = await get_session(db, upload_id, current_user.id)
+    await cancel_session(db, session)
+    
+    return {"detail": "Upload cancelled"}
@@ -1,62 +1,76 @@
-from fastapi import APIRouter, Depends, Query
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 from database import get_db
 from models import User
 from schemas import UserResponse
 from auth import get_current_active_user
+from pagination import encode_search_cursor, decode_search_cursor
+from user_search import search_users as find_users
+from serialization import json_response, user_fragment
 
 router = APIRouter(prefix="/users", tags=["users"])
 
 @router.get("/search", response_model=List[UserResponse])
-def search_users(
+async def search_users(
+    response: Response,
     query: str = Query(..., min_length=1, description="Search query for usernames"),
-    limit: int = Query(default=10, le=50, description="Maximum number of results"),
+    limit: int = Query(default=10, ge=1, le=50, description="Maximum number of results"),
+    cursor: Optional[str] = Query(default=None, description="X-Next-Cursor of the previous page"),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """Search for users by username (excluding current user)."""
+    """Search for users by username (excluding current user).
     
-    # Search users by username (case-insensitive partial match)
-    users = db.query(User).filter(
-        User.username.ilike(f"%{query}%"),
-        User.id != current_user.id,  # Exclude current user
-        User.is_active == True  # Only active users
-    ).limit(limit).all()
+    Case-insensitive; exact matches rank first, then prefix matches, then
+    other substring matches (queries of 3+ characters), each by username.
+    More results continue from the cursor in the X-Next-Cursor header.
+    """
     
-    return users
+    position = None
+    if cursor is not None:
+        try:
+            position = decode_search_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    users, next_position = await find_users(db, query, limit, current_user.id, position)
+    if next_position is not None:
+        response.headers["X-Next-Cursor"] = encode_search_cursor(*next_position)
+    
+    return json_response([user_fragment(user) for user in users], response)
 
 @router.get("/", response_model=List[UserResponse])
-def get_all_users(
+async def get_all_users(
     skip: int = Query(default=0, ge=0),
     limit: int = Query(default=50, le=100),
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Get all users (excluding current user) - useful for user discovery."""
     
-    users = db.query(User).filter(
+    users = (await db.scalars(select(User).filter(
         User.id != current_user.id,
         User.is_active == True
-    ).offset(skip).limit(limit).all()
+    ).offset(skip).limit(limit))).all()
     
-    return users
+    return json_response([user_fragment(user) for user in users])
 
 @router.get("/{user_id}", response_model=UserResponse)
-def get_user_by_id(
+async def get_user_by_id(
     user_id: int,
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Get user by ID."""
     
-    user = db.query(User).filter(
+    user = await db.scalar(select(User).filter(
         User.id == user_id,
         User.is_active == True
-    ).first()
+    ))
     
     if not user:
-        from fastapi import HTTPException, status
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
@@ -1,9 +1,13 @@
 import json
 import logging
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, Query
-from sqlalchemy.orm import Session
-from database import get_db
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, Query
+from database import SessionLocal
+from models import User
+from messaging import create_message, event_frame, sync_events
+from event_log import NEW_MESSAGE
 from websocket_manager import manager, get_websocket_user
+from read_receipts import read_receipts
+from serialization import loads, message_fragment
 
 logger = logging.getLogger(__name__)
 
@@ -12,13 +16,17 @@ router = APIRouter()
 @router.websocket("/ws")
 async def websocket_endpoint(
     websocket: WebSocket,
-    token: str = Query(...),
-    db: Session = Depends(get_db)
+    token: str = Query(...)
 ):
-    """WebSocket endpoint for real-time messaging."""
+    """WebSocket endpoint for real-time messaging.
+    
+    No DB session is held for the connection's lifetime: authentication
+    uses a short-lived session, and event handlers that need the database
+    open their own unit of work (see read_receipts).
+    """
     
     # Authenticate user
-    user = await get_websocket_user(websocket, token, db)
+    user = await get_websocket_user(websocket, token)
     if not user:
         return
     
@@ -31,8 +39,8 @@ async def websocket_endpoint(
             data = await websocket.receive_text()
             
             try:
-                message_data = json.loads(data)
-                await handle_websocket_message(message_data, user.id, db)
+                message_data = loads(data)
+                await handle_websocket_message(message_data, user.id, websocket)
                 
             except json.JSONDecodeError:
                 await manager.send_personal_message({
@@ -53,7 +61,7 @@ async def websocket_endpoint(
         manager.disconnect(websocket)
 
 
-async def handle_websocket_message(message_data: dict, sender_id: int, db: Session):
+async def handle_websocket_message(message_data: dict, sender_id: int, websocket: WebSocket):
     """Handle different types of WebSocket messages."""
     
     message_type = message_data.get("type")
@@ -65,29 +73,48 @@ async def handle_websocket_message(message_data: dict, sender_id: int, db: Sessi
             "timestamp": message_data.get("timestamp")
         }, sender_id)
         
+    elif message_type == "send_message":
+        # Text chat over the open socket instead of an HTTP POST per message
+        await handle_send_message(message_data, sender_id, websocket)
+        
+    elif message_type == "resume":
+        # Catch up on events missed since the client's last seq
+        await handle_resume(message_data, sender_id, websocket)
+        
     elif message_type == "typing":
-        # Handle typing indicators
+        # Coalesced and throttled per conversation before reaching the recipient
         recipient_id = message_data.get("recipient_id")
         if recipient_id:
-            await manager.send_to_user({
-                "type": "typing",
-                "sender_id": sender_id,
-                "is_typing": message_data.get("is_typing", False)
-            }, recipient_id)
+            manager.typing.update(sender_id, int(recipient_id), bool(message_data.get("is_typing", False)))
             
     elif message_type == "message_read":
         # Handle message read receipts
         recipient_id = message_data.get("recipient_id")
         message_id = message_data.get("message_id")
         if recipient_id and message_id:
+            # Persist read watermark in the next batched flush
+            read_receipts.mark_read(sender_id, int(recipient_id), int(message_id))
             await manager.send_to_user({
                 "type": "message_read",
                 "message_id": message_id,
                 "reader_id": sender_id
             }, recipient_id)
             
+    elif message_type == "presence_subscribe":
+        # Watch users; the current status is sent now, changes are pushed in batches
+        user_ids = [int(user_id) for user_id in message_data.get("user_ids", [])]
+        added = manager.presence.subscribe(websocket, user_ids)
+        if added:
+            manager.presence.send(websocket, {
+                user_id: manager.presence.is_online(user_id) for user_id in added
+            })
+            
+    elif message_type == "presence_unsubscribe":
+        user_ids = [int(user_id) for user_id in message_data.get("user_ids", [])]
+        manager.presence.unsubscribe(websocket, user_ids)
+        
     elif message_type == "get_online_status":
-        # Send online status of requested users
+        # Send online status of requested users (prefer presence_subscribe)
         requested_users = message_data.get("user_ids", [])
         online_status = {}
         for user_id in requested_users:
@@ -103,4 +130,80 @@ async def handle_websocket_message(message_data: dict, sender_id: int, db: Sessi
         await manager.send_to_user({
             "type": "error",
             "message": f"Unknown message type: {message_type}"
-        }, sender_id)
\ No newline at end of file
+        }, sender_id)
+
+
+async def handle_send_message(message_data: dict, sender_id: int, websocket: WebSocket):
+    """Persist a message sent over the socket and acknowledge it.
+    
+    Uses the same persistence as POST /messages/. The client_id is
+    required; resending it after a lost ack returns the original message
+    with duplicate set instead of creating another one.
+    """
+    client_id = message_data.get("client_id")
+    content = message_data.get("content")
+    recipient_id = message_data.get("recipient_id")
+    
+    async def reject(detail: str):
+        await manager.send_personal_message({
+            "type": "send_error",
+            "client_id": client_id,
+            "detail": detail
+        }, websocket)
+    
+    if not isinstance(client_id, str) or not client_id:
+        await reject("client_id is required")
+        return
+    if not isinstance(content, str) or not content.strip() or not isinstance(recipient_id, int):
+        await reject("content and recipient_id are required")
+        return
+    
+    try:
+        async with SessionLocal() as db:
+            recipient = await db.get(User, recipient_id)
+            if not recipient:
+                raise HTTPException(status_code=404, detail="Recipient not found")
+            db_message, seq = await create_message(
+                db, sender_id, recipient, content,
+                attachment_ids=message_data.get("attachment_ids") or [],
+                client_id=client_id
+            )
+            message = message_fragment(db_message)
+    except HTTPException as e:
+        await reject(e.detail)
+        return
+    except Exception as e:
+        logger.error(f"Error sending message over WebSocket: {e}")
+        await reject("Error sending message")
+        return
+    
+    await manager.send_personal_message({
+        "type": "ack",
+        "client_id": client_id,
+        "message_id": db_message.id,
+        "created_at": db_message.created_at,
+        "duplicate": seq is None,
+        "message": message
+    }, websocket)
+    
+    if seq is not None:
+        await manager.send_to_user(event_frame(NEW_MESSAGE, seq, db_message.id, message), recipient_id)
+
+
+async def handle_resume(message_data: dict, user_id: int, websocket: WebSocket):
+    """Replay the message events missed while disconnected, as a sync frame.
+    
+    The reply has the same fields as GET /sync; the client sends resume
+    again from the returned seq while has_more is set.
+    """
+    since = message_data.get("since")
+    if since is not None and not isinstance(since, int):
+        await manager.send_personal_message({
+            "type": "error",
+            "message": "since must be an integer"
+        }, websocket)
+        return
+    
+    async with SessionLocal() as db:
+        sync = await sync_events(db, user_id, since)
+    await manager.send_personal_message({"type": "sync", **sync}, websocket)
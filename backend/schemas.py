@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Dict
 
 # User schemas
 class UserBase(BaseModel):
@@ -34,10 +34,20 @@ class MessageAttachmentResponse(BaseModel):
     file_size: int
     content_type: Optional[str]
     uploaded_at: datetime
+    # Served at /messages/attachments/{filename}/thumbnail once ready
+    thumbnail_status: Optional[str] = None
+    thumbnail_width: Optional[int] = None
+    thumbnail_height: Optional[int] = None
     
     class Config:
         from_attributes = True
 
+# Signed, expiring links for <a>/<img> tags, which can't send a bearer header
+class AttachmentLinkResponse(BaseModel):
+    url: str
+    thumbnail_url: Optional[str] = None
+    expires_at: datetime
+
 # Message schemas
 class MessageBase(BaseModel):
     content: str
@@ -49,7 +59,7 @@ class MessageCreate(MessageBase):
 class MessageUpdate(BaseModel):
     content: str
 
-class MessageResponse(BaseModel):
+class CompactMessageResponse(BaseModel):
     id: int
     content: str
     sender_id: int
@@ -58,15 +68,50 @@ class MessageResponse(BaseModel):
     updated_at: Optional[datetime]
     is_edited: bool
     is_deleted: bool
-    sender: UserResponse
-    recipient: UserResponse
     attachments: List[MessageAttachmentResponse] = []
     
     class Config:
         from_attributes = True
 
+class MessageResponse(CompactMessageResponse):
+    sender: UserResponse
+    recipient: UserResponse
+
+# Message page with users side-loaded once instead of nested per message
+class CompactMessageList(BaseModel):
+    messages: List[CompactMessageResponse]
+    users: Dict[int, UserResponse]
+
+# Search hit with the matching excerpt as HTML: text escaped, terms wrapped in <mark></mark>
+class MessageSearchResult(BaseModel):
+    message: MessageResponse
+    snippet: str
+
+# Events missed since a seq, as the WebSocket frames that carried them
+class SyncResponse(BaseModel):
+    seq: int
+    events: List[dict]
+    full_resync: bool
+    has_more: bool
+
 # Chat schemas
 class ChatResponse(BaseModel):
     user: UserResponse
     last_message: Optional[MessageResponse]
-    unread_count: int
\ No newline at end of file
+    unread_count: int
+# Resumable upload schemas
+class UploadSessionCreate(BaseModel):
+    filename: str
+    size: int
+    content_type: Optional[str] = None
+
+class UploadSessionResponse(BaseModel):
+    id: str
+    filename: str
+    content_type: Optional[str]
+    total_size: int
+    received_size: int
+    expires_at: datetime
+    
+    class Config:
+        from_attributes = True
@@ -0,0 +1,132 @@
+from operator import attrgetter
+from typing import Any, Callable, Optional, Type
+import orjson
+from decouple import config
+from fastapi import Response
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+from cache import VersionedCache
+from models import Message, User
+from schemas import UserResponse, MessageAttachmentResponse, CompactMessageResponse, MessageResponse
+
+# Maps keyed by id (compact message pages, presence statuses) have int keys
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+# Memory for encoded messages and users reused across responses and events
+# (per process, in bytes of JSON); 0 disables caching
+MESSAGE_FRAGMENT_CACHE_BYTES = config("MESSAGE_FRAGMENT_CACHE_BYTES", default=64 * 1024 * 1024, cast=int)
+USER_FRAGMENT_CACHE_BYTES = config("USER_FRAGMENT_CACHE_BYTES", default=4 * 1024 * 1024, cast=int)
+
+loads = orjson.loads
+
+
+def dumps(value: Any) -> str:
+    """Encode a WebSocket or delivery bus frame; datetimes are encoded natively."""
+    return orjson.dumps(value, option=ORJSON_OPTIONS).decode()
+
+
+def compile_serializer(schema: Type[BaseModel], **nested: Callable[[Any], dict]) -> Callable[[Any], dict]:
+    """Build a serializer of ORM rows into plain dicts shaped like schema.
+
+    The field list is read from the schema once, so output keys always
+    match the documented response model. Nested serializers apply to
+    relationship fields, per item for lists. Rows come from our own
+    database and are not validated again.
+    """
+    names = tuple(schema.model_fields)
+    getter = attrgetter(*names)
+    if len(names) == 1:
+        get_values = lambda row: (getter(row),)
+    else:
+        get_values = getter
+    nested_fields = tuple(nested.items())
+
+    def serialize(row: Any) -> dict:
+        values = dict(zip(names, get_values(row)))
+        for name, serialize_nested in nested_fields:
+            value = values[name]
+            if isinstance(value, list):
+                values[name] = [serialize_nested(item) for item in value]
+            elif value is not None:
+                values[name] = serialize_nested(value)
+        return values
+
+    return serialize
+
+
+serialize_user = compile_serializer(UserResponse)
+serialize_attachment = compile_serializer(MessageAttachmentResponse)
+serialize_compact_message = compile_serializer(CompactMessageResponse, attachments=serialize_attachment)
+# Message as MessageResponse; HTTP responses and WebSocket frames carry the same dict
+serialize_message = compile_serializer(
+    MessageResponse,
+    attachments=serialize_attachment,
+    sender=serialize_user,
+    recipient=serialize_user
+)
+
+
+# Encoded messages keyed by message id, users keyed by user id
+message_fragments = VersionedCache(MESSAGE_FRAGMENT_CACHE_BYTES)
+user_fragments = VersionedCache(USER_FRAGMENT_CACHE_BYTES)
+
+# A user's fields are its version: users have no updated_at
+user_version = attrgetter(*UserResponse.model_fields)
+
+
+def user_fragment(user: User) -> orjson.Fragment:
+    """UserResponse of a user as pre-encoded JSON, cached."""
+    version = user_version(user)
+    fragment = user_fragments.get(user.id, version)
+    if fragment is None:
+        encoded = orjson.dumps(serialize_user(user))
+        fragment = orjson.Fragment(encoded)
+        user_fragments.set(user.id, version, fragment, len(encoded))
+    return fragment
+
+
+def message_fragment(message: Message) -> orjson.Fragment:
+    """MessageResponse of a loaded message as pre-encoded JSON, cached.
+
+    Every page, chat list entry, search hit and WebSocket event embeds the
+    same fragment. The version changes when the message is edited or
+    deleted (updated_at), a thumbnail finishes, or a participant changes,
+    so entries written by other processes' changes are never reused.
+    """
+    version = (
+        message.updated_at,
+        message.is_deleted,
+        tuple((attachment.id, attachment.thumbnail_status) for attachment in message.attachments),
+        user_version(message.sender),
+        user_version(message.recipient),
+    )
+    fragment = message_fragments.get(message.id, version)
+    if fragment is None:
+        values = serialize_compact_message(message)
+        values["sender"] = user_fragment(message.sender)
+        values["recipient"] = user_fragment(message.recipient)
+        encoded = orjson.dumps(values)
+        fragment = orjson.Fragment(encoded)
+        message_fragments.set(message.id, version, fragment, len(encoded))
+    return fragment
+
+
+def invalidate_message(message_id: int):
+    """Free a message's cached encoding after this process changed it."""
+    message_fragments.invalidate(message_id)
+
+
+def get_fragment_cache_stats() -> dict:
+    """Hit rates and memory use of the encoded message and user caches."""
+    return {
+        "messages": message_fragments.stats(),
+        "users": user_fragments.stats(),
+    }
+
+
+def json_response(content: Any, response: Optional[Response] = None) -> ORJSONResponse:
+    """Encode already serialized content, skipping response_model validation.
+
+    Headers the route set on its injected response are carried over.
+    """
+    return ORJSONResponse(content, headers=dict(response.headers) if response is not None else None)
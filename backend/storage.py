@@ -0,0 +1,254 @@
+import glob
+import hashlib
+import logging
+import os
+import uuid
+from collections import Counter
+from typing import Iterable, List
+import aiofiles
+import aiofiles.os
+from decouple import config
+from fastapi import HTTPException, UploadFile, status
+from sqlalchemy import delete, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Blob
+
+logger = logging.getLogger(__name__)
+
+# Upload configuration
+UPLOAD_DIR = "uploads"
+# Content-addressed files, sharded as blobs/ab/cd/<sha256>
+BLOB_DIR = os.path.join(UPLOAD_DIR, "blobs")
+# Uploads in progress, moved into BLOB_DIR once committed
+TMP_DIR = os.path.join(UPLOAD_DIR, "tmp")
+# Derived previews, sharded like blobs and named <sha256>-<size>.webp
+THUMBNAIL_DIR = os.path.join(UPLOAD_DIR, "thumbnails")
+UPLOAD_CHUNK_SIZE = config("UPLOAD_CHUNK_SIZE", default=1024 * 1024, cast=int)
+MAX_ATTACHMENT_SIZE = config("MAX_ATTACHMENT_SIZE", default=50 * 1024 * 1024, cast=int)
+MAX_MESSAGE_ATTACHMENTS_SIZE = config("MAX_MESSAGE_ATTACHMENTS_SIZE", default=100 * 1024 * 1024, cast=int)
+# Allowance for form fields and multipart framing on top of the files
+MAX_MESSAGE_REQUEST_SIZE = MAX_MESSAGE_ATTACHMENTS_SIZE + 1024 * 1024
+
+
+os.makedirs(TMP_DIR, exist_ok=True)
+
+
+def blob_path(sha256: str) -> str:
+    """Location of a content-addressed file."""
+    return os.path.join(BLOB_DIR, sha256[:2], sha256[2:4], sha256)
+
+
+def thumbnail_path(sha256: str, size: int) -> str:
+    """Location of a blob's thumbnail at a given bounding size."""
+    return os.path.join(THUMBNAIL_DIR, sha256[:2], sha256[2:4], f"{sha256}-{size}.webp")
+
+
+class StoredFile:
+    """An uploaded file written to a temporary path, keyed by its content."""
+
+    def __init__(self, filename: str, original_filename: str, temp_path: str,
+                 file_size: int, content_type: str, sha256: str):
+        self.filename = filename
+        self.original_filename = original_filename
+        self.temp_path = temp_path
+        self.file_path = blob_path(sha256)
+        self.file_size = file_size
+        self.content_type = content_type
+        self.sha256 = sha256
+
+
+def too_large(detail: str) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=detail)
+
+
+async def save_upload(file: UploadFile, size_budget: int) -> StoredFile:
+    """Stream an upload to a temporary file in fixed-size chunks.
+
+    Size and SHA-256 are computed as the data is copied. Raises 413 once the
+    file exceeds MAX_ATTACHMENT_SIZE or the remaining per-message budget;
+    partially written files are removed.
+    """
+    file_extension = os.path.splitext(file.filename)[1]
+    file_path = os.path.join(TMP_DIR, uuid.uuid4().hex)
+
+    digest = hashlib.sha256()
+    file_size = 0
+    try:
+        async with aiofiles.open(file_path, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                file_size += len(chunk)
+                if file_size > MAX_ATTACHMENT_SIZE:
+                    raise too_large(f"Attachment exceeds {MAX_ATTACHMENT_SIZE} bytes")
+                if file_size > size_budget:
+                    raise too_large(f"Attachments exceed {MAX_MESSAGE_ATTACHMENTS_SIZE} bytes per message")
+                digest.update(chunk)
+                await buffer.write(chunk)
+    except BaseException:
+        await remove_files([file_path])
+        raise
+
+    sha256 = digest.hexdigest()
+    return StoredFile(
+        filename=f"{sha256}{file_extension}",
+        original_filename=file.filename,
+        temp_path=file_path,
+        file_size=file_size,
+        content_type=file.content_type,
+        sha256=sha256
+    )
+
+
+async def save_uploads(files: List[UploadFile]) -> List[StoredFile]:
+    """Stream all uploads of a message to disk within the per-message cap."""
+    stored: List[StoredFile] = []
+    try:
+        for file in files:
+            if file.filename:
+                budget = MAX_MESSAGE_ATTACHMENTS_SIZE - sum(f.file_size for f in stored)
+                stored.append(await save_upload(file, budget))
+    except BaseException:
+        await discard_uploads(stored)
+        raise
+    return stored
+
+
+async def discard_uploads(stored_files: List[StoredFile]):
+    """Remove temporary files of uploads that won't be published."""
+    await remove_files([stored.temp_path for stored in stored_files])
+
+
+def _insert(db: AsyncSession):
+    dialect = postgresql if db.bind.dialect.name == "postgresql" else sqlite
+    return dialect.insert
+
+
+async def add_blob_references(db: AsyncSession, stored_files: List[StoredFile]):
+    """Reference the blobs of new attachments in the caller's transaction.
+
+    Identical uploads share one blob row; its ref_count is raised by an
+    atomic upsert, so concurrent uploads of the same content don't race.
+    """
+    sizes = {stored.sha256: stored.file_size for stored in stored_files}
+    for sha256, references in Counter(stored.sha256 for stored in stored_files).items():
+        insert = _insert(db)(Blob).values(sha256=sha256, size=sizes[sha256], ref_count=references)
+        await db.execute(insert.on_conflict_do_update(
+            index_elements=[Blob.sha256],
+            set_={"ref_count": Blob.ref_count + references}
+        ))
+
+
+async def publish_uploads(stored_files: List[StoredFile]):
+    """Move committed uploads into the blob store.
+
+    Runs after the referencing transaction commits. The file is replaced
+    even if it already exists (same content), which restores it should a
+    concurrent garbage collection have unlinked it in the meantime.
+    """
+    for stored in stored_files:
+        await aiofiles.os.makedirs(os.path.dirname(stored.file_path), exist_ok=True)
+        await aiofiles.os.replace(stored.temp_path, stored.file_path)
+
+
+async def release_blob_references(db: AsyncSession, sha256s: Iterable[str]):
+    """Drop references to blobs in the caller's transaction."""
+    for sha256, references in Counter(sha256s).items():
+        await db.execute(
+            update(Blob).where(Blob.sha256 == sha256).values(ref_count=Blob.ref_count - references)
+        )
+
+
+async def collect_blobs(db: AsyncSession, sha256s: Iterable[str]) -> int:
+    """Delete unreferenced blobs, their files and thumbnails; returns bytes freed.
+
+    Each row is deleted before its file is unlinked, so a concurrent upload
+    of the same content waits on the row and re-creates both afterwards.
+    """
+    freed = 0
+    for sha256 in set(sha256s):
+        result = await db.execute(
+            delete(Blob).where(Blob.sha256 == sha256, Blob.ref_count <= 0).returning(Blob.size)
+        )
+        size = result.scalar()
+        if size is not None:
+            thumbnails = glob.glob(os.path.join(THUMBNAIL_DIR, sha256[:2], sha256[2:4], f"{sha256}-*"))
+            await remove_files([blob_path(sha256)] + thumbnails)
+            freed += size
+        await db.commit()
+    return freed
+
+
+async def remove_files(paths: List[str]):
+    """Best-effort removal of written files."""
+    for path in paths:
+        try:
+            await aiofiles.os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Failed to remove upload {path}: {e}")
+
+
+class RequestSizeLimitMiddleware:
+    """Rejects message uploads with 413 while the body is still arriving.
+
+    Multipart parsing spools the whole body before the route runs, so the
+    per-message cap is also enforced here on Content-Length and on the bytes
+    actually received.
+    """
+
+    def __init__(self, app, path: str = "/messages/", max_size: int = MAX_MESSAGE_REQUEST_SIZE):
+        self.app = app
+        self.path = path
+        self.max_size = max_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] != self.path:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_size:
+            await self._reject(send)
+            return
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_size:
+                    raise _RequestTooLarge()
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except _RequestTooLarge:
+            if not response_started:
+                await self._reject(send)
+
+    async def _reject(self, send):
+        body = b'{"detail":"Request body too large"}'
+        await send({
+            "type": "http.response.start",
+            "status": status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+class _RequestTooLarge(Exception):
+    pass
@@ -0,0 +1,114 @@
+"""Shared fixtures; run from the backend directory: python -m pytest
+
+Tests run against a throwaway SQLite file per test, or against
+TEST_DATABASE_URL (e.g. a scratch PostgreSQL database, whose tables are
+dropped afterwards) when it is set.
+"""
+import asyncio
+import os
+import sys
+
+import greenlet
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+# Keep module-level engines off any real database
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from database import get_async_database_url
+from models import Base, User
+
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+
+def _no_blocking_io_on_loop(conn, cursor, statement, parameters, context, executemany):
+    """Fail statements a sync engine or session runs on the event loop.
+
+    Async engines run their driver inside a greenlet spawned by
+    greenlet_spawn; a statement on the loop thread outside one blocks it.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    if greenlet.getcurrent().parent is None:
+        raise AssertionError(f"Blocking database call on the event loop: {statement}")
+
+
+@pytest.fixture(autouse=True)
+def no_blocking_database_io():
+    """Guard every test against sync database access inside coroutines."""
+    event.listen(Engine, "before_cursor_execute", _no_blocking_io_on_loop)
+    yield
+    event.remove(Engine, "before_cursor_execute", _no_blocking_io_on_loop)
+
+
+@pytest.fixture
+def run():
+    """Run a coroutine on the test's event loop."""
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
+
+
+@pytest.fixture
+def engine(run, tmp_path):
+    url = TEST_DATABASE_URL or f"sqlite:///{tmp_path / 'test.db'}"
+    engine = create_async_engine(get_async_database_url(url))
+
+    async def create_tables():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    async def drop_tables():
+        if TEST_DATABASE_URL:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.drop_all)
+        await engine.dispose()
+
+    run(create_tables())
+    yield engine
+    run(drop_tables())
+
+
+@pytest.fixture
+def session_factory(engine):
+    """Sessions configured like database.SessionLocal."""
+    return async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+
+@pytest.fixture
+def make_users(session_factory):
+    """Create users by name; returns them in order."""
+    async def make_users(*usernames: str):
+        async with session_factory() as db:
+            users = [
+                User(username=username, email=f"{username}@example.com", hashed_password="x")
+                for username in usernames
+            ]
+            db.add_all(users)
+            await db.commit()
+        return users
+
+    return make_users
+
+
+@pytest.fixture
+def upload_dir(tmp_path, monkeypatch):
+    """Point attachment storage at a temporary directory."""
+    import storage
+    import upload_sessions
+
+    root = tmp_path / "uploads"
+    paths = {"BLOB_DIR": root / "blobs", "TMP_DIR": root / "tmp", "THUMBNAIL_DIR": root / "thumbnails"}
+    for name, path in paths.items():
+        path.mkdir(parents=True)
+        monkeypatch.setattr(storage, name, str(path))
+    monkeypatch.setattr(storage, "UPLOAD_DIR", str(root))
+    monkeypatch.setattr(upload_sessions, "TMP_DIR", str(paths["TMP_DIR"]))
+    return root
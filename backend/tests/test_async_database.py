@@ -0,0 +1,94 @@
+import ast
+import inspect
+import os
+
+import pytest
+from fastapi.routing import APIRoute, APIWebSocketRoute
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.orm import Session
+
+import database
+from main import app
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Scripts run outside the server; they may drive the database any way they like
+SKIPPED_DIRS = {"tests", "benchmarks", "__pycache__", "uploads"}
+# Sync SQLAlchemy entry points that block when called from a coroutine
+SYNC_ENTRY_POINTS = {"create_engine", "sessionmaker", "Session", "scoped_session"}
+
+
+def test_sync_session_in_coroutine_fails(run):
+    engine = create_engine("sqlite://")
+
+    async def handler():
+        with Session(engine) as db:
+            db.execute(text("SELECT 1"))
+
+    with pytest.raises(AssertionError, match="Blocking database call"):
+        run(handler())
+    engine.dispose()
+
+
+def test_async_session_in_coroutine_passes(run, session_factory):
+    async def handler():
+        async with session_factory() as db:
+            return await db.scalar(select(1))
+
+    assert run(handler()) == 1
+
+
+def test_app_engine_and_sessions_are_async(run):
+    assert isinstance(database.engine, AsyncEngine)
+
+    async def first_session():
+        sessions = database.get_db()
+        db = await sessions.__anext__()
+        await sessions.aclose()
+        return db
+
+    assert isinstance(run(first_session()), AsyncSession)
+
+
+def app_modules():
+    for directory, subdirectories, files in os.walk(BACKEND_DIR):
+        subdirectories[:] = [name for name in subdirectories if name not in SKIPPED_DIRS]
+        for name in files:
+            if name.endswith(".py"):
+                yield os.path.join(directory, name)
+
+
+def test_app_code_has_no_sync_database_api():
+    found = []
+    for path in app_modules():
+        with open(path) as source:
+            tree = ast.parse(source.read(), path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.ImportFrom) and (node.module or "").startswith("sqlalchemy") \
+                    and "asyncio" not in node.module:
+                found += [f"{path}: imports {alias.name}" for alias in node.names if alias.name in SYNC_ENTRY_POINTS]
+            elif isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == "query":
+                found.append(f"{path}:{node.lineno}: legacy Session.query")
+    assert found == []
+
+
+def dependency_calls(dependant):
+    yield dependant.call
+    for sub_dependant in dependant.dependencies:
+        yield from dependency_calls(sub_dependant)
+
+
+def test_routes_reach_the_database_only_through_async_sessions():
+    async_session_users = 0
+    for route in app.routes:
+        if not isinstance(route, (APIRoute, APIWebSocketRoute)):
+            continue
+        for call in dependency_calls(route.dependant):
+            parameters = inspect.signature(call).parameters.values()
+            annotations = {parameter.annotation for parameter in parameters}
+            assert Session not in annotations, f"{route.path}: {call.__name__} takes a sync Session"
+            if AsyncSession in annotations:
+                # A sync def would run in the threadpool and could never await the session
+                assert inspect.iscoroutinefunction(call), f"{route.path}: {call.__name__} is not async"
+                async_session_users += 1
+    assert async_session_users > 0
@@ -0,0 +1,162 @@
+import asyncio
+import threading
+
+import pytest
+from passlib.hash import bcrypt
+
+import auth
+from auth import (
+    PasswordHasher, create_access_token, get_current_user_from_token, get_user_for_token, user_cache
+)
+from delivery_bus import InProcessBus, LocalBroker
+from fastapi import HTTPException
+from models import User
+from websocket_manager import ConnectionManager
+
+
+@pytest.fixture(autouse=True)
+def empty_user_cache():
+    user_cache.clear()
+    yield
+    user_cache.clear()
+
+
+@pytest.fixture
+def published(monkeypatch):
+    """Usernames handed to the cross-worker invalidation listeners."""
+    usernames = []
+    monkeypatch.setattr(auth, "user_invalidation_listeners", [usernames.append])
+    return usernames
+
+
+async def wait_for(condition, timeout: float = 5):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        if asyncio.get_running_loop().time() > deadline:
+            raise TimeoutError("condition not met")
+        await asyncio.sleep(0.01)
+
+
+def test_cached_user_is_dropped_when_deactivated(run, session_factory, make_users, published):
+    async def scenario():
+        alice, = await make_users("alice")
+        token = create_access_token({"sub": "alice"})
+        async with session_factory() as db:
+            assert (await get_user_for_token(token, db)).id == alice.id
+            await get_user_for_token(token, db)
+        assert user_cache.hits == 1
+
+        async with session_factory() as db:
+            user = await db.get(User, alice.id)
+            user.is_active = False
+            await db.flush()
+            # Other workers hear of it only once the change is committed
+            assert published == []
+            await db.commit()
+        assert published == ["alice"]
+
+        async with session_factory() as db:
+            with pytest.raises(HTTPException) as raised:
+                await get_current_user_from_token(token, db)
+        assert raised.value.detail == "Inactive user"
+
+    run(scenario())
+
+
+def test_rename_invalidates_the_old_username(run, session_factory, make_users, published):
+    async def scenario():
+        alice, = await make_users("alice")
+        async with session_factory() as db:
+            await get_user_for_token(create_access_token({"sub": "alice"}), db)
+            user = await db.get(User, alice.id)
+            user.username = "alicia"
+            await db.commit()
+        assert sorted(published) == ["alice", "alicia"]
+        assert user_cache.get("alice") is None
+
+    run(scenario())
+
+
+def test_rolled_back_change_is_not_published(run, session_factory, make_users, published):
+    async def scenario():
+        alice, = await make_users("alice")
+        async with session_factory() as db:
+            user = await db.get(User, alice.id)
+            user.is_active = False
+            await db.flush()
+            await db.rollback()
+            await db.commit()
+        assert published == []
+
+    run(scenario())
+
+
+def test_invalidation_reaches_other_workers(run, session_factory, make_users):
+    async def scenario():
+        await make_users("alice")
+        broker = LocalBroker()
+        worker_a = ConnectionManager(bus=InProcessBus(broker, heartbeat_interval=0.1))
+        worker_b = ConnectionManager(bus=InProcessBus(broker, heartbeat_interval=0.1))
+        await worker_a.start()
+        await worker_b.start()
+        try:
+            # Both workers share this process's cache; a node ignores its own events,
+            # so the entry can only be dropped by worker B hearing from worker A
+            async with session_factory() as db:
+                await get_user_for_token(create_access_token({"sub": "alice"}), db)
+            assert user_cache.stats()["size"] == 1
+            assert worker_a._invalidate_user_elsewhere in auth.user_invalidation_listeners
+            worker_a._invalidate_user_elsewhere("alice")
+            await wait_for(lambda: user_cache.stats()["size"] == 0)
+        finally:
+            await worker_a.stop()
+            await worker_b.stop()
+        assert auth.user_invalidation_listeners == []
+
+    run(scenario())
+
+
+def test_password_hasher_rejects_work_past_its_cap(run):
+    hasher = PasswordHasher(workers=1, max_pending=2)
+    release = threading.Event()
+
+    async def scenario():
+        blocked = [asyncio.ensure_future(hasher.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        assert hasher.pending == 2
+
+        with pytest.raises(HTTPException) as error:
+            await hasher.hash("password")
+        assert error.value.status_code == 503
+        assert error.value.headers == {"Retry-After": "1"}
+
+        release.set()
+        await asyncio.gather(*blocked)
+        # Capacity is back once the queued work is done
+        hashed = await hasher.hash("password")
+        assert await hasher.verify("password", hashed) == (True, None)
+        assert await hasher.verify("wrong", hashed) == (False, None)
+        stats = hasher.stats()
+        assert (stats["pending"], stats["completed"], stats["rejected"]) == (0, 5, 1)
+
+    try:
+        run(scenario())
+    finally:
+        release.set()
+        hasher.executor.shutdown()
+
+
+def test_login_rehashes_at_the_configured_cost(run, monkeypatch):
+    monkeypatch.setattr(auth, "PASSWORD_REHASH_ON_LOGIN", True)
+    hasher = PasswordHasher(workers=1, max_pending=1)
+    cheap = bcrypt.using(rounds=4).hash("password")
+
+    async def scenario():
+        valid, new_hash = await hasher.verify("password", cheap)
+        assert valid and bcrypt.from_string(new_hash).rounds == auth.BCRYPT_ROUNDS
+        assert await hasher.verify("password", new_hash) == (True, None)
+
+    try:
+        run(scenario())
+    finally:
+        hasher.executor.shutdown()
@@ -0,0 +1,83 @@
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import update
+
+import serialization
+from cache import VersionedCache
+from messaging import create_message, load_message
+from models import Message, User
+from serialization import dumps, invalidate_message, loads, message_fragment
+
+
+def test_versioned_cache_evicts_least_recently_used_by_bytes():
+    cache = VersionedCache(max_bytes=10)
+    cache.set("a", 1, "A", 4)
+    cache.set("b", 1, "B", 4)
+    assert cache.get("a", 1) == "A"
+    cache.set("c", 1, "C", 4)
+    # b was used least recently
+    assert (cache.get("a", 1), cache.get("b", 1), cache.get("c", 1)) == ("A", None, "C")
+    assert (cache.bytes, cache.evictions) == (8, 1)
+
+    # Too large to ever fit: not stored, nothing evicted for it
+    cache.set("d", 1, "D", 11)
+    assert cache.get("d", 1) is None and cache.bytes == 8
+
+    # Replacing an entry accounts for its old size
+    cache.set("a", 2, "A2", 6)
+    assert cache.bytes == 10 and cache.evictions == 1
+
+
+def test_versioned_cache_misses_other_versions():
+    cache = VersionedCache(max_bytes=100)
+    cache.set("a", 1, "A", 1)
+    assert cache.get("a", 2) is None
+    assert cache.get("a", 1) == "A"
+    cache.invalidate("a")
+    assert cache.get("a", 1) is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["stale_misses"], stats["invalidations"], stats["bytes"]) == \
+        (1, 2, 1, 1, 0)
+
+
+@pytest.fixture
+def fragment_caches(monkeypatch):
+    messages, users = VersionedCache(1024 * 1024), VersionedCache(1024 * 1024)
+    monkeypatch.setattr(serialization, "message_fragments", messages)
+    monkeypatch.setattr(serialization, "user_fragments", users)
+    return messages, users
+
+
+def test_message_fragments_follow_changes_made_elsewhere(run, session_factory, make_users, fragment_caches):
+    messages, _ = fragment_caches
+
+    async def scenario():
+        alice, bob = await make_users("alice", "bob")
+        async with session_factory() as db:
+            created, _ = await create_message(db, alice.id, bob, "hello")
+
+        async def encoded() -> dict:
+            async with session_factory() as db:
+                return loads(dumps(message_fragment(await load_message(db, created.id))))
+
+        async def change(model, row_id: int, **values):
+            # As another process would, without invalidating our cache
+            async with session_factory() as db:
+                await db.execute(update(model).where(model.id == row_id).values(**values))
+                await db.commit()
+
+        assert (await encoded())["content"] == "hello"
+        assert (await encoded())["content"] == "hello"
+        assert messages.hits == 1
+
+        await change(Message, created.id, content="edited", updated_at=datetime(2030, 1, 1, tzinfo=timezone.utc))
+        assert (await encoded())["content"] == "edited"
+        await change(User, alice.id, username="alicia")
+        assert (await encoded())["sender"]["username"] == "alicia"
+        assert messages.stale == 2
+
+        invalidate_message(created.id)
+        assert messages.stats()["size"] == 0
+
+    run(scenario())
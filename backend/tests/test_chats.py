@@ -0,0 +1,95 @@
+from sqlalchemy import event
+
+from messaging import create_message
+from routes.messages import delete_message, get_user_chats, update_message
+from schemas import MessageUpdate
+from serialization import loads
+
+
+async def chats(session_factory, user) -> list:
+    async with session_factory() as db:
+        return loads((await get_user_chats(current_user=user, db=db)).body)
+
+
+async def statements_for_chats(engine, session_factory, user) -> int:
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", count)
+    try:
+        await chats(session_factory, user)
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", count)
+    return len(statements)
+
+
+def test_chats_are_listed_most_recent_first(run, session_factory, make_users):
+    async def scenario():
+        alice, bob, carol, dave = await make_users("alice", "bob", "carol", "dave")
+        async with session_factory() as db:
+            await create_message(db, alice.id, carol, "to carol")
+            await create_message(db, bob.id, alice, "from bob")
+            await create_message(db, bob.id, alice, "bob again")
+            # Not one of alice's conversations
+            await create_message(db, carol.id, dave, "elsewhere")
+
+        listed = await chats(session_factory, alice)
+        assert [(chat["user"]["username"], chat["last_message"]["content"], chat["unread_count"])
+                for chat in listed] == [("bob", "bob again", 2), ("carol", "to carol", 0)]
+        assert listed[0]["last_message"]["sender"]["username"] == "bob"
+
+    run(scenario())
+
+
+def test_chat_list_query_count_does_not_grow_with_chats(run, engine, session_factory, make_users):
+    async def scenario():
+        alice, *partners = await make_users("alice", *(f"partner{i}" for i in range(6)))
+        async with session_factory() as db:
+            await create_message(db, partners[0].id, alice, "first")
+        one_chat = await statements_for_chats(engine, session_factory, alice)
+
+        async with session_factory() as db:
+            for partner in partners[1:]:
+                await create_message(db, partner.id, alice, f"from {partner.username}")
+        assert len(await chats(session_factory, alice)) == len(partners)
+        assert await statements_for_chats(engine, session_factory, alice) == one_chat
+
+    run(scenario())
+
+
+def test_summaries_follow_edits_and_deletes(run, session_factory, make_users):
+    async def scenario():
+        alice, bob = await make_users("alice", "bob")
+        async with session_factory() as db:
+            messages = [(await create_message(db, bob.id, alice, f"message {i}"))[0] for i in range(3)]
+
+        def summary(listed):
+            chat, = listed
+            return chat["last_message"]["content"], chat["unread_count"]
+
+        assert summary(await chats(session_factory, alice)) == ("message 2", 3)
+        assert summary(await chats(session_factory, bob)) == ("message 2", 0)
+
+        async with session_factory() as db:
+            await update_message(messages[2].id, MessageUpdate(content="edited"), current_user=bob, db=db)
+        assert summary(await chats(session_factory, alice)) == ("edited", 3)
+
+        # Deleting the latest message falls back to the one before it
+        async with session_factory() as db:
+            await delete_message(messages[2].id, current_user=bob, db=db)
+        assert summary(await chats(session_factory, alice)) == ("message 1", 2)
+
+        # Deleting twice doesn't count twice
+        for message in (messages[0], messages[0]):
+            async with session_factory() as db:
+                await delete_message(message.id, current_user=bob, db=db)
+        assert summary(await chats(session_factory, alice)) == ("message 1", 1)
+
+        async with session_factory() as db:
+            await delete_message(messages[1].id, current_user=bob, db=db)
+        chat, = await chats(session_factory, alice)
+        assert (chat["last_message"], chat["unread_count"]) == (None, 0)
+
+    run(scenario())
@@ -0,0 +1,158 @@
+"""Cross-worker delivery: a frame sent on worker A reaches a socket on worker B.
+
+The multi-process test needs a broker shared by the workers; it uses
+TEST_BUS_URL (default redis://localhost:6379/0) and is skipped when that
+isn't reachable. Worker processes run this file as a script.
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import uuid
+
+import pytest
+
+from delivery_bus import InProcessBus, LocalBroker, create_bus
+from models import User
+from serialization import loads
+from websocket_manager import ConnectionManager
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_BUS_URL = os.environ.get("TEST_BUS_URL", "redis://localhost:6379/0")
+RECIPIENT_ID = 2
+WORKER_TIMEOUT = 15
+
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.frames = []
+        self.received = asyncio.Event()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        self.frames.append(loads(text))
+        self.received.set()
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        pass
+
+
+async def wait_for(condition, timeout: float = 5):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        if asyncio.get_running_loop().time() > deadline:
+            raise TimeoutError("condition not met")
+        await asyncio.sleep(0.01)
+
+
+async def frame_with_type(websocket: RecordingWebSocket, frame_type: str) -> dict:
+    while True:
+        for frame in websocket.frames:
+            if frame.get("type") == frame_type:
+                return frame
+        websocket.received.clear()
+        await websocket.received.wait()
+
+
+def test_frame_reaches_socket_on_other_worker_in_process(run):
+    async def scenario():
+        broker = LocalBroker()
+        worker_a = ConnectionManager(bus=InProcessBus(broker, heartbeat_interval=0.1))
+        worker_b = ConnectionManager(bus=InProcessBus(broker, heartbeat_interval=0.1))
+        await worker_a.start()
+        await worker_b.start()
+        try:
+            websocket = RecordingWebSocket()
+            await worker_b.connect(websocket, User(id=RECIPIENT_ID, username="bob"))
+            await wait_for(lambda: worker_a.bus.is_online_elsewhere(RECIPIENT_ID))
+            assert worker_a.is_user_online(RECIPIENT_ID)
+
+            await worker_a.send_to_user({"type": "new_message", "content": "hi from A"}, RECIPIENT_ID)
+            frame = await asyncio.wait_for(frame_with_type(websocket, "new_message"), 5)
+            assert frame["content"] == "hi from A"
+            assert worker_b.bus.stats()["frames_received"] == 1
+
+            # Once the socket closes, worker A stops publishing for the user
+            worker_b.disconnect(websocket)
+            await wait_for(lambda: not worker_a.bus.is_online_elsewhere(RECIPIENT_ID))
+        finally:
+            await worker_a.stop()
+            await worker_b.stop()
+
+    run(scenario())
+
+
+def broker_available(url: str) -> bool:
+    async def ping():
+        bus = create_bus(url)
+        try:
+            await asyncio.wait_for(bus._connect(), 2)
+            await asyncio.wait_for(bus._send(f"ping_{uuid.uuid4().hex}", "ping"), 2)
+            return True
+        except Exception:
+            return False
+        finally:
+            try:
+                await bus._disconnect()
+            except Exception:
+                pass
+
+    return asyncio.run(ping())
+
+
+def start_worker(role: str, channel_prefix: str) -> subprocess.Popen:
+    env = dict(os.environ, PYTHONPATH=BACKEND_DIR, DATABASE_URL="sqlite://",
+               WS_BUS_CHANNEL_PREFIX=channel_prefix, WS_BUS_HEARTBEAT_INTERVAL="0.2")
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), role, TEST_BUS_URL],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    )
+
+
+def test_frame_reaches_socket_on_other_worker_process():
+    if not broker_available(TEST_BUS_URL):
+        pytest.skip(f"no delivery bus broker at {TEST_BUS_URL}")
+    # Keep concurrent runs on the same broker apart
+    channel_prefix = f"test_{uuid.uuid4().hex[:8]}_"
+
+    worker_b = start_worker("receive", channel_prefix)
+    try:
+        assert worker_b.stdout.readline().strip() == "ready"
+        worker_a = start_worker("send", channel_prefix)
+        try:
+            _, errors = worker_a.communicate(timeout=WORKER_TIMEOUT)
+            assert worker_a.returncode == 0, errors
+        finally:
+            worker_a.kill()
+        output, errors = worker_b.communicate(timeout=WORKER_TIMEOUT)
+        assert worker_b.returncode == 0, errors
+        assert output.strip() == f"received hi from {worker_a.pid}"
+    finally:
+        worker_b.kill()
+
+
+async def worker(role: str, url: str):
+    """One worker process: receive holds a socket for the recipient, send publishes to it."""
+    manager = ConnectionManager(bus=create_bus(url))
+    await manager.start()
+    try:
+        await wait_for(lambda: manager.bus.connected, WORKER_TIMEOUT)
+        if role == "receive":
+            websocket = RecordingWebSocket()
+            await manager.connect(websocket, User(id=RECIPIENT_ID, username="bob"))
+            # The sender waits until it sees the recipient online through the broker
+            print("ready", flush=True)
+            frame = await asyncio.wait_for(frame_with_type(websocket, "new_message"), WORKER_TIMEOUT)
+            print(f"received {frame['content']}", flush=True)
+        else:
+            await wait_for(lambda: manager.is_user_online(RECIPIENT_ID), WORKER_TIMEOUT)
+            await manager.send_to_user({"type": "new_message", "content": f"hi from {os.getpid()}"}, RECIPIENT_ID)
+            await wait_for(lambda: manager.bus.stats()["frames_published"] == 1, WORKER_TIMEOUT)
+    finally:
+        await manager.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(worker(sys.argv[1], sys.argv[2]))
@@ -0,0 +1,119 @@
+import io
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+from fastapi import HTTPException
+from starlette.datastructures import Headers, UploadFile
+from starlette.requests import Request
+
+import downloads
+from auth import create_access_token
+from downloads import sign_download_path, verify_download_signature
+from main import app
+from messaging import create_message
+from routes.messages import get_attachment_link, get_downloadable_attachment
+from storage import save_uploads
+
+PATH = "/messages/attachments/0123abcd.png"
+
+
+def signed(url):
+    parts = urlsplit(url)
+    query = parse_qs(parts.query)
+    return parts.path, int(query["expires"][0]), query["signature"][0]
+
+
+def test_signed_path_verifies_until_it_expires(monkeypatch):
+    url, expires = sign_download_path(PATH)
+    path, query_expires, signature = signed(url)
+    assert (path, query_expires) == (PATH, expires)
+    assert verify_download_signature(PATH, expires, signature)
+
+    # Links are shared within a window and outlive it by up to one more
+    now = downloads.time.time()
+    assert downloads.ATTACHMENT_URL_TTL < expires - now <= 2 * downloads.ATTACHMENT_URL_TTL
+
+    monkeypatch.setattr(downloads.time, "time", lambda: expires + 1)
+    assert not verify_download_signature(PATH, expires, signature)
+
+
+def test_signature_covers_path_and_expiry():
+    url, expires = sign_download_path(PATH)
+    _, _, signature = signed(url)
+    assert not verify_download_signature("/messages/attachments/other.png", expires, signature)
+    assert not verify_download_signature(f"{PATH}/thumbnail", expires, signature)
+    assert not verify_download_signature(PATH, expires + downloads.ATTACHMENT_URL_TTL, signature)
+    assert not verify_download_signature(PATH, expires, "0" * len(signature))
+
+
+def request(path: str) -> Request:
+    return Request({
+        "type": "http", "method": "GET", "scheme": "http", "server": ("testserver", 80),
+        "root_path": "", "path": path, "query_string": b"", "headers": [], "router": app.router,
+    })
+
+
+def test_links_authorize_downloads_without_a_session_token(run, session_factory, make_users, upload_dir):
+    async def scenario():
+        owner, friend, outsider = await make_users("link-owner", "link-friend", "link-outsider")
+        file = UploadFile(io.BytesIO(b"report"), filename="report.txt", headers=Headers({"content-type": "text/plain"}))
+        stored_files = await save_uploads([file])
+        async with session_factory() as db:
+            message, _ = await create_message(db, owner.id, friend, "see attached", stored_files)
+        filename = message.attachments[0].filename
+        download_path = f"/messages/attachments/{filename}"
+
+        async with session_factory() as db:
+            link = await get_attachment_link(filename, request(f"{download_path}/link"), current_user=friend, db=db)
+        assert link["thumbnail_url"] is None
+        path, expires, signature = signed(link["url"])
+        assert path == download_path
+        assert int(link["expires_at"].timestamp()) == expires
+
+        async def download(path, expires=None, signature=None, header_token=None):
+            async with session_factory() as db:
+                return await get_downloadable_attachment(
+                    filename, request(path), expires=expires, signature=signature, header_token=header_token, db=db
+                )
+
+        assert (await download(path, expires=expires, signature=signature)).id == message.attachments[0].id
+        # A link is bound to the file it was issued for
+        with pytest.raises(HTTPException) as error:
+            await download(f"{download_path}/thumbnail", expires=expires, signature=signature)
+        assert error.value.status_code == 403
+        with pytest.raises(HTTPException) as error:
+            await download(path, signature=signature)
+        assert error.value.status_code == 403
+        with pytest.raises(HTTPException) as error:
+            await download(path)
+        assert error.value.status_code == 401
+
+        # The bearer header still works, for participants only
+        token = create_access_token({"sub": owner.username})
+        assert (await download(path, header_token=token)).id == message.attachments[0].id
+        with pytest.raises(HTTPException) as error:
+            await download(path, header_token=create_access_token({"sub": outsider.username}))
+        assert error.value.status_code == 404
+        async with session_factory() as db:
+            with pytest.raises(HTTPException) as error:
+                await get_attachment_link(filename, request(f"{download_path}/link"), current_user=outsider, db=db)
+        assert error.value.status_code == 404
+
+    run(scenario())
+
+
+@pytest.mark.parametrize("content_type, disposition", [
+    ("image/png", "inline"),
+    ("application/pdf", "inline"),
+    ("video/mp4", "inline"),
+    ("text/html; charset=utf-8", "attachment"),
+    ("image/svg+xml", "attachment"),
+    ("application/javascript", "attachment"),
+    (None, "attachment"),
+])
+def test_only_safe_types_are_served_inline(run, tmp_path, content_type, disposition):
+    path = tmp_path / "file"
+    path.write_bytes(b"<script>alert(1)</script>")
+    response = run(downloads.file_response(request("/file"), str(path), "file name", content_type))
+    assert response.headers["content-disposition"] == f"{disposition}; filename*=utf-8''file%20name"
+    assert response.headers["x-content-type-options"] == "nosniff"
@@ -0,0 +1,71 @@
+import io
+
+from fastapi import Response
+from sqlalchemy import event
+from starlette.datastructures import Headers, UploadFile
+
+from messaging import create_message
+from routes.messages import get_messages_with_user
+from serialization import loads
+from storage import save_uploads
+
+
+async def history(session_factory, user, partner, **params):
+    async with session_factory() as db:
+        page = await get_messages_with_user(partner.id, Response(), current_user=user, db=db, **params)
+    return loads(page.body)
+
+
+async def send_with_attachment(session_factory, sender, recipient, index: int):
+    file = UploadFile(io.BytesIO(f"file {index}".encode()), filename=f"file{index}.txt",
+                      headers=Headers({"content-type": "text/plain"}))
+    stored_files = await save_uploads([file])
+    async with session_factory() as db:
+        await create_message(db, sender.id, recipient, f"message {index}", stored_files)
+
+
+def test_compact_history_lists_each_user_once(run, session_factory, make_users, upload_dir):
+    async def scenario():
+        alice, bob = await make_users("alice", "bob")
+        for index in range(3):
+            await send_with_attachment(session_factory, *((bob, alice) if index % 2 else (alice, bob)), index)
+
+        full = await history(session_factory, alice, bob)
+        compact = await history(session_factory, alice, bob, compact=True)
+
+        assert [message["id"] for message in compact["messages"]] == [message["id"] for message in full]
+        assert compact["users"] == {str(user["id"]): user for user in (full[1]["sender"], full[0]["sender"])}
+        for slim, message in zip(compact["messages"], full):
+            assert "sender" not in slim and "recipient" not in slim
+            assert slim["sender_id"] == message["sender"]["id"]
+            assert slim["recipient_id"] == message["recipient"]["id"]
+            assert slim["attachments"] == message["attachments"]
+            assert slim["attachments"][0]["original_filename"] == f"file{message['content'][-1]}.txt"
+
+    run(scenario())
+
+
+def test_history_query_count_does_not_grow_with_the_page(run, engine, session_factory, make_users, upload_dir):
+    async def scenario():
+        alice, bob = await make_users("alice", "bob")
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        async def statements_for_page(**params) -> int:
+            statements.clear()
+            event.listen(engine.sync_engine, "before_cursor_execute", count)
+            try:
+                await history(session_factory, alice, bob, **params)
+            finally:
+                event.remove(engine.sync_engine, "before_cursor_execute", count)
+            return len(statements)
+
+        await send_with_attachment(session_factory, bob, alice, 0)
+        one_message = await statements_for_page(), await statements_for_page(compact=True)
+        for index in range(1, 8):
+            await send_with_attachment(session_factory, bob, alice, index)
+        assert (await statements_for_page(), await statements_for_page(compact=True)) == one_message
+
+    run(scenario())
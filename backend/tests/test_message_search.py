@@ -0,0 +1,28 @@
+from message_search import HIGHLIGHT_START, HIGHLIGHT_STOP, highlight, search_messages
+from messaging import create_message
+
+
+def test_highlight_escapes_text_but_not_marks():
+    assert highlight("<b>hi</b> & \"bye\"") == \
+        "&lt;b&gt;<mark>hi</mark>&lt;/b&gt; &amp; &quot;bye&quot;"
+
+
+def test_snippets_escape_message_html(run, session_factory, make_users):
+    async def scenario():
+        alice, bob = await make_users("alice", "bob")
+        async with session_factory() as db:
+            await create_message(db, bob.id, alice, '<img src=x onerror="alert(1)"> payload <script>steal()</script>')
+            await create_message(db, bob.id, alice, "an ordinary payload")
+
+        async with session_factory() as db:
+            hits = await search_messages(db, alice.id, "payload", 10)
+        # Snippet boundaries differ between SQLite and Postgres
+        ordinary, hostile = (snippet for _, snippet in hits)
+        assert f"{HIGHLIGHT_START}payload{HIGHLIGHT_STOP}" in ordinary
+        assert f"{HIGHLIGHT_START}payload{HIGHLIGHT_STOP}" in hostile
+        assert "<img" not in hostile and "<script" not in hostile
+        assert "&lt;" in hostile
+        # Markup left in a snippet is only the marks
+        assert hostile.replace(HIGHLIGHT_START, "").replace(HIGHLIGHT_STOP, "").count("<") == 0
+
+    run(scenario())
@@ -0,0 +1,67 @@
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import database
+from database import InstrumentedQueuePool, PoolMetrics, get_engine_options
+from routes import metrics
+from routes.metrics import get_metrics, require_metrics_token
+
+
+def test_metrics_are_not_served_without_a_configured_token(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "")
+    with pytest.raises(HTTPException) as error:
+        require_metrics_token("anything")
+    assert error.value.status_code == 404
+
+
+@pytest.mark.parametrize("token", [None, "", "wrong", "s3cret-but-longer"])
+def test_metrics_require_the_token(monkeypatch, token):
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "s3cret")
+    with pytest.raises(HTTPException) as error:
+        require_metrics_token(token)
+    assert error.value.status_code == 401
+
+
+def test_metrics_report_each_subsystem(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "s3cret")
+    require_metrics_token("s3cret")
+    assert set(get_metrics()) == {
+        "database_pool", "auth_cache", "password_hashing", "thumbnails", "serialization_cache", "websocket"
+    }
+
+
+def test_pool_settings_apply_to_server_databases():
+    options = get_engine_options("postgresql://user:password@db/messenger")
+    assert options["poolclass"] is InstrumentedQueuePool
+    assert (options["pool_size"], options["max_overflow"]) == (database.DB_POOL_SIZE, database.DB_MAX_OVERFLOW)
+    # SQLite keeps the pool it picks for the file or in-memory database
+    assert "poolclass" not in get_engine_options("sqlite:///./messenger.db")
+
+
+def test_pool_metrics_report_saturation_and_timeouts(run, tmp_path, monkeypatch):
+    pool_metrics = PoolMetrics()
+    monkeypatch.setattr(database, "pool_metrics", pool_metrics)
+    monkeypatch.setattr(database, "DB_MAX_OVERFLOW", 0)
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'pool.db'}",
+        poolclass=InstrumentedQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.1
+    )
+
+    async def scenario():
+        async with engine.connect() as held:
+            await held.execute(text("SELECT 1"))
+            status = pool_metrics.snapshot(engine.sync_engine.pool)
+            assert (status["size"], status["in_use"], status["saturation"]) == (1, 1, 1.0)
+            with pytest.raises(PoolTimeoutError):
+                async with engine.connect():
+                    pass
+        status = pool_metrics.snapshot(engine.sync_engine.pool)
+        assert (status["in_use"], status["idle"], status["saturation"]) == (0, 1, 0.0)
+        assert status["timeouts"] == 1
+        assert status["checkout_wait_max_ms"] >= 100
+        await engine.dispose()
+
+    run(scenario())
@@ -0,0 +1,190 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import Response
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, MetaData, String, Table, Text, inspect, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.sql import func
+
+from conversations import get_conversation
+from migrations import upgrade_database, upgrade_schema
+from models import Base, Message, MessageAttachment, User
+from message_search import search_messages
+from messaging import create_message
+from routes.messages import get_messages_with_user, get_user_chats
+from serialization import loads
+from user_search import search_users
+
+pytestmark = pytest.mark.skipif("TEST_DATABASE_URL" in os.environ, reason="builds its own SQLite database")
+
+# Tables as created by the first release
+initial = MetaData()
+Table(
+    "users", initial,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("username", String(50), unique=True, index=True, nullable=False),
+    Column("email", String(100), unique=True, index=True, nullable=False),
+    Column("hashed_password", String(255), nullable=False),
+    Column("is_active", Boolean, default=True),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+)
+Table(
+    "messages", initial,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("content", Text, nullable=False),
+    Column("sender_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("recipient_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+    Column("updated_at", DateTime(timezone=True)),
+    Column("is_edited", Boolean, default=False),
+    Column("is_deleted", Boolean, default=False),
+)
+Table(
+    "message_attachments", initial,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("message_id", Integer, ForeignKey("messages.id"), nullable=False),
+    Column("filename", String(255), nullable=False),
+    Column("original_filename", String(255), nullable=False),
+    Column("file_path", String(500), nullable=False),
+    Column("file_size", Integer, nullable=False),
+    Column("content_type", String(100), nullable=True),
+    Column("uploaded_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+
+async def initial_database(tmp_path, message_count: int = 1):
+    """A database as the first release left it, with history between alice and bob."""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'old.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(initial.create_all)
+        users, messages, attachments = (initial.tables[name] for name in ("users", "messages", "message_attachments"))
+        await conn.execute(users.insert(), [
+            {"id": 1, "username": "alice", "email": "alice@example.com", "hashed_password": "x"},
+            {"id": 2, "username": "bob", "email": "bob@example.com", "hashed_password": "x"},
+        ])
+        await conn.execute(messages.insert(), [
+            {"id": id, "content": "hi" if id == 1 else f"message {id}",
+             "sender_id": 2 if id % 2 else 1, "recipient_id": 1 if id % 2 else 2, "is_deleted": False,
+             "created_at": datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=id)}
+            for id in range(1, message_count + 1)
+        ])
+        await conn.execute(attachments.insert(), [
+            {"id": 1, "message_id": 1, "filename": "a.png", "original_filename": "a.png",
+             "file_path": "uploads/a.png", "file_size": 3},
+        ])
+    return engine
+
+
+def test_upgrade_of_initial_schema(run, tmp_path):
+    async def scenario():
+        engine = await initial_database(tmp_path)
+        applied = await upgrade_database(engine)
+        assert "add users.event_seq" in applied
+        assert "add messages.conversation_id" in applied
+        assert "create username search index" in applied
+        assert "create message search index" in applied
+        assert "backfill conversations" in applied
+
+        def schema(conn):
+            inspector = inspect(conn)
+            return {
+                table: ({c["name"]: c["nullable"] for c in inspector.get_columns(table)},
+                        {index["name"] for index in inspector.get_indexes(table)})
+                for table in ("users", "messages", "message_attachments")
+            }
+
+        async with engine.begin() as conn:
+            upgraded = await conn.run_sync(schema)
+        # Idempotent once up to date
+        assert await upgrade_database(engine) == []
+        for table in upgraded:
+            assert set(upgraded[table][0]) == set(Base.metadata.tables[table].columns.keys())
+        assert upgraded["message_attachments"][0]["message_id"]
+        assert {"ix_messages_sender_recipient_id", "uq_messages_sender_client_id"} <= upgraded["messages"][1]
+        assert "ix_message_attachments_sha256" in upgraded["message_attachments"][1]
+
+        session_factory = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+        async with session_factory() as db:
+            # Existing rows survive and the new code paths work on them
+            assert (await db.get(MessageAttachment, 1)).message_id == 1
+            assert (await db.get(User, 1)).event_seq == 0
+            # Linked to their conversation by the upgrade
+            assert (await db.get(Message, 1)).conversation_id == (await get_conversation(db, 1, 2)).id
+            # Messages from before the search index are found
+            assert [message.id for message, _ in await search_messages(db, 1, "hi", 10)] == [1]
+
+            alice = await db.get(User, 1)
+            message, seq = await create_message(db, 2, alice, "again", client_id="retry-key")
+            assert seq == 1
+            db.add(Message(content="dup", sender_id=2, recipient_id=1, client_id="retry-key"))
+            with pytest.raises(IntegrityError):
+                await db.commit()
+            await db.rollback()
+
+            # Users from before the search index are found, by every tier
+            for query in ("alice", "ali", "lic"):
+                users, _ = await search_users(db, query, 10, exclude_user_id=2)
+                assert [user.username for user in users] == ["alice"]
+
+            db.add(MessageAttachment(filename="b", original_filename="b", file_path="b", file_size=2 ** 33))
+            await db.commit()
+            assert (await db.scalar(select(MessageAttachment.file_size).where(MessageAttachment.filename == "b"))) == 2 ** 33
+
+        await engine.dispose()
+
+    run(scenario())
+
+
+def test_legacy_history_pages_after_upgrade(run, tmp_path):
+    async def scenario():
+        engine = await initial_database(tmp_path, message_count=25)
+        await upgrade_database(engine)
+
+        session_factory = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+        async with session_factory() as db:
+            alice = await db.get(User, 1)
+            pages, cursor = [], None
+            while True:
+                response = Response()
+                page = await get_messages_with_user(
+                    2, response, limit=10, cursor=cursor, current_user=alice, db=db
+                )
+                pages.append([message["id"] for message in loads(page.body)])
+                cursor = response.headers.get("X-Next-Cursor")
+                if cursor is None:
+                    break
+        assert pages == [list(range(25, 15, -1)), list(range(15, 5, -1)), list(range(5, 0, -1))]
+
+        await engine.dispose()
+
+    run(scenario())
+
+
+def test_reads_link_messages_written_by_earlier_versions(run, tmp_path):
+    async def scenario():
+        engine = await initial_database(tmp_path, message_count=3)
+        # Schema upgraded, but the rows not yet, as while a worker on the
+        # earlier version is still writing during a rolling deploy
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(upgrade_schema)
+
+        session_factory = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+        async with session_factory() as db:
+            alice = await db.get(User, 1)
+            page = await get_messages_with_user(2, Response(), current_user=alice, db=db)
+            assert [message["id"] for message in loads(page.body)] == [3, 2, 1]
+
+            await db.execute(initial.tables["messages"].insert().values(
+                id=4, content="from an old worker", sender_id=2, recipient_id=1, is_deleted=False,
+                created_at=datetime(2024, 1, 2, tzinfo=timezone.utc)
+            ))
+            await db.commit()
+            chats = loads((await get_user_chats(current_user=alice, db=db)).body)
+            assert [(chat["user"]["id"], chat["last_message"]["id"], chat["unread_count"]) for chat in chats] == [(2, 4, 3)]
+
+        await engine.dispose()
+
+    run(scenario())
@@ -0,0 +1,103 @@
+import asyncio
+
+from delivery_bus import InProcessBus
+from models import User
+from serialization import loads
+from websocket_manager import ConnectionManager
+
+GRACE_PERIOD = 0.1
+
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.frames = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        self.frames.append(loads(text))
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        pass
+
+    def presence(self) -> list:
+        """Presence frames received since the last call."""
+        frames = [frame for frame in self.frames if frame["type"] == "presence"]
+        self.frames.clear()
+        return [(sorted(frame["online"]), sorted(frame["offline"])) for frame in frames]
+
+
+async def connect(manager, user_id: int) -> RecordingWebSocket:
+    websocket = RecordingWebSocket()
+    await manager.connect(websocket, User(id=user_id, username=f"user{user_id}"))
+    return websocket
+
+
+async def shutdown(manager):
+    for websocket in list(manager.connections):
+        manager.disconnect(websocket)
+    await asyncio.sleep(0.01)
+    await manager.presence.stop()
+
+
+async def flush(manager):
+    manager.presence.flush()
+    # Let the writers send what was queued
+    await asyncio.sleep(0.01)
+
+
+def test_subscribers_get_batched_diffs_of_watched_users(run):
+    async def scenario():
+        manager = ConnectionManager(bus=InProcessBus())
+        manager.presence.grace_period = GRACE_PERIOD
+        watcher, bystander = await connect(manager, 1), await connect(manager, 9)
+        assert manager.presence.subscribe(watcher, [2, 3, 2]) == [2, 3]
+        manager.presence.subscribe(bystander, [4])
+        await flush(manager)
+        watcher.presence(), bystander.presence()
+
+        # Both changes go out in one frame, only to the socket watching them
+        second, third = await connect(manager, 2), await connect(manager, 3)
+        await connect(manager, 5)
+        await flush(manager)
+        assert watcher.presence() == [([2, 3], [])]
+        assert bystander.presence() == []
+
+        # A reconnect within the grace period is never seen
+        manager.disconnect(second)
+        await connect(manager, 2)
+        await asyncio.sleep(GRACE_PERIOD * 2)
+        await flush(manager)
+        assert watcher.presence() == []
+        assert manager.presence.stats()["flaps_suppressed"] == 1
+
+        # Leaving is reported once the grace period has passed
+        manager.disconnect(third)
+        await flush(manager)
+        assert watcher.presence() == []
+        await asyncio.sleep(GRACE_PERIOD * 2)
+        await flush(manager)
+        assert watcher.presence() == [([], [3])]
+
+        # Unsubscribed sockets hear nothing more
+        manager.presence.unsubscribe(watcher, [3])
+        await connect(manager, 3)
+        await flush(manager)
+        assert watcher.presence() == []
+        await shutdown(manager)
+
+    run(scenario())
+
+
+def test_closed_sockets_drop_their_subscriptions(run):
+    async def scenario():
+        manager = ConnectionManager(bus=InProcessBus())
+        watcher = await connect(manager, 1)
+        manager.presence.subscribe(watcher, [2, 3])
+        manager.disconnect(watcher)
+        stats = manager.presence.stats()
+        assert (stats["subscribed_connections"], stats["watched_users"]) == (0, 0)
+        await shutdown(manager)
+
+    run(scenario())
@@ -0,0 +1,81 @@
+from conversations import advance_read_watermark, get_conversation, get_unread_count
+from messaging import create_message
+
+
+async def unread_count(session_factory, reader, partner) -> int:
+    async with session_factory() as db:
+        conversation = await get_conversation(db, reader.id, partner.id)
+        return get_unread_count(conversation, reader.id)
+
+
+async def send(session_factory, sender, recipient, count: int):
+    async with session_factory() as db:
+        return [(await create_message(db, sender.id, recipient, f"message {i}"))[0] for i in range(count)]
+
+
+def test_watermark_counts_messages_after_it(run, session_factory, make_users):
+    async def scenario():
+        alice, bob = await make_users("alice", "bob")
+        messages = await send(session_factory, bob, alice, 3)
+
+        async with session_factory() as db:
+            assert await advance_read_watermark(db, alice.id, bob.id, messages[0].id)
+            await db.commit()
+        assert await unread_count(session_factory, alice, bob) == 2
+
+    run(scenario())
+
+
+def test_watermark_past_latest_message_is_clamped(run, session_factory, make_users):
+    async def scenario():
+        alice, bob = await make_users("alice", "bob")
+        await send(session_factory, bob, alice, 1)
+
+        async with session_factory() as db:
+            await advance_read_watermark(db, alice.id, bob.id, 999999)
+            await db.commit()
+        assert await unread_count(session_factory, alice, bob) == 0
+
+        # Messages arriving after a bogus id still count as unread
+        messages = await send(session_factory, bob, alice, 3)
+        assert await unread_count(session_factory, alice, bob) == 3
+
+        async with session_factory() as db:
+            await advance_read_watermark(db, alice.id, bob.id, messages[-1].id)
+            await db.commit()
+            conversation = await get_conversation(db, alice.id, bob.id)
+            assert get_unread_count(conversation, alice.id) == 0
+
+    run(scenario())
+
+
+def test_watermark_ignores_other_conversations(run, session_factory, make_users):
+    async def scenario():
+        alice, bob, carol = await make_users("alice", "bob", "carol")
+        await send(session_factory, bob, alice, 2)
+        # Newer ids sent by someone else, and by alice herself
+        other = await send(session_factory, carol, alice, 2)
+        own = await send(session_factory, alice, bob, 1)
+
+        for message_id in (other[-1].id, own[-1].id):
+            async with session_factory() as db:
+                await advance_read_watermark(db, alice.id, bob.id, message_id)
+                await db.commit()
+        await send(session_factory, bob, alice, 1)
+        assert await unread_count(session_factory, alice, bob) == 1
+
+    run(scenario())
+
+
+def test_watermark_without_messages_from_partner(run, session_factory, make_users):
+    async def scenario():
+        alice, bob = await make_users("alice", "bob")
+        await send(session_factory, alice, bob, 1)
+
+        async with session_factory() as db:
+            assert not await advance_read_watermark(db, alice.id, bob.id, 999999)
+            await db.commit()
+        await send(session_factory, bob, alice, 1)
+        assert await unread_count(session_factory, alice, bob) == 1
+
+    run(scenario())
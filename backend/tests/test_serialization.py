@@ -0,0 +1,42 @@
+from datetime import datetime, timezone
+
+from fastapi import Response
+
+from messaging import create_message
+from schemas import CompactMessageResponse, MessageResponse
+from serialization import (
+    dumps, json_response, loads, message_fragment, serialize_compact_message, serialize_message
+)
+
+
+def test_serialized_messages_match_the_response_models(run, session_factory, make_users):
+    async def scenario():
+        alice, bob = await make_users("alice", "bob")
+        async with session_factory() as db:
+            message, _ = await create_message(db, alice.id, bob, "hello")
+
+        expected = MessageResponse.model_validate(message)
+        assert MessageResponse.model_validate(loads(dumps(serialize_message(message)))) == expected
+        # The cached fragment encodes the same document
+        assert MessageResponse.model_validate(loads(dumps(message_fragment(message)))) == expected
+        assert set(loads(dumps(message_fragment(message)))) == set(MessageResponse.model_fields)
+
+        compact = loads(dumps(serialize_compact_message(message)))
+        assert set(compact) == set(CompactMessageResponse.model_fields)
+        assert CompactMessageResponse.model_validate(compact) == CompactMessageResponse.model_validate(message)
+
+    run(scenario())
+
+
+def test_frames_encode_int_keys_and_datetimes():
+    moment = datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    assert loads(dumps({"online": {1: True}, "at": moment})) == {"online": {"1": True}, "at": "2024-01-02T03:04:05+00:00"}
+
+
+def test_json_response_keeps_headers_set_by_the_route():
+    response = Response()
+    response.headers["X-Next-Cursor"] = "abc"
+    encoded = json_response({2: [1, 2]}, response)
+    assert encoded.headers["x-next-cursor"] == "abc"
+    assert encoded.headers["content-type"] == "application/json"
+    assert loads(encoded.body) == {"2": [1, 2]}
@@ -0,0 +1,227 @@
+import asyncio
+import io
+import os
+import time
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select
+from starlette.datastructures import Headers, UploadFile
+
+import storage
+from messaging import create_message
+from models import Blob, MessageAttachment
+from routes.messages import delete_message
+from storage import (
+    RequestSizeLimitMiddleware, add_blob_references, blob_path, collect_blobs, release_blob_references, save_uploads
+)
+from upload_sessions import create_session, session_file_path, sweep_temp_files
+
+CONTENT = b"the same meme, forwarded again"
+
+
+async def upload(content: bytes = CONTENT, filename: str = "meme.txt"):
+    file = UploadFile(io.BytesIO(content), filename=filename, headers=Headers({"content-type": "text/plain"}))
+    return await save_uploads([file])
+
+
+async def send_file(session_factory, sender, recipient, content: bytes = CONTENT):
+    stored_files = await upload(content)
+    async with session_factory() as db:
+        message, _ = await create_message(db, sender.id, recipient, "look", stored_files)
+    return message, stored_files[0]
+
+
+async def blob_refs(session_factory, sha256: str):
+    async with session_factory() as db:
+        return await db.scalar(select(Blob.ref_count).where(Blob.sha256 == sha256))
+
+
+def temp_files(upload_dir):
+    return os.listdir(upload_dir / "tmp")
+
+
+def test_concurrent_uploads_of_same_content_share_one_blob(run, session_factory, make_users, upload_dir):
+    async def scenario():
+        alice, bob, carol = await make_users("alice", "bob", "carol")
+        (first, stored), (second, _) = await asyncio.gather(
+            send_file(session_factory, bob, alice),
+            send_file(session_factory, carol, alice),
+        )
+
+        assert first.attachments[0].file_path == second.attachments[0].file_path == stored.file_path
+        assert await blob_refs(session_factory, stored.sha256) == 2
+        with open(blob_path(stored.sha256), "rb") as file:
+            assert file.read() == CONTENT
+        assert temp_files(upload_dir) == []
+
+    run(scenario())
+
+
+def test_upload_racing_garbage_collection_keeps_its_blob(run, session_factory, make_users, upload_dir):
+    async def scenario():
+        alice, bob = await make_users("alice", "bob")
+        for attempt in range(5):
+            # An unreferenced blob the collector is about to delete
+            _, stored = await send_file(session_factory, bob, alice)
+            async with session_factory() as db:
+                await release_blob_references(db, [stored.sha256])
+                await db.commit()
+            assert await blob_refs(session_factory, stored.sha256) == 0
+
+            # Let the collector start ahead of the upload on odd attempts
+            async def collect_after(delay):
+                await asyncio.sleep(delay)
+                async with session_factory() as db:
+                    await collect_blobs(db, [stored.sha256])
+
+            results = await asyncio.gather(
+                send_file(session_factory, bob, alice),
+                collect_after(0 if attempt % 2 else 0.01),
+            )
+            sent, _ = results[0]
+
+            assert await blob_refs(session_factory, stored.sha256) == 1
+            assert os.path.exists(blob_path(stored.sha256))
+            async with session_factory() as db:
+                await delete_message(sent.id, current_user=bob, db=db)
+            assert not os.path.exists(blob_path(stored.sha256))
+
+    run(scenario())
+
+
+def test_ref_count_follows_message_deletes(run, session_factory, make_users, upload_dir):
+    async def scenario():
+        alice, bob = await make_users("alice", "bob")
+        first, stored = await send_file(session_factory, bob, alice)
+        second, _ = await send_file(session_factory, bob, alice)
+        assert await blob_refs(session_factory, stored.sha256) == 2
+
+        async with session_factory() as db:
+            await delete_message(first.id, current_user=bob, db=db)
+        assert await blob_refs(session_factory, stored.sha256) == 1
+        assert os.path.exists(blob_path(stored.sha256))
+
+        # Deleting twice doesn't release the reference twice
+        async with session_factory() as db:
+            await delete_message(first.id, current_user=bob, db=db)
+        assert await blob_refs(session_factory, stored.sha256) == 1
+
+        async with session_factory() as db:
+            await delete_message(second.id, current_user=bob, db=db)
+        assert await blob_refs(session_factory, stored.sha256) is None
+        assert not os.path.exists(blob_path(stored.sha256))
+
+    run(scenario())
+
+
+def age(path, seconds: int = 7200):
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def test_sweep_restores_blob_left_unpublished_by_a_crash(run, session_factory, make_users, upload_dir):
+    async def scenario():
+        alice, = await make_users("alice")
+        stored, = await upload()
+        # The message committed, then the process died before publish_uploads
+        async with session_factory() as db:
+            db.add(MessageAttachment(
+                filename=stored.filename, original_filename=stored.original_filename,
+                file_path=stored.file_path, file_size=stored.file_size, sha256=stored.sha256
+            ))
+            await add_blob_references(db, [stored])
+            await db.commit()
+        age(stored.temp_path)
+
+        # An abandoned upload that no blob references, and one in progress
+        abandoned, = await upload(b"never sent")
+        age(abandoned.temp_path)
+        in_progress, = await upload(b"still uploading")
+        # A resumable upload idle for a while, but not expired
+        async with session_factory() as db:
+            session = await create_session(db, alice.id, "video.mp4", 10, "video/mp4")
+        age(session_file_path(session.id))
+
+        async with session_factory() as db:
+            swept = await sweep_temp_files(db)
+        assert swept == {"temp_files_restored": 1, "temp_files_removed": 1}
+        with open(blob_path(stored.sha256), "rb") as file:
+            assert file.read() == CONTENT
+        assert sorted(temp_files(upload_dir)) == sorted([
+            os.path.basename(in_progress.temp_path),
+            os.path.basename(session_file_path(session.id)),
+        ])
+
+    run(scenario())
+
+
+@pytest.fixture
+def small_caps(monkeypatch):
+    """10-byte files, 16 bytes per message, copied 4 bytes at a time."""
+    monkeypatch.setattr(storage, "UPLOAD_CHUNK_SIZE", 4)
+    monkeypatch.setattr(storage, "MAX_ATTACHMENT_SIZE", 10)
+    monkeypatch.setattr(storage, "MAX_MESSAGE_ATTACHMENTS_SIZE", 16)
+
+
+def uploads(*contents: bytes):
+    return [
+        UploadFile(io.BytesIO(content), filename=f"file{index}.txt", headers=Headers({"content-type": "text/plain"}))
+        for index, content in enumerate(contents)
+    ]
+
+
+def test_uploads_stream_in_chunks_within_the_caps(run, upload_dir, small_caps):
+    stored = run(save_uploads(uploads(b"0123456789", b"abcdef")))
+    assert [file.file_size for file in stored] == [10, 6]
+    with open(stored[0].temp_path, "rb") as file:
+        assert file.read() == b"0123456789"
+
+
+@pytest.mark.parametrize("contents, detail", [
+    ((b"0123456789X",), "Attachment exceeds 10 bytes"),
+    ((b"0123456789", b"abcdefg"), "Attachments exceed 16 bytes per message"),
+])
+def test_oversized_uploads_are_rejected_and_removed(run, upload_dir, small_caps, contents, detail):
+    with pytest.raises(HTTPException) as error:
+        run(save_uploads(uploads(*contents)))
+    assert (error.value.status_code, error.value.detail) == (413, detail)
+    assert temp_files(upload_dir) == []
+
+
+def call_with_body(chunks, content_length=None):
+    """Send a POST /messages/ body in chunks; returns (status, body read by the app)."""
+    headers = [] if content_length is None else [(b"content-length", str(content_length).encode())]
+    scope = {"type": "http", "method": "POST", "path": "/messages/", "headers": headers}
+    incoming = [{"type": "http.request", "body": chunk, "more_body": True} for chunk in chunks]
+    incoming[-1]["more_body"] = False
+    read, sent = [], []
+
+    async def receive():
+        return incoming.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    async def app(scope, receive, send):
+        while True:
+            message = await receive()
+            read.append(message["body"])
+            if not message["more_body"]:
+                break
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def call():
+        await RequestSizeLimitMiddleware(app, max_size=10)(scope, receive, send)
+        return sent[0]["status"], b"".join(read)
+
+    return call()
+
+
+def test_request_size_limit_checks_declared_and_received_sizes(run):
+    assert run(call_with_body([b"01234", b"56789"], content_length=10)) == (200, b"0123456789")
+    # Rejected up front on Content-Length, before the app reads anything
+    assert run(call_with_body([b"0123456789X"], content_length=11)) == (413, b"")
+    # Rejected as soon as the streamed body passes the limit
+    assert run(call_with_body([b"01234", b"56789", b"X", b"more"])) == (413, b"0123456789")
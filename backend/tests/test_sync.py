@@ -0,0 +1,117 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import update
+
+import routes.websocket
+from event_log import EVENT_LOG_RETENTION, prune_events
+from messaging import create_message
+from models import UserEvent
+from routes.sync import sync
+from serialization import dumps, loads
+
+SENDERS = 4
+MESSAGES_PER_SENDER = 5
+
+
+class RecordingManager:
+    """Stands in for the connection manager; keeps the frames sent to a socket."""
+
+    def __init__(self):
+        self.frames = []
+
+    async def send_personal_message(self, message: dict, websocket):
+        self.frames.append(message)
+
+
+@pytest.fixture
+def resume(session_factory, monkeypatch):
+    """Send a resume frame over the WebSocket handler; returns the sync reply."""
+    manager = RecordingManager()
+    monkeypatch.setattr(routes.websocket, "SessionLocal", session_factory)
+    monkeypatch.setattr(routes.websocket, "manager", manager)
+
+    async def resume(user_id: int, since):
+        await routes.websocket.handle_resume({"type": "resume", "since": since}, user_id, websocket=None)
+        # As the client receives it; messages are pre-encoded fragments
+        frame = loads(dumps(manager.frames.pop()))
+        assert frame.pop("type") == "sync"
+        return frame
+
+    return resume
+
+
+async def http_sync(session_factory, user, since, limit: int = 500) -> dict:
+    async with session_factory() as db:
+        return loads((await sync(since=since, limit=limit, current_user=user, db=db)).body)
+
+
+async def send_all(session_factory, senders, recipient):
+    """Every sender sends its messages one after another, all senders at once."""
+    async def send_from(sender):
+        sent = []
+        for index in range(MESSAGES_PER_SENDER):
+            async with session_factory() as db:
+                message, seq = await create_message(db, sender.id, recipient, f"{sender.username} {index}")
+            sent.append((seq, message.id))
+        return sent
+
+    return [pair for sent in await asyncio.gather(*map(send_from, senders)) for pair in sent]
+
+
+def test_concurrent_sends_replay_gapless_and_in_order(run, session_factory, make_users, resume):
+    async def scenario():
+        recipient, *senders = await make_users("alice", *(f"sender{i}" for i in range(SENDERS)))
+        sent = await send_all(session_factory, senders, recipient)
+        total = SENDERS * MESSAGES_PER_SENDER
+        # Each send got its own seq, with none skipped
+        assert sorted(seq for seq, _ in sent) == list(range(1, total + 1))
+        message_for_seq = dict(sent)
+
+        for replay in (await http_sync(session_factory, recipient, 0), await resume(recipient.id, 0)):
+            assert replay["full_resync"] is False and replay["has_more"] is False
+            assert replay["seq"] == total
+            assert [frame["seq"] for frame in replay["events"]] == list(range(1, total + 1))
+            assert all(frame["message"]["id"] == message_for_seq[frame["seq"]] for frame in replay["events"])
+
+        # Paging from the returned seq continues without gaps or repeats
+        seqs, since = [], 3
+        while True:
+            page = await http_sync(session_factory, recipient, since, limit=7)
+            seqs += [frame["seq"] for frame in page["events"]]
+            since = page["seq"]
+            if not page["has_more"]:
+                break
+        assert seqs == list(range(4, total + 1))
+
+        # Caught up
+        assert (await resume(recipient.id, total))["events"] == []
+
+    run(scenario())
+
+
+def test_since_older_than_retention_requires_full_resync(run, session_factory, make_users, resume):
+    async def scenario():
+        recipient, sender = await make_users("alice", "bob")
+        for index in range(3):
+            async with session_factory() as db:
+                await create_message(db, sender.id, recipient, f"message {index}")
+
+        # The first two events fall out of the retention window
+        expired = datetime.now(timezone.utc) - timedelta(seconds=EVENT_LOG_RETENTION + 60)
+        async with session_factory() as db:
+            await db.execute(update(UserEvent).where(UserEvent.seq <= 2).values(created_at=expired))
+            await db.commit()
+            assert await prune_events(db) == 2
+
+        for since in (0, 1):
+            for replay in (await http_sync(session_factory, recipient, since), await resume(recipient.id, since)):
+                assert replay == {"seq": 3, "events": [], "full_resync": True, "has_more": False}
+
+        # A client that already applied the pruned events still catches up
+        for replay in (await http_sync(session_factory, recipient, 2), await resume(recipient.id, 2)):
+            assert replay["full_resync"] is False
+            assert [frame["seq"] for frame in replay["events"]] == [3]
+
+    run(scenario())
@@ -0,0 +1,86 @@
+import io
+import os
+
+import pytest
+from PIL import Image
+
+import thumbnails
+from models import MessageAttachment
+from storage import blob_path
+from thumbnails import THUMBNAIL_FAILED, THUMBNAIL_PENDING, THUMBNAIL_READY, ThumbnailGenerator
+
+
+@pytest.fixture
+def generator(session_factory, monkeypatch):
+    monkeypatch.setattr(thumbnails, "SessionLocal", session_factory)
+    return ThumbnailGenerator(workers=1, queue_size=10, sweep_interval=30, missing_source_grace=3600)
+
+
+def png() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (640, 480), "red").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+async def pending_attachment(session_factory, sha256: str) -> MessageAttachment:
+    async with session_factory() as db:
+        attachment = MessageAttachment(
+            filename=f"{sha256}.png", original_filename="photo.png", file_path=blob_path(sha256),
+            file_size=1, content_type="image/png", sha256=sha256, thumbnail_status=THUMBNAIL_PENDING
+        )
+        db.add(attachment)
+        await db.commit()
+    return attachment
+
+
+async def status(session_factory, attachment_id: int) -> str:
+    async with session_factory() as db:
+        return (await db.get(MessageAttachment, attachment_id)).thumbnail_status
+
+
+def write_source(sha256: str, content: bytes):
+    path = blob_path(sha256)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(content)
+
+
+def test_missing_source_stays_pending_until_published(run, session_factory, generator, upload_dir):
+    async def scenario():
+        sha256 = "ab" * 32
+        attachment = await pending_attachment(session_factory, sha256)
+
+        # Committed, but publish_uploads hasn't moved the file into place yet
+        await generator.process(attachment.id)
+        assert await status(session_factory, attachment.id) == THUMBNAIL_PENDING
+        assert generator.stats()["waiting_for_source"] == 1
+
+        write_source(sha256, png())
+        await generator.process(attachment.id)
+        assert await status(session_factory, attachment.id) == THUMBNAIL_READY
+        stats = generator.stats()
+        assert (stats["generated"], stats["failed"], stats["retried"], stats["waiting_for_source"]) == (1, 0, 1, 0)
+
+    run(scenario())
+
+
+def test_source_missing_past_grace_fails(run, session_factory, generator, upload_dir):
+    async def scenario():
+        attachment = await pending_attachment(session_factory, "cd" * 32)
+        generator.missing_source_grace = 0
+        await generator.process(attachment.id)
+        assert await status(session_factory, attachment.id) == THUMBNAIL_FAILED
+
+    run(scenario())
+
+
+def test_undecodable_source_fails(run, session_factory, generator, upload_dir):
+    async def scenario():
+        sha256 = "ef" * 32
+        attachment = await pending_attachment(session_factory, sha256)
+        write_source(sha256, b"not an image")
+        await generator.process(attachment.id)
+        assert await status(session_factory, attachment.id) == THUMBNAIL_FAILED
+        assert generator.failed == 1
+
+    run(scenario())
@@ -0,0 +1,82 @@
+import asyncio
+
+from serialization import loads
+from typing_indicators import TypingThrottle
+
+MIN_INTERVAL = 0.1
+TIMEOUT = 0.3
+
+
+class RecordingManager:
+    """Stands in for the connection manager; keeps the typing frames delivered."""
+
+    def __init__(self):
+        self.delivered = []
+
+    def is_user_online(self, user_id: int) -> bool:
+        return True
+
+    def deliver(self, text: str, user_id: int, coalesce_key=None):
+        frame = loads(text)
+        assert (frame["type"], coalesce_key) == ("typing", f"typing:{frame['sender_id']}")
+        self.delivered.append((frame["sender_id"], user_id, frame["is_typing"]))
+
+
+def test_changes_are_forwarded_at_most_once_per_interval(run):
+    async def scenario():
+        manager = RecordingManager()
+        typing = TypingThrottle(manager, min_interval=MIN_INTERVAL, timeout=TIMEOUT)
+
+        typing.update(1, 2, True)
+        typing.update(1, 2, True)
+        assert manager.delivered == [(1, 2, True)]
+
+        # Stopped and started again within the interval: nothing to tell
+        typing.update(1, 2, False)
+        typing.update(1, 2, True)
+        await asyncio.sleep(MIN_INTERVAL * 1.5)
+        assert manager.delivered == [(1, 2, True)]
+
+        # Only the latest of several changes goes out, once the interval allows it
+        typing.update(1, 2, False)
+        await asyncio.sleep(0)
+        assert manager.delivered == [(1, 2, True), (1, 2, False)]
+        typing.update(1, 2, True)
+        typing.update(1, 2, False)
+        typing.update(1, 2, True)
+        assert len(manager.delivered) == 2
+        await asyncio.sleep(MIN_INTERVAL * 1.5)
+        assert manager.delivered[2:] == [(1, 2, True)]
+
+        # Other conversations are throttled separately
+        typing.update(1, 3, True)
+        assert manager.delivered[3:] == [(1, 3, True)]
+        assert typing.stats()["updates_received"] == 9
+        typing.clear(1)
+
+    run(scenario())
+
+
+def test_typing_stops_when_not_refreshed_or_disconnected(run):
+    async def scenario():
+        manager = RecordingManager()
+        typing = TypingThrottle(manager, min_interval=MIN_INTERVAL, timeout=TIMEOUT)
+
+        typing.update(1, 2, True)
+        await asyncio.sleep(TIMEOUT / 2)
+        typing.update(1, 2, True)
+        await asyncio.sleep(TIMEOUT / 2 + 0.05)
+        # Refreshed, so still typing
+        assert manager.delivered == [(1, 2, True)]
+        await asyncio.sleep(TIMEOUT / 2 + 0.05)
+        assert manager.delivered == [(1, 2, True), (1, 2, False)]
+        assert typing.stats()["expired"] == 1
+
+        # The last socket closing stops typing at once, without throttling
+        typing.update(1, 3, True)
+        typing.clear(1)
+        assert manager.delivered[2:] == [(1, 3, True), (1, 3, False)]
+        await asyncio.sleep(MIN_INTERVAL * 1.5)
+        assert typing.stats()["active"] == 0
+
+    run(scenario())
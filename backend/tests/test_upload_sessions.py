@@ -0,0 +1,92 @@
+import hashlib
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import ClientDisconnect
+
+from messaging import create_message
+from models import UploadSession
+from storage import blob_path
+from upload_sessions import create_session, finalize_session, get_session, session_file_path, write_chunk
+
+CONTENT = b"0123456789"
+
+
+class ChunkRequest:
+    """A chunk upload whose body arrives in pieces; optionally the client drops."""
+
+    def __init__(self, *pieces: bytes, disconnect: bool = False):
+        self.pieces = pieces
+        self.disconnect = disconnect
+
+    async def stream(self):
+        for piece in self.pieces:
+            yield piece
+        if self.disconnect:
+            raise ClientDisconnect()
+
+
+async def put_chunk(session_factory, user, upload_id: str, offset: int, request: ChunkRequest) -> UploadSession:
+    async with session_factory() as db:
+        return await write_chunk(db, await get_session(db, upload_id, user.id), offset, request)
+
+
+def test_upload_resumes_from_the_received_offset(run, session_factory, make_users, upload_dir):
+    async def scenario():
+        alice, bob = await make_users("alice", "bob")
+        async with session_factory() as db:
+            upload_id = (await create_session(db, alice.id, "notes.txt", len(CONTENT), "text/plain")).id
+
+        # The connection drops mid-chunk; what arrived is kept
+        session = await put_chunk(session_factory, alice, upload_id, 0, ChunkRequest(b"01", b"23", disconnect=True))
+        assert session.received_size == 4
+
+        # A retry from the wrong offset learns where to resume
+        with pytest.raises(HTTPException) as error:
+            await put_chunk(session_factory, alice, upload_id, 0, ChunkRequest(CONTENT))
+        assert error.value.status_code == 409
+        assert error.value.headers == {"Upload-Offset": "4"}
+
+        async with session_factory() as db:
+            with pytest.raises(HTTPException) as error:
+                await finalize_session(db, await get_session(db, upload_id, alice.id))
+        assert (error.value.status_code, error.value.headers) == (409, {"Upload-Offset": "4"})
+
+        with pytest.raises(HTTPException) as error:
+            await put_chunk(session_factory, alice, upload_id, 4, ChunkRequest(b"456789", b"X"))
+        assert error.value.status_code == 413
+
+        session = await put_chunk(session_factory, alice, upload_id, 4, ChunkRequest(b"4567", b"89"))
+        assert session.received_size == len(CONTENT)
+        with open(session_file_path(upload_id), "rb") as file:
+            assert file.read() == CONTENT
+
+        async with session_factory() as db:
+            attachment = await finalize_session(db, await get_session(db, upload_id, alice.id))
+        assert attachment.sha256 == hashlib.sha256(CONTENT).hexdigest()
+        with open(blob_path(attachment.sha256), "rb") as file:
+            assert file.read() == CONTENT
+        async with session_factory() as db:
+            assert await db.get(UploadSession, upload_id) is None
+
+        # Only the uploader can send the finished attachment
+        async with session_factory() as db:
+            with pytest.raises(HTTPException):
+                await create_message(db, bob.id, alice, "not mine", attachment_ids=[attachment.id])
+        async with session_factory() as db:
+            message, _ = await create_message(db, alice.id, bob, "notes", attachment_ids=[attachment.id])
+        assert [sent.original_filename for sent in message.attachments] == ["notes.txt"]
+
+    run(scenario())
+
+
+def test_sessions_belong_to_their_uploader(run, session_factory, make_users, upload_dir):
+    async def scenario():
+        alice, bob = await make_users("alice", "bob")
+        async with session_factory() as db:
+            upload_id = (await create_session(db, alice.id, "notes.txt", len(CONTENT), "text/plain")).id
+        with pytest.raises(HTTPException) as error:
+            await put_chunk(session_factory, bob, upload_id, 0, ChunkRequest(CONTENT))
+        assert error.value.status_code == 404
+
+    run(scenario())
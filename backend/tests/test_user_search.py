@@ -0,0 +1,52 @@
+from fastapi import Response
+from sqlalchemy import update
+
+from models import User
+from routes.users import search_users
+from serialization import loads
+
+
+async def search(session_factory, user, query: str, limit: int = 10):
+    """Usernames of every page, following X-Next-Cursor."""
+    pages, cursor = [], None
+    async with session_factory() as db:
+        while True:
+            response = Response()
+            page = await search_users(response, query=query, limit=limit, cursor=cursor, current_user=user, db=db)
+            pages.append([found["username"] for found in loads(page.body)])
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                return pages
+
+
+def test_matches_rank_exact_then_prefix_then_substring(run, session_factory, make_users):
+    async def scenario():
+        searcher, *_ = await make_users("searcher_ann", "joanne", "Annabel", "hannah", "ann", "Anna", "annie", "bob")
+        async with session_factory() as db:
+            await db.execute(update(User).where(User.username == "annie").values(is_active=False))
+            await db.commit()
+
+        assert await search(session_factory, searcher, "ANN") == [["ann", "Anna", "Annabel", "hannah", "joanne"]]
+        # Pages continue across tiers without repeats
+        assert await search(session_factory, searcher, "ann", limit=2) == \
+            [["ann", "Anna"], ["Annabel", "hannah"], ["joanne"]]
+        # Too short for the trigram index: exact and prefix matches only
+        assert await search(session_factory, searcher, "an") == [["ann", "Anna", "Annabel"]]
+        # LIKE wildcards in the query match literally
+        assert await search(session_factory, searcher, "a_n") == [[]]
+        assert await search(session_factory, searcher, "%") == [[]]
+
+    run(scenario())
+
+
+def test_renamed_users_are_found_by_their_new_name(run, session_factory, make_users):
+    async def scenario():
+        searcher, bob = await make_users("searcher", "bob")
+        async with session_factory() as db:
+            user = await db.get(User, bob.id)
+            user.username = "robert"
+            await db.commit()
+        assert await search(session_factory, searcher, "bert") == [["robert"]]
+        assert await search(session_factory, searcher, "bob") == [[]]
+
+    run(scenario())
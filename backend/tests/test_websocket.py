@@ -0,0 +1,157 @@
+import asyncio
+
+import pytest
+from fastapi import WebSocketDisconnect
+from sqlalchemy import event, func, select
+
+import database
+import messaging
+import routes.websocket
+from auth import create_access_token
+from delivery_bus import InProcessBus
+from models import Message
+from routes.websocket import websocket_endpoint
+from serialization import dumps, loads
+from websocket_manager import ConnectionManager
+
+
+class ScriptedWebSocket:
+    """Feeds the endpoint client frames, then disconnects; keeps what it sent."""
+
+    def __init__(self, frames, on_receive=None):
+        self.frames = list(frames)
+        self.on_receive = on_receive
+        self.sent = []
+        self.closed_with = None
+
+    async def accept(self):
+        pass
+
+    async def receive_text(self) -> str:
+        # Let queued frames reach the socket first
+        await asyncio.sleep(0.05)
+        if self.on_receive is not None:
+            self.on_receive()
+        if not self.frames:
+            raise WebSocketDisconnect()
+        return dumps(self.frames.pop(0))
+
+    async def send_text(self, text: str):
+        self.sent.append(loads(text))
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        self.closed_with = (code, reason)
+
+    def of_type(self, frame_type: str) -> list:
+        return [frame for frame in self.sent if frame.get("type") == frame_type]
+
+
+@pytest.fixture
+def manager(run, session_factory, monkeypatch):
+    """The /ws endpoint on its own connection manager and the test database."""
+    manager = ConnectionManager(bus=InProcessBus())
+    monkeypatch.setattr(routes.websocket, "manager", manager)
+    monkeypatch.setattr(routes.websocket, "SessionLocal", session_factory)
+    monkeypatch.setattr(database, "SessionLocal", session_factory)
+    run(manager.start())
+    yield manager
+    run(manager.stop())
+
+
+@pytest.fixture
+def checked_out(engine):
+    """Number of connections currently checked out of the engine's pool."""
+    connections = set()
+    listeners = {
+        "checkout": lambda dbapi_connection, record, proxy: connections.add(record),
+        "checkin": lambda dbapi_connection, record: connections.discard(record),
+    }
+    for name, listener in listeners.items():
+        event.listen(engine.sync_engine, name, listener)
+    yield lambda: len(connections)
+    for name, listener in listeners.items():
+        event.remove(engine.sync_engine, name, listener)
+
+
+def test_open_socket_holds_no_database_connection(run, make_users, manager, checked_out):
+    async def scenario():
+        alice, bob = await make_users("alice", "bob")
+        counts = []
+        websocket = ScriptedWebSocket([
+            {"type": "ping", "timestamp": 1},
+            {"type": "send_message", "client_id": "c1", "recipient_id": bob.id, "content": "hi"},
+            {"type": "resume", "since": 0},
+        ], on_receive=lambda: counts.append(checked_out()))
+
+        await websocket_endpoint(websocket, token=create_access_token({"sub": "alice"}))
+
+        # Between frames, authentication and handlers have returned their connections
+        assert counts == [0, 0, 0, 0]
+        assert websocket.closed_with is None
+        assert [frame["type"] for frame in websocket.sent if frame["type"] != "connection_status"] == \
+            ["pong", "ack", "sync"]
+        assert not manager.is_user_online(alice.id)
+
+    run(scenario())
+
+
+async def send_over_socket(manager, user, frames) -> ScriptedWebSocket:
+    websocket = ScriptedWebSocket(frames)
+    await websocket_endpoint(websocket, token=create_access_token({"sub": user.username}))
+    return websocket
+
+
+async def message_count(session_factory) -> int:
+    async with session_factory() as db:
+        return await db.scalar(select(func.count(Message.id)))
+
+
+def test_resent_client_id_is_acked_as_duplicate(run, session_factory, make_users, manager):
+    async def scenario():
+        alice, bob = await make_users("alice", "bob")
+        recipient = ScriptedWebSocket([])
+        await manager.connect(recipient, bob)
+        frame = {"type": "send_message", "client_id": "c1", "recipient_id": bob.id, "content": "hi"}
+
+        websocket = await send_over_socket(manager, alice, [frame, frame])
+        first, second = websocket.of_type("ack")
+        assert (first["client_id"], first["duplicate"], second["duplicate"]) == ("c1", False, True)
+        assert first["message_id"] == second["message_id"] == second["message"]["id"]
+        assert await message_count(session_factory) == 1
+        # The recipient hears of the message once
+        await asyncio.sleep(0.05)
+        assert [event["message"]["id"] for event in recipient.of_type("new_message")] == [first["message_id"]]
+
+        rejected = await send_over_socket(manager, alice, [
+            {"type": "send_message", "recipient_id": bob.id, "content": "no key"},
+            {"type": "send_message", "client_id": "c2", "recipient_id": 999, "content": "nobody"},
+        ])
+        assert [frame["detail"] for frame in rejected.of_type("send_error")] == \
+            ["client_id is required", "Recipient not found"]
+        assert await message_count(session_factory) == 1
+        manager.disconnect(recipient)
+
+    run(scenario())
+
+
+def test_concurrent_send_losing_the_insert_acks_the_winner(run, session_factory, make_users, manager, monkeypatch):
+    async def scenario():
+        alice, bob = await make_users("alice", "bob")
+        frame = {"type": "send_message", "client_id": "c1", "recipient_id": bob.id, "content": "hi"}
+        winner = (await send_over_socket(manager, alice, [frame])).of_type("ack")[0]
+
+        # The other attempt checked for the key before the winner committed
+        lookup = messaging.get_message_by_client_id
+        calls = []
+
+        async def racing_lookup(db, sender_id, client_id):
+            calls.append(client_id)
+            return None if len(calls) == 1 else await lookup(db, sender_id, client_id)
+
+        monkeypatch.setattr(messaging, "get_message_by_client_id", racing_lookup)
+        ack, = (await send_over_socket(manager, alice, [frame])).of_type("ack")
+        assert calls == ["c1", "c1"]
+        assert (ack["duplicate"], ack["message_id"]) == (True, winner["message_id"])
+        assert await message_count(session_factory) == 1
+
+    run(scenario())
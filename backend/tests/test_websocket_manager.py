@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+import websocket_manager
+from delivery_bus import InProcessBus
+from models import User
+from websocket_manager import ConnectionManager
+
+
+class FakeWebSocket:
+    """Records frames; send_text fails or hangs when told to."""
+
+    def __init__(self, fail: bool = False, hang: bool = False):
+        self.fail = fail
+        self.hang = hang
+        self.sent = []
+        self.closed_with = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        if self.fail:
+            raise RuntimeError("connection reset")
+        if self.hang:
+            await asyncio.Event().wait()
+        self.sent.append(text)
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        self.closed_with = (code, reason)
+
+
+@pytest.mark.parametrize("failure", ["fail", "hang"])
+def test_failed_send_closes_and_unregisters_the_socket(run, monkeypatch, failure):
+    monkeypatch.setattr(websocket_manager, "WS_SEND_TIMEOUT", 0.05)
+
+    async def scenario():
+        manager = ConnectionManager(bus=InProcessBus())
+        user = User(id=1, username="alice")
+        websocket = FakeWebSocket(**{failure: True})
+        # The connection status frame is the first send
+        await manager.connect(websocket, user)
+        for _ in range(20):
+            if websocket.closed_with is not None:
+                break
+            await asyncio.sleep(0.05)
+
+        assert websocket.closed_with == (1011, "Send failed")
+        assert websocket not in manager.connections
+        assert not manager.is_user_online(user.id)
+        assert manager.metrics.send_errors == 1
+        # Frames for the user are no longer queued anywhere
+        await manager.send_to_user({"type": "ping"}, user.id)
+        assert websocket.sent == []
+        await manager.presence.stop()
+
+    run(scenario())
+
+
+async def slow_connection(policy: str, queue_size: int = 2):
+    """A connection whose writer is stuck sending the connection status frame."""
+    manager = ConnectionManager(queue_size=queue_size, policy=policy, bus=InProcessBus())
+    websocket = FakeWebSocket(hang=True)
+    await manager.connect(websocket, User(id=1, username="alice"))
+    await asyncio.sleep(0.01)
+    return manager, websocket, manager.connections[websocket]
+
+
+def queued(connection) -> list:
+    return [text for _, text in connection.queue]
+
+
+async def close(manager, websocket):
+    manager.disconnect(websocket)
+    await asyncio.sleep(0.01)
+    await manager.presence.stop()
+
+
+def test_drop_policy_discards_the_oldest_frames(run):
+    async def scenario():
+        manager, websocket, connection = await slow_connection("drop")
+        for text in ("a", "b", "c"):
+            manager.send_encoded(text, 1)
+        assert queued(connection) == ["b", "c"]
+        assert manager.metrics.frames_dropped == 1
+        await close(manager, websocket)
+
+    run(scenario())
+
+
+def test_coalesce_policy_replaces_queued_frames_with_the_same_key(run):
+    async def scenario():
+        manager, websocket, connection = await slow_connection("coalesce")
+        manager.send_encoded("typing on", 1, coalesce_key="typing:2")
+        manager.send_encoded("message", 1)
+        manager.send_encoded("typing off", 1, coalesce_key="typing:2")
+        assert queued(connection) == ["typing off", "message"]
+        assert manager.metrics.frames_coalesced == 1
+
+        # Unkeyed frames still fall back to dropping the oldest; the key is freed
+        manager.send_encoded("another message", 1)
+        assert queued(connection) == ["message", "another message"]
+        manager.send_encoded("typing on", 1, coalesce_key="typing:2")
+        assert queued(connection) == ["another message", "typing on"]
+        assert manager.metrics.frames_dropped == 2
+        await close(manager, websocket)
+
+    run(scenario())
+
+
+def test_disconnect_policy_closes_slow_consumers(run):
+    async def scenario():
+        manager, websocket, _ = await slow_connection("disconnect")
+        for text in ("a", "b", "c"):
+            manager.send_encoded(text, 1)
+        await asyncio.sleep(0.01)
+        assert websocket.closed_with == (1008, "Slow consumer")
+        assert not manager.is_user_online(1)
+        assert manager.metrics.slow_disconnects == 1
+        await manager.presence.stop()
+
+    run(scenario())
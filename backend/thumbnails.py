@@ -0,0 +1,228 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional, Set, Tuple
+from decouple import config
+from sqlalchemy import select, update
+from database import SessionLocal
+from models import MessageAttachment
+from storage import thumbnail_path
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = config("THUMBNAIL_SIZE", default=320, cast=int)  # bounding box, pixels
+THUMBNAIL_WORKERS = config("THUMBNAIL_WORKERS", default=2, cast=int)
+THUMBNAIL_QUEUE_SIZE = config("THUMBNAIL_QUEUE_SIZE", default=1000, cast=int)
+THUMBNAIL_SWEEP_INTERVAL = config("THUMBNAIL_SWEEP_INTERVAL", default=30.0, cast=float)
+THUMBNAIL_MAX_PIXELS = config("THUMBNAIL_MAX_PIXELS", default=50_000_000, cast=int)
+# How long a missing source file is waited for before giving up; the sweep
+# of crashed uploads (ORPHAN_UPLOAD_GRACE) may still put it in place
+THUMBNAIL_MISSING_SOURCE_GRACE = config("THUMBNAIL_MISSING_SOURCE_GRACE", default=7200.0, cast=float)  # seconds
+
+# MessageAttachment.thumbnail_status values
+THUMBNAIL_PENDING = "pending"
+THUMBNAIL_READY = "ready"
+THUMBNAIL_FAILED = "failed"
+
+# Formats Pillow decodes; SVG and friends are left without thumbnails
+THUMBNAIL_CONTENT_TYPES = {"image/jpeg", "image/png", "image/gif", "image/webp", "image/bmp"}
+
+
+def wants_thumbnail(content_type: Optional[str], sha256: Optional[str]) -> bool:
+    """Whether an attachment gets a thumbnail (content-addressed images only)."""
+    return sha256 is not None and content_type in THUMBNAIL_CONTENT_TYPES
+
+
+def render_thumbnail(source: str, target: str, size: int) -> Tuple[int, int]:
+    """Write a WebP thumbnail of source fitting in size x size; returns its dimensions.
+
+    Blocking; runs on the generator's thread pool. Thumbnails are shared by
+    identical blobs, so an existing one is reused.
+    """
+    from PIL import Image, ImageOps
+
+    if os.path.exists(target):
+        with Image.open(target) as existing:
+            return existing.size
+
+    Image.MAX_IMAGE_PIXELS = THUMBNAIL_MAX_PIXELS
+    with Image.open(source) as image:
+        # Let JPEG decode at a reduced scale instead of full resolution
+        image.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if image.mode in ("P", "LA", "PA") else "RGB")
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temp_target = f"{target}.{uuid.uuid4().hex}.tmp"
+        try:
+            image.save(temp_target, "WEBP", quality=80)
+            os.replace(temp_target, target)
+        finally:
+            if os.path.exists(temp_target):
+                os.remove(temp_target)
+        return image.size
+
+
+class ThumbnailGenerator:
+    """Generates attachment thumbnails in the background.
+
+    The backlog lives in the database (thumbnail_status = pending), so it
+    survives restarts: new uploads are queued directly and a periodic sweep
+    picks up whatever is still pending, including work left over from a
+    previous run or dropped because the queue was full. At most `workers`
+    images are decoded at a time.
+    """
+
+    def __init__(self, workers: int, queue_size: int, sweep_interval: float, missing_source_grace: float):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.sweep_interval = sweep_interval
+        self.missing_source_grace = missing_source_grace
+        self._queue: Optional[asyncio.Queue] = None
+        # Attachment ids queued or being processed
+        self._queued: Set[int] = set()
+        self._tasks = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # Attachment id -> when its source file was first found missing
+        self._missing_since: Dict[int, float] = {}
+        self.generated = 0
+        self.failed = 0
+        self.retried = 0
+
+    def enqueue(self, attachment_ids: Iterable[int]):
+        """Queue pending attachments; overflow is left for the next sweep."""
+        if self._queue is None:
+            return
+        for attachment_id in attachment_ids:
+            if attachment_id in self._queued:
+                continue
+            try:
+                self._queue.put_nowait(attachment_id)
+            except asyncio.QueueFull:
+                return
+            self._queued.add(attachment_id)
+
+    async def start(self):
+        """Start the sweep and worker tasks."""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="thumbnail")
+        self._tasks = [asyncio.create_task(self._sweep())]
+        self._tasks += [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Stop processing; unfinished work stays pending in the database."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        self._queued.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _sweep(self):
+        while True:
+            try:
+                if self._queue.empty():
+                    async with SessionLocal() as db:
+                        pending = (await db.execute(
+                            select(MessageAttachment.id)
+                            .where(MessageAttachment.thumbnail_status == THUMBNAIL_PENDING)
+                            .order_by(MessageAttachment.id)
+                            .limit(self.queue_size)
+                        )).scalars().all()
+                    self.enqueue(pending)
+            except Exception as e:
+                logger.error(f"Thumbnail backlog sweep failed: {e}")
+            await asyncio.sleep(self.sweep_interval)
+
+    async def _work(self):
+        while True:
+            attachment_id = await self._queue.get()
+            try:
+                await self.process(attachment_id)
+            except Exception as e:
+                logger.error(f"Thumbnail job for attachment {attachment_id} failed: {e}")
+            finally:
+                self._queued.discard(attachment_id)
+                self._queue.task_done()
+
+    async def process(self, attachment_id: int):
+        """Render and record the thumbnail of one attachment.
+
+        A source file that doesn't exist yet (the row commits before
+        publish_uploads moves the file into place) leaves the attachment
+        pending for the next sweep; only images that fail to decode, or a
+        source still missing after missing_source_grace, are marked failed.
+        """
+        # Don't hold a pooled connection while the image is decoded
+        async with SessionLocal() as db:
+            attachment = await db.get(MessageAttachment, attachment_id)
+        if attachment is None or attachment.thumbnail_status != THUMBNAIL_PENDING:
+            self._missing_since.pop(attachment_id, None)
+            return
+
+        target = thumbnail_path(attachment.sha256, THUMBNAIL_SIZE)
+        loop = asyncio.get_running_loop()
+        try:
+            width, height = await loop.run_in_executor(
+                self._executor, render_thumbnail, attachment.file_path, target, THUMBNAIL_SIZE
+            )
+        except FileNotFoundError:
+            missing_since = self._missing_since.setdefault(attachment_id, time.monotonic())
+            if time.monotonic() - missing_since < self.missing_source_grace:
+                self.retried += 1
+                return
+            logger.warning(f"Cannot thumbnail attachment {attachment_id}: source file missing")
+            values = {"thumbnail_status": THUMBNAIL_FAILED}
+            self.failed += 1
+        except Exception as e:
+            # Undecodable image; don't retry forever
+            logger.warning(f"Cannot thumbnail attachment {attachment_id}: {e}")
+            values = {"thumbnail_status": THUMBNAIL_FAILED}
+            self.failed += 1
+        else:
+            values = {
+                "thumbnail_status": THUMBNAIL_READY,
+                "thumbnail_path": target,
+                "thumbnail_width": width,
+                "thumbnail_height": height,
+            }
+            self.generated += 1
+        self._missing_since.pop(attachment_id, None)
+
+        async with SessionLocal() as db:
+            await db.execute(
+                update(MessageAttachment)
+                .where(
+                    MessageAttachment.id == attachment_id,
+                    MessageAttachment.thumbnail_status == THUMBNAIL_PENDING
+                )
+                .values(**values)
+            )
+            await db.commit()
+
+    def stats(self) -> dict:
+        """Queue depth and job counters."""
+        return {
+            "workers": self.workers,
+            "queued": len(self._queued),
+            "generated": self.generated,
+            "failed": self.failed,
+            "retried": self.retried,
+            "waiting_for_source": len(self._missing_since),
+        }
+
+
+# Global thumbnail generator instance
+thumbnails = ThumbnailGenerator(
+    THUMBNAIL_WORKERS, THUMBNAIL_QUEUE_SIZE, THUMBNAIL_SWEEP_INTERVAL, THUMBNAIL_MISSING_SOURCE_GRACE
+)
@@ -0,0 +1,137 @@
+import asyncio
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+from decouple import config
+from serialization import dumps
+
+if TYPE_CHECKING:
+    from websocket_manager import ConnectionManager
+
+# At most one typing update per (sender, recipient) per interval
+TYPING_MIN_INTERVAL = config("TYPING_MIN_INTERVAL", default=1.0, cast=float)  # seconds
+# Typing without a refresh for this long is forwarded as stopped
+TYPING_TIMEOUT = config("TYPING_TIMEOUT", default=8.0, cast=float)  # seconds
+
+
+class TypingState:
+    def __init__(self):
+        # Last state forwarded to the recipient
+        self.forwarded = False
+        self.forwarded_at = float("-inf")
+        # State to forward once the interval allows it
+        self.pending: Optional[bool] = None
+        self.flush_timer: Optional[asyncio.TimerHandle] = None
+        self.expiry_timer: Optional[asyncio.TimerHandle] = None
+
+
+class TypingThrottle:
+    """Tracks typing state per (sender, recipient) and forwards only changes.
+
+    Duplicate states are dropped, changes are forwarded at most once per
+    min_interval (the latest state wins), and typing that isn't refreshed
+    within timeout is forwarded as stopped.
+    """
+
+    def __init__(self, manager: "ConnectionManager",
+                 min_interval: float = TYPING_MIN_INTERVAL,
+                 timeout: float = TYPING_TIMEOUT):
+        self.manager = manager
+        self.min_interval = min_interval
+        self.timeout = timeout
+        self.states: Dict[Tuple[int, int], TypingState] = {}
+        self.updates_received = 0
+        self.updates_forwarded = 0
+        self.expired = 0
+
+    def update(self, sender_id: int, recipient_id: int, is_typing: bool):
+        """Record a typing event from the sender's client."""
+        self.updates_received += 1
+        key = (sender_id, recipient_id)
+        state = self.states.get(key)
+        if state is None:
+            if not is_typing:
+                return
+            state = self.states[key] = TypingState()
+
+        loop = asyncio.get_running_loop()
+        if state.expiry_timer is not None:
+            state.expiry_timer.cancel()
+            state.expiry_timer = None
+        if is_typing:
+            state.expiry_timer = loop.call_later(self.timeout, self._expire, key)
+
+        if is_typing == state.forwarded:
+            # Unchanged, or flipped back before the pending change went out
+            state.pending = None
+        elif loop.time() - state.forwarded_at >= self.min_interval:
+            self._forward(key, state, is_typing)
+        else:
+            state.pending = is_typing
+            if state.flush_timer is None:
+                state.flush_timer = loop.call_at(
+                    state.forwarded_at + self.min_interval, self._flush, key
+                )
+        self._forget_if_idle(key, state)
+
+    def clear(self, sender_id: int):
+        """Stop all typing of a sender, e.g. when their last socket closes."""
+        for key in [key for key in self.states if key[0] == sender_id]:
+            state = self.states[key]
+            if state.expiry_timer is not None:
+                state.expiry_timer.cancel()
+            self._expire(key)
+
+    def _flush(self, key: Tuple[int, int]):
+        state = self.states.get(key)
+        if state is None:
+            return
+        state.flush_timer = None
+        if state.pending is not None and state.pending != state.forwarded:
+            self._forward(key, state, state.pending)
+        state.pending = None
+        self._forget_if_idle(key, state)
+
+    def _expire(self, key: Tuple[int, int]):
+        state = self.states.get(key)
+        if state is None:
+            return
+        state.expiry_timer = None
+        if state.flush_timer is not None:
+            state.flush_timer.cancel()
+            state.flush_timer = None
+        state.pending = None
+        if state.forwarded:
+            self.expired += 1
+            # Stopping is never throttled
+            self._forward(key, state, False)
+        self._forget_if_idle(key, state)
+
+    def _forward(self, key: Tuple[int, int], state: TypingState, is_typing: bool):
+        sender_id, recipient_id = key
+        state.forwarded = is_typing
+        state.forwarded_at = asyncio.get_running_loop().time()
+        state.pending = None
+        self.updates_forwarded += 1
+        if self.manager.is_user_online(recipient_id):
+            self.manager.deliver(dumps({
+                "type": "typing",
+                "sender_id": sender_id,
+                "is_typing": is_typing
+            }), recipient_id, coalesce_key=f"typing:{sender_id}")
+
+    def _forget_if_idle(self, key: Tuple[int, int], state: TypingState):
+        # Keep stopped states until their interval passes so restarts stay throttled
+        if state.forwarded or state.pending is not None or state.flush_timer is not None:
+            return
+        remaining = state.forwarded_at + self.min_interval - asyncio.get_running_loop().time()
+        if remaining > 0:
+            state.flush_timer = asyncio.get_running_loop().call_later(remaining, self._flush, key)
+        else:
+            del self.states[key]
+
+    def stats(self) -> dict:
+        return {
+            "active": len(self.states),
+            "updates_received": self.updates_received,
+            "updates_forwarded": self.updates_forwarded,
+            "expired": self.expired,
+        }
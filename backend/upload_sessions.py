@@ -0,0 +1,335 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Set
+import aiofiles
+import aiofiles.os
+from decouple import config
+from fastapi import HTTPException, Request, status
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.requests import ClientDisconnect
+from database import SessionLocal
+from models import Blob, MessageAttachment, UploadSession
+from storage import (
+    TMP_DIR,
+    UPLOAD_CHUNK_SIZE,
+    StoredFile,
+    blob_path,
+    too_large,
+    add_blob_references,
+    publish_uploads,
+    release_blob_references,
+    collect_blobs,
+    remove_files
+)
+from thumbnails import thumbnails, wants_thumbnail, THUMBNAIL_PENDING
+
+logger = logging.getLogger(__name__)
+
+# Resumable uploads bypass the per-message cap, so they have their own
+MAX_RESUMABLE_UPLOAD_SIZE = config("MAX_RESUMABLE_UPLOAD_SIZE", default=4 * 1024 * 1024 * 1024, cast=int)
+MAX_UPLOAD_CHUNK_SIZE = config("MAX_UPLOAD_CHUNK_SIZE", default=64 * 1024 * 1024, cast=int)
+# Idle sessions, and finalized uploads never sent, are removed after this
+UPLOAD_SESSION_TTL = config("UPLOAD_SESSION_TTL", default=24 * 3600, cast=int)  # seconds
+UPLOAD_CLEANUP_INTERVAL = config("UPLOAD_CLEANUP_INTERVAL", default=600.0, cast=float)
+# Temporary files untouched this long, outside live sessions, were left by a crash
+ORPHAN_UPLOAD_GRACE = config("ORPHAN_UPLOAD_GRACE", default=3600, cast=int)  # seconds
+
+# Sessions with a chunk or finalize request in flight in this process
+_busy_sessions: Set[str] = set()
+
+
+def session_file_path(session_id: str) -> str:
+    return os.path.join(TMP_DIR, f"session-{session_id}")
+
+
+def session_expiry() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(seconds=UPLOAD_SESSION_TTL)
+
+
+async def create_session(db: AsyncSession, user_id: int, filename: str,
+                         size: int, content_type: Optional[str]) -> UploadSession:
+    """Start a resumable upload of a file of known size."""
+    if size > MAX_RESUMABLE_UPLOAD_SIZE:
+        raise too_large(f"Upload exceeds {MAX_RESUMABLE_UPLOAD_SIZE} bytes")
+
+    session = UploadSession(
+        id=uuid.uuid4().hex,
+        user_id=user_id,
+        filename=filename,
+        content_type=content_type,
+        total_size=size,
+        received_size=0,
+        expires_at=session_expiry()
+    )
+    async with aiofiles.open(session_file_path(session.id), "wb"):
+        pass
+    db.add(session)
+    await db.commit()
+    return session
+
+
+async def get_session(db: AsyncSession, session_id: str, user_id: int) -> UploadSession:
+    """Load a live session owned by the user; 404 otherwise."""
+    session = await db.get(UploadSession, session_id)
+    if session is None or session.user_id != user_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Upload session not found"
+        )
+    return session
+
+
+def _claim(session_id: str):
+    if session_id in _busy_sessions:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Another request for this upload is in progress"
+        )
+    _busy_sessions.add(session_id)
+
+
+def _offset_mismatch(session: UploadSession) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail=f"Upload offset is {session.received_size}",
+        headers={"Upload-Offset": str(session.received_size)}
+    )
+
+
+async def write_chunk(db: AsyncSession, session: UploadSession, offset: int, request: Request) -> UploadSession:
+    """Append the request body at offset and record the new offset.
+
+    The offset must equal what the server has received; clients resume by
+    asking for the current offset. Bytes that arrive before a client drops
+    are kept, so a retry only resends what is missing.
+    """
+    if offset != session.received_size:
+        raise _offset_mismatch(session)
+
+    _claim(session.id)
+    try:
+        # Don't hold a pooled connection while the body streams in
+        await db.commit()
+
+        written = 0
+        disconnected = False
+        async with aiofiles.open(session_file_path(session.id), "r+b") as file:
+            # Drop bytes a failed earlier request wrote past the recorded offset
+            await file.seek(offset)
+            await file.truncate()
+            try:
+                async for chunk in request.stream():
+                    written += len(chunk)
+                    if written > MAX_UPLOAD_CHUNK_SIZE:
+                        raise too_large(f"Chunk exceeds {MAX_UPLOAD_CHUNK_SIZE} bytes")
+                    if offset + written > session.total_size:
+                        raise too_large("Chunk runs past the declared upload size")
+                    await file.write(chunk)
+            except ClientDisconnect:
+                disconnected = True
+
+        received_size = offset + written
+        result = await db.execute(
+            update(UploadSession)
+            .where(UploadSession.id == session.id, UploadSession.received_size == offset)
+            .values(received_size=received_size, expires_at=session_expiry())
+        )
+        await db.commit()
+        if result.rowcount == 0:
+            # Another process moved the offset, or the session expired meanwhile
+            current = await get_session(db, session.id, session.user_id)
+            await db.refresh(current)
+            raise _offset_mismatch(current)
+        session.received_size = received_size
+        if disconnected:
+            logger.info(f"Upload {session.id} interrupted at {received_size} bytes")
+        return session
+    finally:
+        _busy_sessions.discard(session.id)
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def finalize_session(db: AsyncSession, session: UploadSession) -> MessageAttachment:
+    """Turn a complete session into an unsent attachment of its owner.
+
+    The attachment, its blob reference and the session's removal commit
+    together; the file then moves into the blob store. The attachment is
+    attached to a message by passing its id when sending.
+    """
+    if session.received_size != session.total_size:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Upload incomplete: {session.received_size} of {session.total_size} bytes",
+            headers={"Upload-Offset": str(session.received_size)}
+        )
+
+    _claim(session.id)
+    try:
+        await db.commit()
+        # Hashing gigabytes would stall the event loop
+        temp_path = session_file_path(session.id)
+        sha256 = await asyncio.to_thread(_hash_file, temp_path)
+        stored = StoredFile(
+            filename=f"{sha256}{os.path.splitext(session.filename)[1]}",
+            original_filename=session.filename,
+            temp_path=temp_path,
+            file_size=session.total_size,
+            content_type=session.content_type,
+            sha256=sha256
+        )
+        attachment = MessageAttachment(
+            uploaded_by_id=session.user_id,
+            filename=stored.filename,
+            original_filename=stored.original_filename,
+            file_path=stored.file_path,
+            file_size=stored.file_size,
+            content_type=stored.content_type,
+            sha256=stored.sha256,
+            thumbnail_status=THUMBNAIL_PENDING if wants_thumbnail(stored.content_type, stored.sha256) else None
+        )
+        removed = await db.execute(delete(UploadSession).where(UploadSession.id == session.id))
+        if removed.rowcount == 0:
+            # Expired while hashing; its file is being removed
+            await db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Upload session not found"
+            )
+        db.add(attachment)
+        await add_blob_references(db, [stored])
+        await db.commit()
+
+        await publish_uploads([stored])
+        if attachment.thumbnail_status == THUMBNAIL_PENDING:
+            thumbnails.enqueue([attachment.id])
+        return attachment
+    finally:
+        _busy_sessions.discard(session.id)
+
+
+async def cancel_session(db: AsyncSession, session: UploadSession):
+    """Abort an upload and delete its data."""
+    _claim(session.id)
+    try:
+        await db.delete(session)
+        await db.commit()
+        await remove_files([session_file_path(session.id)])
+    finally:
+        _busy_sessions.discard(session.id)
+
+
+async def expire_uploads(db: AsyncSession) -> dict:
+    """Delete idle sessions and finalized uploads that were never sent."""
+    now = datetime.now(timezone.utc)
+
+    expired_sessions = (await db.execute(
+        delete(UploadSession)
+        .where(UploadSession.expires_at < now)
+        .returning(UploadSession.id)
+    )).scalars().all()
+    await db.commit()
+    await remove_files([session_file_path(session_id) for session_id in expired_sessions])
+
+    orphans = (await db.execute(
+        delete(MessageAttachment)
+        .where(
+            MessageAttachment.message_id.is_(None),
+            MessageAttachment.uploaded_at < now - timedelta(seconds=UPLOAD_SESSION_TTL)
+        )
+        .returning(MessageAttachment.sha256)
+    )).scalars().all()
+    await release_blob_references(db, [sha256 for sha256 in orphans if sha256])
+    await db.commit()
+    freed = await collect_blobs(db, [sha256 for sha256 in orphans if sha256])
+
+    swept = await sweep_temp_files(db)
+    return {"sessions": len(expired_sessions), "attachments": len(orphans), "bytes_freed": freed, **swept}
+
+
+def _stale_temp_files(cutoff: float) -> List[os.DirEntry]:
+    with os.scandir(TMP_DIR) as entries:
+        return [entry for entry in entries if entry.is_file() and entry.stat().st_mtime < cutoff]
+
+
+async def sweep_temp_files(db: AsyncSession, grace: int = ORPHAN_UPLOAD_GRACE) -> dict:
+    """Recover or delete temporary files a crashed process left behind.
+
+    A process that dies between committing an upload and publish_uploads
+    leaves a referenced blob without its file, and the file in TMP_DIR.
+    Stray files untouched for grace seconds are hashed: one that a
+    referenced blob is missing is moved into place, any other is deleted.
+    Files of live upload sessions are kept.
+    """
+    stale = await asyncio.to_thread(_stale_temp_files, time.time() - grace)
+    if not stale:
+        return {"temp_files_restored": 0, "temp_files_removed": 0}
+    live_sessions = {f"session-{session_id}" for session_id in (await db.scalars(select(UploadSession.id))).all()}
+
+    restored = removed = 0
+    for entry in stale:
+        if entry.name in live_sessions:
+            continue
+        sha256 = await asyncio.to_thread(_hash_file, entry.path)
+        referenced = await db.scalar(select(Blob.ref_count).where(Blob.sha256 == sha256))
+        target = blob_path(sha256)
+        if referenced and not await aiofiles.os.path.exists(target):
+            await aiofiles.os.makedirs(os.path.dirname(target), exist_ok=True)
+            await aiofiles.os.replace(entry.path, target)
+            logger.warning(f"Restored blob {sha256} from an unpublished upload")
+            restored += 1
+        else:
+            await remove_files([entry.path])
+            removed += 1
+    await db.commit()
+    return {"temp_files_restored": restored, "temp_files_removed": removed}
+
+
+class UploadJanitor:
+    """Periodically expires stale upload sessions and unsent uploads."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Start periodic cleanup."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop periodic cleanup."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                async with SessionLocal() as db:
+                    expired = await expire_uploads(db)
+                if any(expired.values()):
+                    logger.info(f"Expired uploads: {expired}")
+            except Exception as e:
+                logger.error(f"Upload cleanup failed: {e}")
+            await asyncio.sleep(self.interval)
+
+
+# Global upload janitor instance
+upload_janitor = UploadJanitor(UPLOAD_CLEANUP_INTERVAL)
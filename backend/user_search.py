@@ -0,0 +1,99 @@
+from typing import List, Optional, Tuple
+from sqlalchemy import and_, column, func, select, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from models import User, USER_SEARCH_DDL, USER_SEARCH_REINDEX
+
+# Match tiers, in rank order
+EXACT = 0
+PREFIX = 1
+SUBSTRING = 2
+
+# Trigram indexes can't narrow shorter queries, so those only match exactly
+# or by prefix
+MIN_SUBSTRING_LENGTH = 3
+
+# Sorts after any character, bounding a prefix range
+MAX_CHAR = "\U0010ffff"
+
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def username_key(entity, dialect: str):
+    """Lowercased username in the order of the ix_users_username_lower index."""
+    key = func.lower(entity.username)
+    # Bytewise collation so prefix ranges and ordering use the btree
+    return key.collate("C") if dialect == "postgresql" else key
+
+
+def tier_condition(tier: int, term: str, dialect: str):
+    key = username_key(User, dialect)
+    if tier == EXACT:
+        return key == term
+    if tier == PREFIX:
+        return and_(key > term, key < term + MAX_CHAR)
+
+    escaped = escape_like(term)
+    condition = and_(
+        func.lower(User.username).like(f"%{escaped}%", escape="\\"),
+        ~func.lower(User.username).like(f"{escaped}%", escape="\\")
+    )
+    if dialect == "sqlite":
+        # Candidates from the trigram table; the LIKE above confirms them
+        phrase = '"' + term.replace('"', '""') + '"'
+        candidates = text(
+            "SELECT rowid FROM users_search WHERE users_search MATCH :phrase"
+        ).bindparams(phrase=phrase).columns(column("rowid"))
+        condition = and_(User.id.in_(candidates), condition)
+    return condition
+
+
+async def search_users(
+    db: AsyncSession,
+    query: str,
+    limit: int,
+    exclude_user_id: int,
+    cursor: Optional[Tuple[int, int]] = None
+) -> Tuple[List[User], Optional[Tuple[int, int]]]:
+    """Active users matching query, exact matches first, then prefix, then substring.
+
+    Each tier is a separate query driven by its own index and ordered by
+    lowercased username, so a page stops reading as soon as it is full.
+    cursor is the (tier, user_id) of the last user of the previous page;
+    returns the users and the cursor to continue from, if any.
+    """
+    term = query.strip().lower()
+    dialect = db.bind.dialect.name
+    last_tier = SUBSTRING if len(term) >= MIN_SUBSTRING_LENGTH else PREFIX
+    start_tier, anchor_id = cursor if cursor is not None else (EXACT, None)
+    key = username_key(User, dialect)
+
+    users: List[User] = []
+    tier = start_tier
+    for tier in range(start_tier, last_tier + 1):
+        statement = select(User).filter(
+            tier_condition(tier, term, dialect),
+            User.id != exclude_user_id,
+            User.is_active == True
+        )
+        if tier == start_tier and anchor_id is not None:
+            anchor = aliased(User)
+            anchor_key = select(username_key(anchor, dialect)).where(anchor.id == anchor_id).scalar_subquery()
+            statement = statement.filter(tuple_(key, User.id) > tuple_(anchor_key, anchor_id))
+        statement = statement.order_by(key, User.id).limit(limit - len(users))
+        users.extend((await db.scalars(statement)).all())
+        if len(users) == limit:
+            break
+
+    next_cursor = (tier, users[-1].id) if users and len(users) == limit else None
+    return users, next_cursor
+
+
+async def build_search_index(db: AsyncSession):
+    """Create the username search indexes if missing and reindex all users."""
+    dialect = db.bind.dialect.name
+    for statement in USER_SEARCH_DDL.get(dialect, []) + USER_SEARCH_REINDEX.get(dialect, []):
+        await db.execute(text(statement))
+    await db.commit()
@@ -1,18 +1,180 @@
-import json
+import asyncio
 import logging
-from typing import Dict, List, Optional
+from collections import deque
+from typing import Deque, Dict, List, Optional
+from decouple import config
 from fastapi import WebSocket, WebSocketDisconnect
-from sqlalchemy.orm import Session
 from models import User
+from auth import invalidate_user, user_invalidation_listeners
+from delivery_bus import DeliveryBus, create_bus
+from presence import PresenceHub
+from typing_indicators import TypingThrottle
+from serialization import dumps
 
 logger = logging.getLogger(__name__)
 
-class ConnectionManager:
+# Cache names used for invalidations on the delivery bus
+AUTH_USER_CACHE = "auth_user"
+
+# Outbound frames buffered per connection before the slow-consumer policy applies
+WS_SEND_QUEUE_SIZE = config("WS_SEND_QUEUE_SIZE", default=256, cast=int)
+# drop: discard the oldest queued frame; coalesce: replace a queued frame with
+# the same key (e.g. a typing state), else drop the oldest; disconnect: close
+WS_SLOW_CONSUMER_POLICY = config("WS_SLOW_CONSUMER_POLICY", default="coalesce")
+# A single send blocked longer than this closes the connection
+WS_SEND_TIMEOUT = config("WS_SEND_TIMEOUT", default=10.0, cast=float)
+
+SLOW_CONSUMER_POLICIES = ("drop", "coalesce", "disconnect")
+if WS_SLOW_CONSUMER_POLICY not in SLOW_CONSUMER_POLICIES:
+    raise ValueError(f"WS_SLOW_CONSUMER_POLICY must be one of {SLOW_CONSUMER_POLICIES}")
+
+
+class FanoutMetrics:
+    """Counters for outbound WebSocket traffic."""
+
     def __init__(self):
+        self.frames_queued = 0
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.frames_coalesced = 0
+        self.slow_disconnects = 0
+        self.send_errors = 0
+
+
+class Connection:
+    """A WebSocket with a bounded outbound queue drained by its own writer task.
+
+    Producers never await the socket: they enqueue an already encoded frame,
+    so one slow client can't hold up delivery to anyone else.
+    """
+
+    def __init__(self, websocket: WebSocket, user_id: int, manager: "ConnectionManager"):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.manager = manager
+        # [coalesce_key, text] entries, oldest first
+        self.queue: Deque[list] = deque()
+        self.keyed: Dict[str, list] = {}
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._write())
+
+    def enqueue(self, text: str, coalesce_key: Optional[str] = None):
+        """Queue an encoded frame, applying the slow-consumer policy when full."""
+        if self.closed:
+            return
+        metrics = self.manager.metrics
+        policy = self.manager.policy
+
+        if coalesce_key is not None and policy == "coalesce":
+            entry = self.keyed.get(coalesce_key)
+            if entry is not None:
+                # Newer state supersedes the queued one
+                entry[1] = text
+                metrics.frames_coalesced += 1
+                return
+
+        if len(self.queue) >= self.manager.queue_size:
+            if policy == "disconnect":
+                metrics.slow_disconnects += 1
+                logger.warning(f"Disconnecting slow WebSocket consumer (user {self.user_id})")
+                self.abort(code=1008, reason="Slow consumer")
+                return
+            oldest = self.queue.popleft()
+            if oldest[0] is not None and self.keyed.get(oldest[0]) is oldest:
+                del self.keyed[oldest[0]]
+            metrics.frames_dropped += 1
+
+        entry = [coalesce_key, text]
+        self.queue.append(entry)
+        if coalesce_key is not None:
+            self.keyed[coalesce_key] = entry
+        metrics.frames_queued += 1
+        self.ready.set()
+
+    async def _write(self):
+        metrics = self.manager.metrics
+        try:
+            while True:
+                if not self.queue:
+                    self.ready.clear()
+                    await self.ready.wait()
+                    continue
+                coalesce_key, text = entry = self.queue.popleft()
+                if coalesce_key is not None and self.keyed.get(coalesce_key) is entry:
+                    del self.keyed[coalesce_key]
+                await asyncio.wait_for(self.websocket.send_text(text), WS_SEND_TIMEOUT)
+                metrics.frames_sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            metrics.send_errors += 1
+            logger.error(f"Error sending to user {self.user_id}: {e}")
+            # Close the socket too, or a client whose send timed out stays
+            # connected without ever receiving frames again
+            self.abort(code=1011, reason="Send failed")
+
+    def abort(self, code: int = 1000, reason: str = ""):
+        """Stop writing and close the socket without waiting for the queue."""
+        self.manager.disconnect(self.websocket)
+        asyncio.create_task(self._close(code, reason))
+
+    async def _close(self, code: int, reason: str):
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code, reason=reason), WS_SEND_TIMEOUT)
+        except Exception:
+            pass
+
+    def stop(self):
+        self.closed = True
+        self.queue.clear()
+        self.keyed.clear()
+        if self.task is not None and self.task is not asyncio.current_task():
+            self.task.cancel()
+
+
+class ConnectionManager:
+    """Sockets of this process; users on other nodes are reached through the delivery bus."""
+
+    def __init__(self, queue_size: int = WS_SEND_QUEUE_SIZE, policy: str = WS_SLOW_CONSUMER_POLICY,
+                 bus: Optional[DeliveryBus] = None):
         # Store active connections: user_id -> list of websockets
         self.active_connections: Dict[int, List[WebSocket]] = {}
         # Store websocket -> user_id mapping for quick lookup
         self.websocket_users: Dict[WebSocket, int] = {}
+        # Outbound queue and writer of each websocket
+        self.connections: Dict[WebSocket, Connection] = {}
+        self.queue_size = queue_size
+        self.policy = policy
+        self.metrics = FanoutMetrics()
+        self.bus = bus if bus is not None else create_bus()
+        self.presence = PresenceHub(self)
+        self.bus.on_presence = self.presence.status_changed
+        self.typing = TypingThrottle(self)
+
+    async def start(self):
+        """Join the delivery bus so other nodes can reach our users."""
+        await self.bus.start(self.send_encoded)
+        await self.presence.start()
+        # Keep the authenticated-user caches of all workers in step
+        self.bus.on_invalidate = self._invalidated_elsewhere
+        user_invalidation_listeners.append(self._invalidate_user_elsewhere)
+
+    async def stop(self):
+        if self._invalidate_user_elsewhere in user_invalidation_listeners:
+            user_invalidation_listeners.remove(self._invalidate_user_elsewhere)
+        await self.presence.stop()
+        await self.bus.stop()
+
+    def _invalidate_user_elsewhere(self, username: str):
+        self.bus.invalidate(AUTH_USER_CACHE, username)
+
+    def _invalidated_elsewhere(self, cache: str, key: str):
+        if cache == AUTH_USER_CACHE:
+            invalidate_user(key)
 
     async def connect(self, websocket: WebSocket, user: User):
         """Accept websocket connection and associate with user."""
@@ -21,10 +183,16 @@ class ConnectionManager:
         # Add connection to user's connections
         if user.id not in self.active_connections:
             self.active_connections[user.id] = []
+            self.bus.hold(user.id)
         self.active_connections[user.id].append(websocket)
         
         # Store user mapping
         self.websocket_users[websocket] = user.id
+        connection = Connection(websocket, user.id, self)
+        self.connections[websocket] = connection
+        connection.start()
+        if len(self.active_connections[user.id]) == 1:
+            self.presence.status_changed(user.id)
         
         logger.info(f"User {user.username} (ID: {user.id}) connected via WebSocket")
         
@@ -48,60 +216,103 @@ class ConnectionManager:
                 # Clean up empty connection list
                 if not self.active_connections[user_id]:
                     del self.active_connections[user_id]
+                    self.bus.release(user_id)
+                    self.presence.status_changed(user_id)
+                    self.typing.clear(user_id)
             
-            # Remove user mapping
+            # Remove user mapping, presence subscriptions and stop its writer
             del self.websocket_users[websocket]
+            self.presence.drop(websocket)
+            connection = self.connections.pop(websocket, None)
+            if connection is not None:
+                connection.stop()
             
             logger.info(f"User ID {user_id} disconnected from WebSocket")
 
     async def send_personal_message(self, message: dict, websocket: WebSocket):
         """Send message to specific websocket."""
-        try:
-            await websocket.send_text(json.dumps(message))
-        except Exception as e:
-            logger.error(f"Error sending message to websocket: {e}")
-            self.disconnect(websocket)
+        connection = self.connections.get(websocket)
+        if connection is not None:
+            connection.enqueue(dumps(message))
+
+    def send_encoded(self, text: str, user_id: int, coalesce_key: Optional[str] = None):
+        """Queue an encoded frame on all connections of a user."""
+        # Copy: the disconnect policy may remove sockets while iterating
+        for websocket in tuple(self.active_connections.get(user_id, ())):
+            self.connections[websocket].enqueue(text, coalesce_key)
 
-    async def send_to_user(self, message: dict, user_id: int):
-        """Send message to all connections of a specific user."""
+    def deliver(self, text: str, user_id: int, coalesce_key: Optional[str] = None):
+        """Queue an encoded frame for a user's sockets here and on other nodes."""
         if user_id in self.active_connections:
-            disconnected = []
-            for websocket in self.active_connections[user_id][:]:  # Create copy to iterate
-                try:
-                    await websocket.send_text(json.dumps(message))
-                except Exception as e:
-                    logger.error(f"Error sending to user {user_id}: {e}")
-                    disconnected.append(websocket)
-            
-            # Clean up disconnected websockets
-            for ws in disconnected:
-                self.disconnect(ws)
+            self.send_encoded(text, user_id, coalesce_key)
+        self.bus.publish(text, user_id, coalesce_key)
+
+    async def send_to_user(self, message: dict, user_id: int, coalesce_key: Optional[str] = None):
+        """Send message to all connections of a specific user.
+
+        The message is encoded once and queued; delivery happens on each
+        connection's writer task. Frames sharing a coalesce_key may replace
+        each other while queued for a slow client.
+        """
+        if self.is_user_online(user_id):
+            self.deliver(dumps(message), user_id, coalesce_key)
 
     async def broadcast_to_users(self, message: dict, user_ids: List[int]):
-        """Send message to multiple users."""
+        """Send message to multiple users, encoding it once."""
+        text = None
         for user_id in user_ids:
-            await self.send_to_user(message, user_id)
+            if self.is_user_online(user_id):
+                if text is None:
+                    text = dumps(message)
+                self.deliver(text, user_id)
 
     def get_active_users(self) -> List[int]:
-        """Get list of currently connected user IDs."""
-        return list(self.active_connections.keys())
+        """Get list of user IDs connected to any node."""
+        return list(set(self.active_connections).union(self.bus.online_elsewhere()))
 
     def is_user_online(self, user_id: int) -> bool:
-        """Check if user has any active connections."""
-        return user_id in self.active_connections and len(self.active_connections[user_id]) > 0
+        """Check if user has any active connections on any node."""
+        return user_id in self.active_connections or self.bus.is_online_elsewhere(user_id)
+
+    def stats(self) -> dict:
+        """Connection counts, queue depth and outbound frame counters."""
+        depths = [len(connection.queue) for connection in self.connections.values()]
+        return {
+            "connections": len(self.connections),
+            "users": len(self.active_connections),
+            "slow_consumer_policy": self.policy,
+            "queue_size": self.queue_size,
+            "queued_frames": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "frames_queued": self.metrics.frames_queued,
+            "frames_sent": self.metrics.frames_sent,
+            "frames_dropped": self.metrics.frames_dropped,
+            "frames_coalesced": self.metrics.frames_coalesced,
+            "slow_disconnects": self.metrics.slow_disconnects,
+            "send_errors": self.metrics.send_errors,
+            "bus": self.bus.stats(),
+            "presence": self.presence.stats(),
+            "typing": self.typing.stats(),
+        }
 
 # Global connection manager instance
 manager = ConnectionManager()
 
 
-async def get_websocket_user(websocket: WebSocket, token: str, db: Session) -> Optional[User]:
-    """Get user from websocket token."""
+async def get_websocket_user(websocket: WebSocket, token: str) -> Optional[User]:
+    """Get user from websocket token.
+    
+    Uses a short-lived session that is released before the socket is
+    accepted, so connected clients don't hold pool connections.
+    """
     try:
         # Import here to avoid circular imports
         from auth import get_current_user_from_token
-        user = await get_current_user_from_token(token, db)
+        from database import SessionLocal
+        async with SessionLocal() as db:
+            user = await get_current_user_from_token(token, db)
         return user
     except Exception as e:
         logger.error(f"WebSocket authentication failed: {e}")
         await websocket.close(code=1008, reason="Authentication failed")
-        return None
\ No newline at end of file
+        return None
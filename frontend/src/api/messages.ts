@@ -20,12 +20,14 @@ export const sendMessage = async (
   content: string,
   recipientId: number,
   files: File[],
-  token: string
+  token: string,
+  clientId?: string
 ) => {
   const formData = new FormData();
   formData.append("content", content);
   formData.append("recipient_id", recipientId.toString());
   files.forEach((file) => formData.append("files", file));
+  if (clientId) formData.append("client_id", clientId);
 
   const res = await axios.post(`${API_URL}/messages/`, formData, {
     headers: { Authorization: `Bearer ${token}` },
@@ -48,3 +50,35 @@ export const deleteMessage = async (id: number, token: string) => {
   });
   return res.data;
 };
+
+export interface AttachmentLink {
+  url: string;
+  thumbnail_url: string | null;
+  expires_at: string;
+}
+
+// Signed links are shared within a signing window, so cache them until
+// shortly before they expire
+const LINK_EXPIRY_MARGIN_MS = 60_000;
+const attachmentLinks = new Map<string, AttachmentLink>();
+
+export const getAttachmentLink = async (
+  filename: string,
+  token: string
+): Promise<AttachmentLink> => {
+  const cached = attachmentLinks.get(filename);
+  if (cached && Date.parse(cached.expires_at) - Date.now() > LINK_EXPIRY_MARGIN_MS) {
+    return cached;
+  }
+  const res = await axios.get(
+    `${API_URL}/messages/attachments/${encodeURIComponent(filename)}/link`,
+    { headers: { Authorization: `Bearer ${token}` } }
+  );
+  const link: AttachmentLink = {
+    ...res.data,
+    url: `${API_URL}${res.data.url}`,
+    thumbnail_url: res.data.thumbnail_url && `${API_URL}${res.data.thumbnail_url}`,
+  };
+  attachmentLinks.set(filename, link);
+  return link;
+};
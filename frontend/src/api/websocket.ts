@@ -1,19 +1,89 @@
 export class WebSocketManager {
   private ws: WebSocket | null = null;
+  // Users whose presence is pushed to us; resubscribed on every connect
+  private presenceUserIds = new Set<number>();
+  // Messages sent over the socket, waiting for their ack
+  private pendingSends = new Map<string, { resolve: (message: any) => void; reject: (error: Error) => void }>();
+
+  // Highest event seq applied; missed events are replayed from it on reconnect
+  private lastSeq: number | null = null;
+  private token = "";
+  private onMessage: (data: any) => void = () => {};
+  private closedByUser = false;
+  private reconnectDelay = 1000;
+  private reconnectTimer: ReturnType<typeof setTimeout> | null = null;
 
   connect(token: string, onMessage: (data: any) => void) {
-    this.ws = new WebSocket(`ws://localhost:8000/ws?token=${token}`);  // Change this in prod
+    this.token = token;
+    this.onMessage = onMessage;
+    this.closedByUser = false;
+    this.open();
+  }
+
+  private open() {
+    this.ws = new WebSocket(`ws://localhost:8000/ws?token=${this.token}`);  // Change this in prod
 
-    this.ws.onopen = () => console.log("✅ WebSocket connected");
+    this.ws.onopen = () => {
+      console.log("✅ WebSocket connected");
+      this.reconnectDelay = 1000;
+      // Only the events missed while away, or just the current seq on first connect
+      this.send({ type: "resume", since: this.lastSeq });
+      if (this.presenceUserIds.size > 0) {
+        this.send({ type: "presence_subscribe", user_ids: [...this.presenceUserIds] });
+      }
+    };
     this.ws.onmessage = (event) => {
       try {
         const data = JSON.parse(event.data);
-        onMessage(data);
+        if (data.type === "ack" || data.type === "send_error") {
+          const pending = this.pendingSends.get(data.client_id);
+          if (pending) {
+            this.pendingSends.delete(data.client_id);
+            if (data.type === "ack") pending.resolve(data.message);
+            else pending.reject(new Error(data.detail));
+          }
+          return;
+        }
+        if (data.type === "sync") {
+          this.applySync(data);
+          return;
+        }
+        if (typeof data.seq === "number" && this.lastSeq !== null) {
+          if (data.seq > this.lastSeq + 1) {
+            // A frame was lost (e.g. dropped for a slow connection): fetch the gap
+            this.send({ type: "resume", since: this.lastSeq });
+          } else if (data.seq > this.lastSeq) {
+            this.lastSeq = data.seq;
+          }
+        }
+        this.onMessage(data);
       } catch (err) {
         console.error("WebSocket parse error:", err);
       }
     };
-    this.ws.onclose = () => console.log("❌ WebSocket closed");
+    this.ws.onclose = () => {
+      console.log("❌ WebSocket closed");
+      if (this.closedByUser) return;
+      // Jittered backoff so clients don't all reconnect at once after a deploy
+      const delay = this.reconnectDelay * (0.5 + Math.random());
+      this.reconnectDelay = Math.min(this.reconnectDelay * 2, 30000);
+      this.reconnectTimer = setTimeout(() => this.open(), delay);
+    };
+  }
+
+  // Apply replayed events; events are idempotent, so overlap with live frames is harmless
+  private applySync(data: any) {
+    if (data.full_resync) {
+      // The log no longer reaches back to lastSeq: reload from the API
+      this.lastSeq = data.seq;
+      this.onMessage({ type: "full_resync" });
+      return;
+    }
+    data.events.forEach((event: any) => this.onMessage(event));
+    this.lastSeq = Math.max(this.lastSeq ?? 0, data.seq);
+    if (data.has_more) {
+      this.send({ type: "resume", since: this.lastSeq });
+    }
   }
 
   send(data: any) {
@@ -22,7 +92,40 @@ export class WebSocketManager {
     }
   }
 
+  isOpen() {
+    return this.ws !== null && this.ws.readyState === WebSocket.OPEN;
+  }
+
+  // Send a text message and resolve with the stored message once acked.
+  // Resending the same clientId (here or over HTTP) never duplicates it.
+  sendMessage(content: string, recipientId: number, clientId: string, timeoutMs = 10000): Promise<any> {
+    return new Promise((resolve, reject) => {
+      if (!this.isOpen()) {
+        reject(new Error("WebSocket not connected"));
+        return;
+      }
+      const timer = setTimeout(() => {
+        this.pendingSends.delete(clientId);
+        reject(new Error("Message ack timed out"));
+      }, timeoutMs);
+      this.pendingSends.set(clientId, {
+        resolve: (message) => { clearTimeout(timer); resolve(message); },
+        reject: (error) => { clearTimeout(timer); reject(error); },
+      });
+      this.send({ type: "send_message", client_id: clientId, content, recipient_id: recipientId });
+    });
+  }
+
+  subscribePresence(userIds: number[]) {
+    const added = userIds.filter((id) => !this.presenceUserIds.has(id));
+    if (added.length === 0) return;
+    added.forEach((id) => this.presenceUserIds.add(id));
+    this.send({ type: "presence_subscribe", user_ids: added });
+  }
+
   disconnect() {
+    this.closedByUser = true;
+    if (this.reconnectTimer) clearTimeout(this.reconnectTimer);
     if (this.ws) this.ws.close();
   }
 }
@@ -54,6 +54,7 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({
   const [isTyping, setIsTyping] = useState(false);
   const [otherUserTyping, setOtherUserTyping] = useState(false);
   const messagesEndRef = useRef<HTMLDivElement>(null);
+  const typingClearRef = useRef<ReturnType<typeof setTimeout> | null>(null);
 
   useEffect(() => {
     loadMessages();
@@ -83,9 +84,21 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({
   const handleSendMessage = async (content: string, files: File[]) => {
     if (!auth?.token) return;
 
+    // Idempotency key: a retry over HTTP can't create a second copy
+    const clientId = crypto.randomUUID();
     try {
-      const newMessage = await sendMessage(content, selectedUser.id, files, auth.token);
-      setMessages(prev => [...prev, newMessage]);
+      let newMessage;
+      if (files.length === 0 && wsManager?.isOpen()) {
+        try {
+          newMessage = await wsManager.sendMessage(content, selectedUser.id, clientId);
+        } catch (error) {
+          console.warn("WebSocket send failed, retrying over HTTP:", error);
+        }
+      }
+      if (!newMessage) {
+        newMessage = await sendMessage(content, selectedUser.id, files, auth.token, clientId);
+      }
+      setMessages(prev => prev.find(m => m.id === newMessage.id) ? prev : [...prev, newMessage]);
     } catch (error) {
       console.error("Failed to send message:", error);
     }
@@ -165,12 +178,20 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({
           );
           break;
 
+        case "full_resync":
+          // Missed events are no longer available to replay
+          loadMessages();
+          break;
+
         case "typing":
           if (data.sender_id === selectedUser.id) {
             setOtherUserTyping(data.is_typing);
+            if (typingClearRef.current) {
+              clearTimeout(typingClearRef.current);
+            }
             if (data.is_typing) {
-              // Clear typing indicator after 3 seconds
-              setTimeout(() => setOtherUserTyping(false), 3000);
+              // The server sends the stop; this only covers a lost connection
+              typingClearRef.current = setTimeout(() => setOtherUserTyping(false), 15000);
             }
           }
           break;
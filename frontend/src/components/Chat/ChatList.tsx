@@ -34,12 +34,14 @@ interface ChatListProps {
   selectedUserId: number | null;
   onSelectUser: (userId: number, user: User) => void;
   onlineUsers: Set<number>;
+  onChatsLoaded?: (userIds: number[]) => void;
 }
 
 const ChatList: React.FC<ChatListProps> = ({
   selectedUserId,
   onSelectUser,
   onlineUsers,
+  onChatsLoaded,
 }) => {
   const auth = useContext(AuthContext);
   const [chats, setChats] = useState<Chat[]>([]);
@@ -54,6 +56,7 @@ const ChatList: React.FC<ChatListProps> = ({
     try {
       const data = await getChats(auth.token);
       setChats(data);
+      onChatsLoaded?.(data.map((chat: Chat) => chat.user.id));
     } catch (error) {
       console.error("Failed to load chats:", error);
     } finally {
@@ -1,4 +1,6 @@
-import React, { useState } from "react";
+import React, { useState, useEffect, useContext } from "react";
+import { AuthContext } from "../../context/AuthContext";
+import { AttachmentLink, getAttachmentLink } from "../../api/messages";
 
 interface User {
   id: number;
@@ -15,6 +17,9 @@ interface Attachment {
   file_size: number;
   content_type?: string;
   uploaded_at: string;
+  thumbnail_status?: string | null;
+  thumbnail_width?: number | null;
+  thumbnail_height?: number | null;
 }
 
 interface Message {
@@ -44,9 +49,33 @@ const MessageBubble: React.FC<MessageBubbleProps> = ({
   onEdit,
   onDelete,
 }) => {
+  const auth = useContext(AuthContext);
   const [showActions, setShowActions] = useState(false);
   const [isEditing, setIsEditing] = useState(false);
   const [editContent, setEditContent] = useState(message.content);
+  const [links, setLinks] = useState<Record<string, AttachmentLink>>({});
+
+  // <a> and <img> can't send an Authorization header, so fetch signed,
+  // expiring links for the attachments instead of putting the token in URLs
+  useEffect(() => {
+    const token = auth?.token;
+    if (!token || message.is_deleted || message.attachments.length === 0) return;
+    let cancelled = false;
+    Promise.all(
+      message.attachments.map((attachment) =>
+        getAttachmentLink(attachment.filename, token).then(
+          (link) => [attachment.filename, link] as const
+        )
+      )
+    )
+      .then((entries) => {
+        if (!cancelled) setLinks(Object.fromEntries(entries));
+      })
+      .catch((err) => console.error("Failed to load attachment links", err));
+    return () => {
+      cancelled = true;
+    };
+  }, [auth?.token, message.is_deleted, message.attachments]);
 
   const handleEdit = () => {
     if (editContent.trim() !== message.content) {
@@ -70,8 +99,9 @@ const MessageBubble: React.FC<MessageBubbleProps> = ({
     return parseFloat((bytes / Math.pow(k, i)).toFixed(2)) + " " + sizes[i];
   };
 
-  const getAttachmentUrl = (filename: string) => {
-    return `http://localhost:8000/messages/attachments/${filename}`;
+  const getAttachmentUrl = (filename: string, thumbnail = false) => {
+    const link = links[filename];
+    return (thumbnail ? link?.thumbnail_url : link?.url) ?? undefined;
   };
 
   if (message.is_deleted) {
@@ -149,6 +179,23 @@ const MessageBubble: React.FC<MessageBubbleProps> = ({
                       className="flex items-center space-x-2 p-2 bg-white bg-opacity-10 rounded"
                     >
                       <div className="flex-1">
+                        {attachment.thumbnail_status === "ready" &&
+                          getAttachmentUrl(attachment.filename, true) && (
+                          <a
+                            href={getAttachmentUrl(attachment.filename)}
+                            target="_blank"
+                            rel="noopener noreferrer"
+                          >
+                            <img
+                              src={getAttachmentUrl(attachment.filename, true)}
+                              width={attachment.thumbnail_width ?? undefined}
+                              height={attachment.thumbnail_height ?? undefined}
+                              alt={attachment.original_filename}
+                              loading="lazy"
+                              className="max-w-full h-auto rounded mb-1"
+                            />
+                          </a>
+                        )}
                         <a
                           href={getAttachmentUrl(attachment.filename)}
                           target="_blank"
@@ -15,6 +15,7 @@ const MessageInput: React.FC<MessageInputProps> = ({
   const [selectedFiles, setSelectedFiles] = useState<File[]>([]);
   const fileInputRef = useRef<HTMLInputElement>(null);
   const typingTimeoutRef = useRef<ReturnType<typeof setTimeout> | null>(null);
+  const typingSentAtRef = useRef(0);
 
   const handleSubmit = (e: React.FormEvent) => {
     e.preventDefault();
@@ -33,8 +34,10 @@ const MessageInput: React.FC<MessageInputProps> = ({
     const value = e.target.value;
     setMessage(value);
 
-    // Handle typing indicators
-    if (value.trim() && !isTyping) {
+    // Handle typing indicators; while typing, refresh the server's
+    // expiry every few seconds (the server drops the repeated state)
+    if (value.trim() && (!isTyping || Date.now() - typingSentAtRef.current > 3000)) {
+      typingSentAtRef.current = Date.now();
       onTypingChange(true);
     }
 
@@ -19,6 +19,8 @@ const Dashboard = () => {
   const [selectedUser, setSelectedUser] = useState<User | null>(null);
   const [onlineUsers, setOnlineUsers] = useState<Set<number>>(new Set());
   const [wsManager] = useState(() => new WebSocketManager());
+  // Bumped to reload the chat list when missed events can't be replayed
+  const [chatListVersion, setChatListVersion] = useState(0);
 
   useEffect(() => {
     if (auth?.token) {
@@ -42,6 +44,16 @@ const Dashboard = () => {
         setOnlineUsers(new Set(Object.keys(data.users).filter(id => data.users[id]).map(Number)));
         break;
 
+      case "presence":
+        // Batched diff for the users we subscribed to
+        setOnlineUsers(prev => {
+          const newSet = new Set(prev);
+          data.online.forEach((id: number) => newSet.add(id));
+          data.offline.forEach((id: number) => newSet.delete(id));
+          return newSet;
+        });
+        break;
+
       case "user_online":
         setOnlineUsers(prev => new Set([...prev, data.user_id]));
         break;
@@ -54,6 +66,10 @@ const Dashboard = () => {
         });
         break;
 
+      case "full_resync":
+        setChatListVersion(version => version + 1);
+        break;
+
       default:
         // Handle other message types in ChatInterface
         break;
@@ -63,11 +79,8 @@ const Dashboard = () => {
   const handleSelectUser = (userId: number, user: User) => {
     setSelectedUser(user);
 
-    // Request online status for this user
-    wsManager.send({
-      type: "get_online_status",
-      user_ids: [userId],
-    });
+    // Status changes for this user are pushed from now on
+    wsManager.subscribePresence([userId]);
   };
 
   return (
@@ -75,9 +88,11 @@ const Dashboard = () => {
       <Navbar />
       <div className="flex-1 flex overflow-hidden">
         <ChatList
+          key={chatListVersion}
           selectedUserId={selectedUser?.id || null}
           onSelectUser={handleSelectUser}
           onlineUsers={onlineUsers}
+          onChatsLoaded={(userIds) => wsManager.subscribePresence(userIds)}
         />
 
         {selectedUser ? (